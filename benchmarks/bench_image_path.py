@@ -0,0 +1,124 @@
+"""
+单页图像通路微基准：旧 PIL 通路 vs 精简 numpy 通路
+
+旧通路（原 batch_pdf_import.preprocess_image + image_to_base64，已删除，legacy_path 保留其步骤；JPEG 质量 95）：
+    RGB PIL → numpy → BGR → gray → 处理 → PIL('L') → PIL('RGB') → BytesIO → base64 → str
+精简通路（imaging.preprocess_array + array_to_data_url）：
+    灰度 numpy → 原地处理 → cv2.imencode → base64 → data URL
+
+每个通路在独立子进程中运行，分别统计单页 CPU 时间、tracemalloc 峰值（Python/numpy 分配）
+和进程 RSS 峰值增量（包含 PIL/OpenCV 的原生分配）。
+
+用法：
+    python benchmarks/bench_image_path.py [--pages 20] [--width 2480 --height 3508]
+"""
+import argparse
+import base64
+import io
+import multiprocessing as mp
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent.imaging import array_to_data_url, preprocess_array  # noqa: E402
+
+
+def make_page(width: int, height: int) -> np.ndarray:
+    """生成一张模拟报告页（白底黑字 + 轻微噪声）的灰度图"""
+    rng = np.random.default_rng(0)
+    page = np.full((height, width), 250, np.uint8)
+    line_height = max(20, height // 60)
+    scale = line_height / 30
+    for y in range(line_height * 2, height - line_height, line_height):
+        cv2.putText(page, "LVEF 59%  LVEDD 42mm  IVSd 8mm  E/A 0.9", (width // 20, y),
+                    cv2.FONT_HERSHEY_SIMPLEX, scale, 20, max(1, int(scale * 2)))
+    noise = rng.integers(0, 12, page.shape, dtype=np.uint8)
+    return cv2.subtract(page, noise)
+
+
+def legacy_path(rgb_page: Image.Image) -> str:
+    img_array = np.array(rgb_page)
+    img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+    denoised = cv2.medianBlur(gray, 3)
+    _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    kernel = np.ones((2, 2), np.uint8)
+    binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+    processed = Image.fromarray(binary, mode='L').convert('RGB')
+    img_buffer = io.BytesIO()
+    processed.save(img_buffer, format='JPEG', quality=95)
+    img_buffer.seek(0)
+    b64 = base64.b64encode(img_buffer.read()).decode('utf-8')
+    return f"data:image/jpeg;base64,{b64}"
+
+
+def lean_path(gray_page: np.ndarray) -> str:
+    return array_to_data_url(preprocess_array(gray_page))
+
+
+def _run(variant: str, pages: int, width: int, height: int, queue) -> None:
+    gray = make_page(width, height)
+    # 模拟栅格化器的输出：旧通路得到 RGB PIL 图，精简通路直接得到灰度数组
+    page = Image.fromarray(gray).convert('RGB') if variant == "legacy" else gray
+    func = legacy_path if variant == "legacy" else lean_path
+    func(page)  # 预热
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    payload = 0
+    for _ in range(pages):
+        payload = len(func(page))
+    cpu = (time.process_time() - cpu_start) / pages
+    wall = (time.perf_counter() - wall_start) / pages
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({
+        "variant": variant,
+        "cpu_ms": cpu * 1000,
+        "wall_ms": wall * 1000,
+        "traced_peak_mb": peak / 2 ** 20,
+        "rss_growth_mb": (rss_after - rss_before) / 1024,
+        "payload_kb": payload / 1024,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20)
+    # 默认为 A4@300dpi，即旧版 pdf_to_images 的输出尺寸
+    parser.add_argument("--width", type=int, default=2480)
+    parser.add_argument("--height", type=int, default=3508)
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    results = []
+    for variant in ("legacy", "lean"):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run, args=(variant, args.pages, args.width, args.height, queue))
+        proc.start()
+        results.append(queue.get())
+        proc.join()
+
+    print(f"页面尺寸: {args.width}x{args.height}, 每通路 {args.pages} 页")
+    print(f"{'通路':<8}{'CPU ms/页':>12}{'墙钟 ms/页':>12}{'tracemalloc峰值MB':>20}{'RSS增长MB':>12}{'载荷KB':>10}")
+    for r in results:
+        print(f"{r['variant']:<8}{r['cpu_ms']:>12.1f}{r['wall_ms']:>12.1f}"
+              f"{r['traced_peak_mb']:>20.1f}{r['rss_growth_mb']:>12.1f}{r['payload_kb']:>10.0f}")
+    legacy, lean = results
+    print(f"CPU 节省: {(1 - lean['cpu_ms'] / legacy['cpu_ms']) * 100:.0f}%  "
+          f"tracemalloc 峰值节省: {(1 - lean['traced_peak_mb'] / max(legacy['traced_peak_mb'], 1e-9)) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+测量值查询基准：合成 N 份报告的结果 parquet，测量索引构建、增量更新与查询延迟
+
+合成报告与流水线输出的表格同构（名称/英文/类型/症状/数值/单位，检查日期写入 DataFrame.attrs），
+每份报告从常见超声/CTA 测量项中抽取若干项。依次统计：
+    1. 全量构建索引（build_measurement_index）
+    2. 增量更新：新增少量报告（常见情况）、修改少量已有报告（重新处理）
+    3. 典型查询（阈值筛选、时间范围、分布统计、多 metric 列表）在热缓存下的延迟
+
+目标：10 万份报告上单次查询 < 1 秒。
+
+用法：
+    python benchmarks/bench_query.py [--reports 100000] [--rows 25] [--updates 100] [--repeat 5]
+    python benchmarks/bench_query.py --work-dir /tmp/bench_query --keep   # 保留合成的报告，下次运行复用
+"""
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent.query import (build_measurement_index, list_metrics, measurement_distribution,  # noqa: E402
+                                 query_measurements)
+
+# (名称, 英文, 单位, 均值, 标准差)
+METRICS = [
+    ("左心室射血分数(LVEF)", "LV ejection fraction", "%", 58, 10),
+    ("右心室射血分数(RVEF)", "RV ejection fraction", "%", 52, 8),
+    ("左心室舒张末期内径(LVEDD)", "LV end-diastolic diameter", "mm", 48, 6),
+    ("左心室收缩末期内径(LVESD)", "LV end-systolic diameter", "mm", 31, 5),
+    ("室间隔厚度(IVSd)", "Interventricular septum", "mm", 9.5, 1.5),
+    ("左心室后壁厚度(LVPWd)", "LV posterior wall", "mm", 9, 1.4),
+    ("左心房内径(LA)", "Left atrium", "mm", 36, 5),
+    ("左心房容积(LAV)", "LA volume", "ml", 50, 15),
+    ("主动脉根部内径(AO)", "Aortic root", "mm", 31, 3),
+    ("二尖瓣E峰(MV E)", "MV E velocity", "cm/s", 75, 15),
+    ("二尖瓣A峰(MV A)", "MV A velocity", "cm/s", 70, 15),
+    ("二尖瓣E/A比值(MV E/A)", "MV E/A ratio", "", 1.1, 0.4),
+    ("E/e'比值(E/e')", "E/e' ratio", "", 9, 3),
+    ("三尖瓣环收缩期位移(TAPSE)", "TAPSE", "mm", 21, 4),
+    ("肺动脉收缩压(PASP)", "Pulmonary artery systolic pressure", "mmHg", 30, 8),
+    ("右心室收缩压(RVSP)", "RV systolic pressure", "mmHg", 30, 8),
+    ("左心室质量指数(LVMI)", "LV mass index", "g/m2", 95, 20),
+    ("左前降支近段(pLAD)", "Proximal LAD", "%", 35, 25),
+    ("左前降支中段(mLAD)", "Mid LAD", "%", 30, 25),
+    ("左前降支远段(dLAD)", "Distal LAD", "%", 20, 20),
+    ("回旋支近段(pLCX)", "Proximal LCX", "%", 25, 20),
+    ("右冠状动脉近段(pRCA)", "Proximal RCA", "%", 25, 20),
+    ("右冠状动脉中段(mRCA)", "Mid RCA", "%", 22, 20),
+    ("左主干(LM)", "Left main", "%", 15, 15),
+    ("冠状动脉钙化积分(CACS)", "Calcium score", "", 120, 150),
+    ("心率(HR)", "Heart rate", "bpm", 72, 12),
+    ("颈动脉内中膜厚度(IMT)", "Carotid IMT", "mm", 0.8, 0.2),
+    ("下腔静脉内径(IVC)", "IVC diameter", "mm", 17, 4),
+    ("升主动脉内径(AAO)", "Ascending aorta", "mm", 33, 4),
+    ("心包积液深度", "Pericardial effusion", "mm", 3, 3),
+]
+COLUMNS = ["名称", "英文", "类型", "症状", "数值", "单位"]
+
+
+def _write_reports(args) -> None:
+    cache_dir, start, stop, rows = args
+    rng = np.random.default_rng(start)
+    dates = pd.Timestamp("2018-01-01") + pd.to_timedelta(rng.integers(0, 365 * 8, stop - start), unit="D")
+    for offset, case in enumerate(range(start, stop)):
+        picks = rng.choice(len(METRICS), size=min(rows, len(METRICS)), replace=False)
+        records = []
+        for i in picks:
+            name, english, unit, mean, std = METRICS[i]
+            value = max(rng.normal(mean, std), 0)
+            records.append([name, english, "", "", f"{value:.1f}", unit])
+        df = pd.DataFrame(records, columns=COLUMNS)
+        df.attrs["report_date"] = dates[offset].strftime("%Y-%m-%d")
+        df.to_parquet(os.path.join(cache_dir, f"case_{case:07d}.parquet"), index=False)
+
+
+def synthesize(cache_dir: str, reports: int, rows: int, processes: int) -> float:
+    """并行合成缺失的报告文件，返回耗时（秒）"""
+    os.makedirs(cache_dir, exist_ok=True)
+    existing = sum(1 for n in os.listdir(cache_dir) if n.endswith(".parquet"))
+    if existing >= reports:
+        return 0.0
+    chunk = 1000
+    tasks = [(cache_dir, start, min(start + chunk, reports), rows) for start in range(existing, reports, chunk)]
+    t0 = time.perf_counter()
+    with mp.get_context("spawn").Pool(processes) as pool:
+        for i, _ in enumerate(pool.imap_unordered(_write_reports, tasks), 1):
+            print(f"\r合成报告: {min(existing + i * chunk, reports)}/{reports}", end="", flush=True)
+    print()
+    return time.perf_counter() - t0
+
+
+def timed(func, repeat: int):
+    """热缓存下重复执行，返回 (中位耗时秒, 最后一次结果)"""
+    result = func()  # 预热（目录读取、页缓存）
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=100_000)
+    parser.add_argument("--rows", type=int, default=25, help="每份报告的测量项数")
+    parser.add_argument("--updates", type=int, default=100, help="增量更新时新增/修改的报告数")
+    parser.add_argument("--repeat", type=int, default=5, help="每个查询的重复次数（取中位数）")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="合成报告的进程数")
+    parser.add_argument("--work-dir", default=None, help="合成数据目录（默认临时目录）")
+    parser.add_argument("--keep", action="store_true", help="结束后保留合成数据与索引")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="bench_query_")
+    cache_dir = os.path.join(work_dir, "cache")
+    index_dir = os.path.join(work_dir, "_index")
+    try:
+        synth = synthesize(cache_dir, args.reports, args.rows, args.processes)
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+        t0 = time.perf_counter()
+        stats = build_measurement_index(cache_dir, index_dir)
+        build = time.perf_counter() - t0
+
+        # 新增报告：只写一个新分片
+        _write_reports((cache_dir, args.reports, args.reports + args.updates, args.rows))
+        t0 = time.perf_counter()
+        add_stats = build_measurement_index(cache_dir, index_dir)
+        add = time.perf_counter() - t0
+
+        # 修改随机的已有报告（重写文件即更新 mtime）：重写它们所在的分片
+        rng = np.random.default_rng(1)
+        for case in rng.choice(args.reports, size=min(args.updates, args.reports), replace=False):
+            path = os.path.join(cache_dir, f"case_{case:07d}.parquet")
+            df = pd.read_parquet(path)
+            df.to_parquet(path, index=False)
+            os.utime(path, ns=(time.time_ns(), time.time_ns() + 1))
+        t0 = time.perf_counter()
+        update_stats = build_measurement_index(cache_dir, index_dir)
+        update = time.perf_counter() - t0
+        for name in os.listdir(cache_dir):
+            if int(name[len("case_"):-len(".parquet")]) >= args.reports:
+                os.remove(os.path.join(cache_dir, name))  # 新增的报告不保留，--keep 复用时数据不变
+
+        queries = {
+            "LVEF < 40": lambda: query_measurements("LVEF", "<", 40, index_dir=index_dir),
+            "LVEF < 40 (2024 年)": lambda: query_measurements("LVEF", "<", 40, since="2024-01-01",
+                                                              until="2025-01-01", index_dir=index_dir),
+            "LAD 狭窄 >= 70 (fuzzy)": lambda: query_measurements("LAD", ">=", 70, index_dir=index_dir, fuzzy=True),
+            "[LVEDD, LVESD] 全部": lambda: query_measurements(["LVEDD", "LVESD"], index_dir=index_dir),
+            "PASP 分布": lambda: measurement_distribution("PASP", index_dir=index_dir),
+            "测量项目录": lambda: list_metrics(index_dir),
+        }
+        results = {}
+        for label, func in queries.items():
+            seconds, result = timed(func, args.repeat)
+            rows = len(result["histogram"]) if isinstance(result, dict) else len(result)
+            results[label] = (seconds, rows)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\n报告数: {args.reports}  每份测量项: {args.rows}  索引行数: {stats['rows']}  分片: {update_stats['parts']}")
+    if synth:
+        print(f"合成报告: {synth:.1f}s")
+    print(f"全量构建: {build:.2f}s ({args.reports / build:.0f} 报告/秒)")
+    print(f"增量更新：新增 {add_stats['added']} 份 {add:.2f}s，修改 {update_stats['added']} 份 {update:.2f}s")
+    print(f"\n{'查询':<26}{'中位耗时 ms':>12}{'结果行数':>10}")
+    for label, (seconds, rows) in results.items():
+        print(f"{label:<26}{seconds * 1000:>12.1f}{rows:>10}")
+    slowest = max(seconds for seconds, _ in results.values())
+    mark = "✅" if slowest < 1 else "❌"
+    print(f"\n{mark} 最慢查询 {slowest * 1000:.0f} ms（目标 < 1000 ms）")
+
+
+if __name__ == "__main__":
+    main()
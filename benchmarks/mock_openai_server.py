@@ -0,0 +1,396 @@
+"""
+本地 OpenAI 兼容模拟服务（离线基准测试用）
+
+实现 POST {prefix}/chat/completions，根据提示词内容识别调用类型并返回预置响应：
+    ocr / classifier / header / cta_origin / cta_dominance / abnormal / segment /
+    cta_gapfill / us_header / all_measurements / alias / key_pick / other
+每种类型可单独配置延迟分布（对数正态：中位数 + sigma），并可按比例注入 429 与 500 错误。
+响应带 usage 字段（按字符数粗略估算 token），并模拟提供商的前缀缓存：消息文本按
+PREFIX_BLOCK_CHARS 个字符分块，与之前请求相同的最长前缀计入 prompt_tokens_details.cached_tokens。
+GET /stats 返回各类型的请求数、服务耗时与缓存命中 tokens。
+
+用法：
+    python benchmarks/mock_openai_server.py --port 8765 --latency ocr=1.5,segment=0.4 --rate-limit 0.02
+    # 然后 DASHSCOPE_BASE_URL=http://127.0.0.1:8765/v1 DASHSCOPE_API_KEY=mock ...
+
+也可在进程内启动：
+    server = MockOpenAIServer(latency={"ocr": (1.5, 0.3)}, scale=0.1).start()
+    ... server.base_url ...
+    server.stop()
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+# 前缀缓存的分块粒度（字符数），真实服务按 token 块缓存，这里按字符粗略模拟
+PREFIX_BLOCK_CHARS = 256
+
+# 默认延迟：(中位数秒, 对数正态 sigma)，量级参考 DashScope 实测
+DEFAULT_LATENCY: Dict[str, Tuple[float, float]] = {
+    "ocr": (2.5, 0.35),
+    "classifier": (0.8, 0.3),
+    "header": (1.0, 0.3),
+    "cta_origin": (0.9, 0.3),
+    "cta_dominance": (0.9, 0.3),
+    "abnormal": (1.2, 0.3),
+    "segment": (0.7, 0.4),
+    "cta_gapfill": (2.0, 0.3),
+    "us_header": (1.5, 0.3),
+    "all_measurements": (2.5, 0.3),
+    "alias": (0.5, 0.3),
+    "key_pick": (0.5, 0.3),
+    "other": (1.0, 0.3),
+}
+
+CTA_OCR_TEXT = """冠状动脉CTA检查报告
+检查所见：
+冠状动脉钙化积分：LM 12，LAD 86，LCX 0，RCA 35，总积分 133。
+冠状动脉呈右冠优势型。
+左主干管壁可见钙化斑块，管腔轻微狭窄约10%。左前降支近段管壁可见钙化斑块，管腔轻度狭窄约25%；中段管壁可见混合斑块，管腔重度狭窄约85%；远段管壁可见钙化斑块，管腔轻度狭窄约25%。第一，第二对角支未见斑块及明显狭窄。左回旋支中远段管壁可见非钙化斑块，管腔轻度狭窄约25%；近段未见斑块及明显狭窄。
+右冠状动脉近段管壁可见钙化、非钙化斑块，管腔轻度狭窄约25%；中段、远段未见斑块及明显狭窄。
+印象：冠状动脉CTA：左前降支中段管壁混合斑块，管腔重度狭窄。
+注：1.本报告仅供临床科室申请医生诊治参考！
+"""
+
+ULTRASOUND_OCR_TEXT = """超声心动图报告
+姓名：张三 性别：男 年龄：56岁 超声号：U20250101 检查设备：EPIQ 7C 探头频率：1-5MHz 图像质量：良
+测量值：
+主动脉根部内径(AO) 31mm  左心房内径(LA) 36mm  左心室舒张末期内径(LVEDD) 48mm
+左心室收缩末期内径(LVESD) 31mm  室间隔厚度(IVSd) 10mm  左心室后壁厚度(LVPWd) 9mm
+左心室射血分数(LVEF) 62%  E峰 0.72m/s  A峰 0.86m/s  E/A 0.84  e' 7.1cm/s  E/e' 10.1
+肺动脉收缩压(PASP) 28mmHg  三尖瓣环收缩期位移(TAPSE) 21mm
+超声所见：左房稍大，余房室腔内径正常，室间隔与左室后壁厚度正常，左室壁运动协调。
+超声提示：左房稍大；左室舒张功能减低。
+注：本报告仅供临床参考。
+"""
+
+_MEASUREMENT_RE = re.compile(r"([一-鿿A-Za-z/'′]+(?:\([A-Za-z/' ]+\))?)\s*([<>]?\d+(?:\.\d+)?\s*(?:mm|%|m/s|cm/s|mmHg)?)")
+
+
+def classify_prompt(messages: List[Dict[str, Any]]) -> str:
+    """根据最后一条 user 消息识别调用类型"""
+    user = next((m for m in reversed(messages) if m.get("role") == "user"), {})
+    content = user.get("content", "")
+    if isinstance(content, list):
+        if any(isinstance(part, dict) and part.get("type") == "image_url" for part in content):
+            return "ocr"
+        content = " ".join(str(part.get("text", "")) for part in content if isinstance(part, dict))
+    text = str(content)
+    # 报告上下文前缀（-----包围的 OCR 文本）之后才是任务，避免报告正文中的词误判类型
+    if text.count("-----") >= 2 and "**医疗诊断报告：**" in text:
+        text = text.split("-----", 2)[2]
+    rules = [
+        ("主要是关于什么类型的检查", "classifier"),
+        ("**关键信息/指标：**", "header"),
+        ("冠状动脉起源、走形及终止", "cta_origin"),
+        ("冠脉优势型", "cta_dominance"),
+        ("提取“异常描述”", "abnormal"),
+        ("提取冠脉节段", "segment"),
+        ("可能没有包含在以下已知项目中的数据", "cta_gapfill"),
+        ("仅提取心脏超声报告的头部信息", "us_header"),
+        ('抽取所有"测量项目 → 数值"', "all_measurements"),
+        ("下面每一项给出一个 query", "alias_batch"),
+        ("医学术语规范化助手", "alias"),
+        ("医学术语匹配助手", "key_pick"),
+    ]
+    for marker, kind in rules:
+        if marker in text:
+            return kind
+    return "other"
+
+
+def _prompt_text(messages: List[Dict[str, Any]]) -> str:
+    parts = []
+    for m in messages:
+        content = m.get("content", "")
+        if isinstance(content, list):
+            parts.extend(str(p.get("text", "")) for p in content if isinstance(p, dict))
+        else:
+            parts.append(str(content))
+    return "\n".join(parts)
+
+
+def canned_response(kind: str, messages: List[Dict[str, Any]], ocr_report: str = "ultrasound") -> str:
+    """生成与提示词类型对应的预置响应"""
+    text = _prompt_text(messages)
+    if kind == "ocr":
+        return CTA_OCR_TEXT if ocr_report == "cta" else ULTRASOUND_OCR_TEXT
+    if kind == "classifier":
+        # 提示词模板本身同时包含两类关键词，只看报告正文的标题
+        is_cta = "超声心动图" not in text
+        return json.dumps({"report_type": "CTA" if is_cta else "Ultrasound", "confidence": "高",
+                           "reason": "模拟响应"}, ensure_ascii=False)
+    if kind == "header":
+        return json.dumps({"冠状动脉钙化总积分": "133", "LM": "12", "LAD": "86", "LCX": "0", "RCA": "35"},
+                          ensure_ascii=False)
+    if kind == "cta_origin":
+        return json.dumps({"key_name": "冠状动脉起源、走形及终止", "result": "正常", "reason": "模拟"}, ensure_ascii=False)
+    if kind == "cta_dominance":
+        return json.dumps({"key_name": "冠脉优势型", "result": "右冠优势型", "reason": "模拟"}, ensure_ascii=False)
+    if kind == "abnormal":
+        return json.dumps({"key_name": "异常描述", "result": "左前降支中段重度狭窄"}, ensure_ascii=False)
+    if kind == "segment":
+        location = re.search(r'提取冠脉节段"([^"]+)\(名称\)"', text)
+        hit = location and any(k in location.group(1) for k in ("前降支中段", "mLAD"))
+        return json.dumps({"斑块种类": "混合密度斑块" if hit else "-", "类型": "-", "症状": "-",
+                           "数值": "85%" if hit else "-", "狭窄程度": "-", "闭塞": "否"}, ensure_ascii=False)
+    if kind == "cta_gapfill":
+        return json.dumps({"左回旋支中远段": "轻度狭窄约25%"}, ensure_ascii=False)
+    if kind == "us_header":
+        return json.dumps({"姓名": "张三", "性别": "男", "年龄": "56岁", "超声号": "U20250101", "门诊号": "",
+                           "住院号": "", "床号": "", "检查设备": "EPIQ 7C", "检查部位": "心脏", "探头频率": "1-5MHz",
+                           "图像质量": "良", "超声所见": "左房稍大", "超声提示": "左房稍大；左室舒张功能减低。"},
+                          ensure_ascii=False)
+    if kind == "all_measurements":
+        report = text.split("-----")[1] if text.count("-----") >= 2 else text
+        return json.dumps({name.strip(): value.replace(" ", "") for name, value in _MEASUREMENT_RE.findall(report)},
+                          ensure_ascii=False)
+    if kind == "alias":
+        return json.dumps({"match": "no_match"})
+    if kind == "alias_batch":
+        return json.dumps({item_id: "no_match" for item_id in re.findall(r'"id":\s*"([^"]+)"', text)})
+    if kind == "key_pick":
+        key = re.search(r"target_key:\s*(\S+)", text)
+        names = re.search(r"candidate_names \(JSON\):\s*(\[.*\])", text, re.S)
+        match = ""
+        if key and names:
+            try:
+                for name in json.loads(names.group(1)):
+                    if f"({key.group(1)})" in name:
+                        match = name
+                        break
+            except ValueError:
+                pass
+        return json.dumps({"match": match}, ensure_ascii=False)
+    return "{}"
+
+
+def malform_json(content: str) -> str:
+    """模拟常见的格式问题：代码块包裹、尾逗号"""
+    body = content.rstrip()
+    if body.endswith("}"):
+        body = body[:-1].rstrip() + ",}"
+    return f"```json\n{body}\n```"
+
+
+def estimate_tokens(text: str) -> int:
+    # 中文约 1.5 字符/token，足够用于相对比较
+    return max(1, int(len(text) / 1.5))
+
+
+class MockOpenAIServer:
+    """
+    可在进程内启动的模拟服务
+
+    Args:
+        host (str): 监听地址
+        port (int): 端口，0 表示随机
+        latency (Dict[str, Tuple[float, float]]): 覆盖默认延迟 {类型: (中位数秒, sigma)}
+        scale (float): 全部延迟乘以该系数（<1 用于快速测试）
+        rate_limit (float): 返回 429 的比例
+        error_rate (float): 返回 500 的比例
+        malformed_rate (float): JSON 回复被写坏（代码块 + 尾逗号）的比例；请求带 JSON 模式时不写坏
+        ocr_report (str): OCR 返回的报告类型（ultrasound / cta / mixed）
+        seed (int): 随机种子
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 latency: Optional[Dict[str, Tuple[float, float]]] = None, scale: float = 1.0,
+                 rate_limit: float = 0.0, error_rate: float = 0.0, ocr_report: str = "ultrasound",
+                 seed: int = 0, malformed_rate: float = 0.0):
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.scale = scale
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.ocr_report = ocr_report
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ocr_count = 0
+        self._prefixes: set = set()
+        self.stats: Dict[str, Dict[str, Any]] = {}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockOpenAIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = {}
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return json.loads(json.dumps(self.stats))
+
+    def _draw(self) -> Tuple[float, float]:
+        with self._lock:
+            return self._rng.random(), self._rng.random()
+
+    def _malformed(self) -> bool:
+        with self._lock:
+            return self._rng.random() < self.malformed_rate
+
+    def _sample_latency(self, kind: str) -> float:
+        median, sigma = self.latency.get(kind, self.latency["other"])
+        with self._lock:
+            value = self._rng.lognormvariate(0.0, sigma) * median
+        return value * self.scale
+
+    def _cached_prefix(self, text: str) -> str:
+        """返回与之前请求共享的最长分块前缀，并记住本次请求的所有分块前缀"""
+        hashes = [hash(text[:end]) for end in range(PREFIX_BLOCK_CHARS, len(text) + 1, PREFIX_BLOCK_CHARS)]
+        with self._lock:
+            hit = 0
+            for i, h in enumerate(hashes):
+                if h not in self._prefixes:
+                    break
+                hit = i + 1
+            self._prefixes.update(hashes)
+        return text[:hit * PREFIX_BLOCK_CHARS]
+
+    def _record(self, kind: str, status: int, seconds: float, usage: Dict[str, Any]) -> None:
+        with self._lock:
+            s = self.stats.setdefault(kind, {"requests": 0, "errors": 0, "rate_limited": 0, "latencies": [],
+                                             "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+            s["requests"] += 1
+            if status == 429:
+                s["rate_limited"] += 1
+            elif status >= 500:
+                s["errors"] += 1
+            s["latencies"].append(round(seconds, 4))
+            s["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            s["completion_tokens"] += usage.get("completion_tokens", 0)
+            s["cached_tokens"] += usage.get("prompt_tokens_details", {}).get("cached_tokens", 0)
+
+    def _next_ocr_report(self) -> str:
+        if self.ocr_report != "mixed":
+            return self.ocr_report
+        with self._lock:
+            self._ocr_count += 1
+            return "cta" if self._ocr_count % 2 == 0 else "ultrasound"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/stats"):
+                    self._send_json(200, server.snapshot())
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                messages = request.get("messages", [])
+                kind = classify_prompt(messages)
+                delay = server._sample_latency(kind)
+                roll_429, roll_500 = server._draw()
+                start = time.perf_counter()
+
+                if roll_429 < server.rate_limit:
+                    time.sleep(min(delay, 0.05))
+                    server._record(kind, 429, time.perf_counter() - start, {})
+                    self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit_error"}},
+                                    {"Retry-After": "0.2"})
+                    return
+                time.sleep(delay)
+                if roll_500 < server.error_rate:
+                    server._record(kind, 500, time.perf_counter() - start, {})
+                    self._send_json(500, {"error": {"message": "injected error", "type": "server_error"}})
+                    return
+
+                ocr_report = server._next_ocr_report() if kind == "ocr" else server.ocr_report
+                content = canned_response(kind, messages, ocr_report)
+                if kind != "ocr" and not request.get("response_format") and server._malformed():
+                    content = malform_json(content)
+                prompt_text = _prompt_text(messages)
+                usage = {
+                    "prompt_tokens": estimate_tokens(prompt_text),
+                    "completion_tokens": estimate_tokens(content),
+                    "prompt_tokens_details": {"cached_tokens": estimate_tokens(server._cached_prefix(prompt_text))},
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                server._record(kind, 200, time.perf_counter() - start, usage)
+                self._send_json(200, {
+                    "id": f"chatcmpl-mock-{kind}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": usage,
+                })
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def parse_latency(spec: str) -> Dict[str, Tuple[float, float]]:
+    """解析 "ocr=1.5,segment=0.4:0.5" 形式的延迟配置（中位数秒[:sigma]）"""
+    latency = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        kind, value = item.split("=", 1)
+        median, _, sigma = value.partition(":")
+        latency[kind.strip()] = (float(median), float(sigma) if sigma else DEFAULT_LATENCY.get(kind.strip(), (0, 0.3))[1])
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="", help="按类型覆盖延迟，例如 ocr=1.5,segment=0.4:0.5")
+    parser.add_argument("--scale", type=float, default=1.0, help="全部延迟乘以该系数")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="JSON 回复被写坏的比例（未请求 JSON 模式时）")
+    parser.add_argument("--ocr-report", choices=["ultrasound", "cta", "mixed"], default="ultrasound")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(args.host, args.port, parse_latency(args.latency), args.scale,
+                              args.rate_limit, args.error_rate, args.ocr_report, malformed_rate=args.malformed_rate)
+    print(f"🧪 模拟服务已启动: {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+离线端到端吞吐基准
+
+在进程内启动 mock_openai_server，将 DASHSCOPE_BASE_URL 指向它，然后驱动：
+    fill_form  对预置 OCR 文本直接运行 init_llms + fill_form_node
+    jpg        生成模拟报告图片，运行 process_single_jpg_to_parquet（或 --via-batch 时运行
+               batch_process_jpg_directory）
+    pdf        生成模拟报告 PDF，运行 process_single_pdf_to_parquet（需要 poppler）
+输出报告/分钟、单份报告 p50/p95 延迟、每份报告的调用次数（按提示词类型）以及服务端延迟分位数。
+全程不访问网络。
+
+用法：
+    python benchmarks/run_throughput.py --mode fill_form --reports 20 --workers 4 --scale 0.1
+    python benchmarks/run_throughput.py --mode jpg --reports 10 --rate-limit 0.05 --latency ocr=3
+"""
+import argparse
+import contextlib
+import glob
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+SRC_DIR = os.path.join(REPO_DIR, 'src')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(SRC_DIR, 'medical_agent'))
+sys.path.insert(0, SRC_DIR)
+
+from mock_openai_server import CTA_OCR_TEXT, ULTRASOUND_OCR_TEXT, MockOpenAIServer, parse_latency  # noqa: E402
+
+# 基准生成的文件都带此前缀，结束后从导出目录中清理（缓存目录本身指向临时目录）
+BENCH_PREFIX = "bench_"
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def make_report_image(path: str, index: int, report: str) -> None:
+    """生成一张模拟报告图片（内容本身不重要，OCR 由模拟服务返回）"""
+    import cv2
+    import numpy as np
+    page = np.full((1600, 1130), 250, np.uint8)
+    for row, y in enumerate(range(120, 1500, 48)):
+        cv2.putText(page, f"{report.upper()} #{index} line {row} LVEF 6{row % 10}%", (60, y),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, 20, 2)
+    if path.endswith(".pdf"):
+        from PIL import Image
+        Image.fromarray(page).save(path, "PDF", resolution=150)
+    else:
+        cv2.imwrite(path, page)
+
+
+def run_fill_form(index: int, report: str, _: str) -> bool:
+    from agent import AgentState, fill_form_node, init_llms
+    state = init_llms(AgentState())
+    state['context'] = {'ocr': CTA_OCR_TEXT if report == "cta" else ULTRASOUND_OCR_TEXT}
+    state = fill_form_node(state)
+    return 'formatted_table' in state
+
+
+def run_jpg(index: int, report: str, path: str) -> bool:
+    from batch_jpg_import import process_single_jpg_to_parquet
+    return process_single_jpg_to_parquet(path, f"{BENCH_PREFIX}{index:04d}")
+
+
+def run_pdf(index: int, report: str, path: str) -> bool:
+    from batch_pdf_import import process_single_pdf_to_parquet
+    return process_single_pdf_to_parquet(path, f"{BENCH_PREFIX}{index:04d}")
+
+
+RUNNERS: Dict[str, Callable[[int, str, str], bool]] = {
+    "fill_form": run_fill_form,
+    "jpg": run_jpg,
+    "pdf": run_pdf,
+}
+
+
+def cleanup_artifacts() -> None:
+    for path in glob.glob(os.path.join(REPO_DIR, "exports", "test_export", f"*{BENCH_PREFIX}*.xlsx")):
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=sorted(RUNNERS), default="fill_form")
+    parser.add_argument("--reports", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=1, help="并发处理的报告数")
+    parser.add_argument("--concurrency", type=int, default=None, help="LLM_CONCURRENCY（单份报告内的并发调用数）")
+    parser.add_argument("--latency", default="", help="按类型覆盖延迟，例如 ocr=1.5,segment=0.4:0.5")
+    parser.add_argument("--scale", type=float, default=1.0, help="全部延迟乘以该系数")
+    parser.add_argument("--rate-limit", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="JSON 回复被写坏的比例（JSON_MODE=0 时生效）")
+    parser.add_argument("--ocr-report", choices=["ultrasound", "cta", "mixed"], default="mixed")
+    parser.add_argument("--via-batch", action="store_true", help="jpg/pdf 模式下调用批量目录处理函数")
+    parser.add_argument("--verbose", action="store_true", help="显示流水线自身的输出")
+    args = parser.parse_args()
+
+    if args.mode == "pdf" and shutil.which("pdftoppm") is None:
+        print("⚠️ 未安装 poppler（pdftoppm），无法运行 pdf 模式")
+        return
+
+    server = MockOpenAIServer(latency=parse_latency(args.latency), scale=args.scale,
+                              rate_limit=args.rate_limit, error_rate=args.error_rate, malformed_rate=args.malformed_rate,
+                              ocr_report=args.ocr_report).start()
+    # 必须在导入流水线模块之前设置
+    os.environ.update({
+        "DASHSCOPE_BASE_URL": server.base_url,
+        "DASHSCOPE_API_KEY": "mock",
+        # LLM_ENDPOINTS=qwen,baichuan=... 时两个后端都指向 mock 服务
+        "BAICHUAN_BASE_URL": server.base_url,
+        "SHOW_GUI": "0",
+        "DEDUP": "0",
+        "BATCH_FILE_DELAY": "0",
+        "PDF_TEXT_LAYER": "0",
+    })
+    if args.concurrency:
+        os.environ["LLM_CONCURRENCY"] = str(args.concurrency)
+
+    work_dir = tempfile.mkdtemp(prefix="medical_agent_bench_")
+    # 缓存（qwen_cache.parquet、结果 parquet、用量、记录库等）与 OCR 文本都写到临时目录，不覆盖真实缓存
+    os.environ["MEDICAL_AGENT_CACHE_DIR"] = os.path.join(work_dir, "cache")
+    os.environ["OCR_RESULT_DIR"] = os.path.join(work_dir, "OCR_result")
+    os.environ["TRACE_FILE"] = os.path.join(work_dir, "trace.jsonl")
+    # 名称解析记录库每次基准测试从空库开始（首份报告学习，之后的报告复用）
+    os.environ.setdefault("RESOLUTION_DB", os.path.join(work_dir, "resolutions.db"))
+    reports = [("cta" if args.ocr_report == "cta" or (args.ocr_report == "mixed" and i % 2) else "ultrasound")
+               for i in range(args.reports)]
+    paths = [""] * args.reports
+    if args.mode in ("jpg", "pdf"):
+        suffix = ".jpg" if args.mode == "jpg" else ".pdf"
+        paths = [os.path.join(work_dir, f"{BENCH_PREFIX}{i:04d}{suffix}") for i in range(args.reports)]
+        for i, path in enumerate(paths):
+            make_report_image(path, i, reports[i])
+
+    runner = RUNNERS[args.mode]
+    latencies: List[float] = []
+    failures = 0
+
+    def timed(i: int) -> None:
+        nonlocal failures
+        start = time.perf_counter()
+        try:
+            ok = runner(i, reports[i], paths[i])
+        except Exception as e:
+            print(f"❌ 报告 {i} 失败: {e}", file=sys.__stderr__)
+            ok = False
+        latencies.append(time.perf_counter() - start)
+        failures += 0 if ok else 1
+
+    cwd = os.getcwd()
+    os.chdir(REPO_DIR)  # 流水线按仓库根目录解析 data/ 与 exports/ 等相对路径
+    sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    wall_start = time.perf_counter()
+    try:
+        with sink:
+            if args.via_batch and args.mode != "fill_form":
+                if args.mode == "jpg":
+                    from batch_jpg_import import batch_process_jpg_directory as batch
+                else:
+                    from batch_pdf_import import batch_process_pdf_directory as batch
+                result = batch(work_dir)
+                failures = result.get("failed_count", 0)
+            else:
+                with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+                    list(executor.map(timed, range(args.reports)))
+        wall = time.perf_counter() - wall_start
+    finally:
+        os.chdir(cwd)
+        cleanup_artifacts()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        stats = server.snapshot()
+        server.stop()
+
+    total_calls = sum(s["requests"] for s in stats.values())
+    print(f"模式: {args.mode}  报告数: {args.reports}  并发报告: {args.workers}  "
+          f"LLM_CONCURRENCY: {os.environ.get('LLM_CONCURRENCY', '默认')}  延迟系数: {args.scale}")
+    print(f"总耗时: {wall:.2f}s  吞吐: {args.reports / wall * 60:.1f} 报告/分钟  失败: {failures}")
+    if latencies:
+        print(f"单份报告延迟: p50 {percentile(latencies, 50):.2f}s  p95 {percentile(latencies, 95):.2f}s  "
+              f"均值 {statistics.mean(latencies):.2f}s")
+    print(f"每份报告调用次数: {total_calls / max(args.reports, 1):.1f}")
+    prompt_tokens = sum(s["prompt_tokens"] for s in stats.values())
+    cached_tokens = sum(s.get("cached_tokens", 0) for s in stats.values())
+    if prompt_tokens:
+        print(f"前缀缓存命中: {cached_tokens}/{prompt_tokens} prompt tokens ({cached_tokens / prompt_tokens:.0%})")
+    print(f"\n{'类型':<18}{'调用/报告':>10}{'429':>6}{'5xx':>6}{'p50 s':>9}{'p95 s':>9}{'prompt tok/次':>15}{'缓存命中':>10}")
+    for kind, s in sorted(stats.items(), key=lambda kv: -kv[1]["requests"]):
+        ok = max(s["requests"] - s["rate_limited"] - s["errors"], 1)
+        print(f"{kind:<18}{s['requests'] / max(args.reports, 1):>10.1f}{s['rate_limited']:>6}{s['errors']:>6}"
+              f"{percentile(s['latencies'], 50):>9.2f}{percentile(s['latencies'], 95):>9.2f}"
+              f"{s['prompt_tokens'] / ok:>15.0f}{s.get('cached_tokens', 0) / max(s['prompt_tokens'], 1):>10.0%}")
+    from medical_agent.singleflight import flights
+    merged = flights.snapshot()
+    if merged:
+        print("请求合并: " + "，".join(f"{kind} {m['coalesced']}/{m['leaders'] + m['coalesced']}"
+                                     for kind, m in sorted(merged.items())))
+    if os.environ.get("LLM_ENDPOINTS"):
+        from medical_agent.endpoints import print_endpoint_summary
+        print()
+        print_endpoint_summary()
+
+
+if __name__ == "__main__":
+    main()
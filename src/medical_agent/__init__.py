@@ -1,11 +1,4 @@
-from .agent import (
-    build_medical_agent,
-    AgentState,
-    Message,
-    init_llms,
-    create_input_node,
-    create_response_node,
-)
+from importlib import import_module
 
 __version__ = "0.1.0"
 
@@ -16,4 +9,11 @@ __all__ = [
     "init_llms",
     "create_input_node",
     "create_response_node",
-] 
\ No newline at end of file
+]
+
+
+def __getattr__(name):
+    # 按需导入 agent：导入 medical_agent.imaging / medical_agent.query 等子模块时不加载智能体依赖
+    if name in __all__:
+        return getattr(import_module(".agent", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
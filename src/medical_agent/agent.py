@@ -1,21 +1,24 @@
 from typing import List, Dict, Any, TypedDict, Literal, Union
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langgraph.graph import StateGraph
-from pydantic import BaseModel, Field
 import base64
 from pathlib import Path
-from openai import OpenAI
+from medical_agent.clients import LLM_CONCURRENCY, LazyClient, get_client, shared_gpt_llm
 import os
-from medical_agent.utils import call_qwen_vl_api, safe_json_load, end_timer_and_print
+from medical_agent.utils import call_qwen_vl_api, end_timer_and_print
+from medical_agent.tracing import current_span, span, traced, with_context
+from medical_agent.llm import chat_completion, current_ledger, json_completion, report_messages
+from medical_agent.compaction import compact_ocr_text, compaction_enabled
+from medical_agent.cascade import cascade_model
+from medical_agent.endpoints import get_endpoint_pool
 from medical_agent.utils import *
 from medical_agent.table_format import create_formatted_df, ROW_INDEX
 from typing import TypedDict, get_type_hints, Any
-from medical_agent.prompts import FILL_IN_FORM_PROMPT, FILLIN_PROMPT_2, FILLIN_PROMPT_3, FILLIN_PROMPT_4, FILLIN_PROMPT_5, REPORT_CLASSIFIER_PROMPT, ULTRASOUND_EXTRACT_PROMPT
+from medical_agent.prompts import FILL_IN_FORM_PROMPT, FILLIN_PROMPT_2, FILLIN_PROMPT_3, FILLIN_PROMPT_4, FILLIN_PROMPT_5, REPORT_CLASSIFIER_PROMPT, ULTRASOUND_EXTRACT_PROMPT, REPORT_CONTEXT_PROMPT, REPORT_EXCERPT_PROMPT, FILLIN_PROMPT_5_DEFAULT
+from medical_agent.retrieval import ReportIndex, mention_skip_enabled, retrieval_enabled
+from medical_agent.resolutions import catalog_fingerprint, get_resolution_store, normalize_name
+from medical_agent.resolutions import preclean_name as _preclean_name
 import json
 import pandas as pd
-from medical_agent.gui import show_popup_with_df
-from medical_agent.utils import ROOT_DIR
+from medical_agent.utils import ROOT_DIR, extract_report_date
 from rapidfuzz import fuzz, process
 
 # Define message types
@@ -44,7 +47,6 @@ def process_ultrasound_location(location, ocr, qwen, row_index, system_prompt, m
         dynamic_alias_rules = ""
     
     input_prompt = ULTRASOUND_EXTRACT_PROMPT.format(
-        ocr_text=ocr, 
         location=location,
         dynamic_alias_rules=dynamic_alias_rules
     )
@@ -55,15 +57,11 @@ def process_ultrasound_location(location, ocr, qwen, row_index, system_prompt, m
     
     while attempt < max_retries:
         try:
-            completion = qwen.chat.completions.create(
-                model=model_name,
-                messages=[
-                    {'role': 'system', 'content': system_prompt},
-                    {'role': 'user', 'content': input_prompt}
-                ]
+            tmp = json_completion(
+                qwen, model_name,
+                messages=report_messages(system_prompt, ocr, input_prompt),
+                kind="ultrasound_location", prompt="ULTRASOUND_EXTRACT_PROMPT", location=location, retries=attempt
             )
-            text = completion.choices[0].message.content
-            tmp = safe_json_load(text)
             return location, ridx, tmp
         except Exception as e:
             attempt += 1
@@ -281,30 +279,19 @@ def init_llms(state: AgentState):
     """
     state = init_typed_dict(AgentState)
 
-    # OCR 专用客户端 (继续使用 Qwen-VL)
-    state["ocr_client"] = OpenAI(
-        # 若没有配置环境变量，请用百炼API Key将下行替换为：api_key="sk-xxx"
-        api_key=os.getenv('DASHSCOPE_API_KEY'),
-        base_url=os.getenv('DASHSCOPE_BASE_URL', "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"),
-    )
+    # OCR 专用客户端 (继续使用 Qwen-VL)，进程内共享，复用长连接
+    # 若没有配置环境变量，请设置 DASHSCOPE_API_KEY
+    state["ocr_client"] = get_client("qwen")
     
     # 医疗推理专用客户端 (使用本地部署的 Baichuan M2)
-    # 如果本地服务不可用，会自动fallback到OCR客户端
-    baichuan_base_url = os.getenv('BAICHUAN_BASE_URL', 'http://localhost:8000/v1')
-    state["medical_llm"] = OpenAI(
-        api_key=os.getenv('BAICHUAN_API_KEY', 'not-needed'),  # 本地部署通常不需要
-        base_url=baichuan_base_url,
-    )
+    # 主流程暂未使用，首次调用时才创建
+    state["medical_llm"] = LazyClient(lambda: get_client("baichuan"))
     
     # 保留原有的 qwen 客户端作为备选 (向后兼容)
     state["qwen"] = state["ocr_client"]  # 指向OCR客户端，保持兼容性
     
-    # 保留原有的 GPT 客户端
-    state["gpt"] = ChatOpenAI(
-        model="gpt-4o",
-        max_tokens=1024,
-        temperature=0.7
-    )
+    # 保留原有的 GPT 客户端（惰性创建）
+    state["gpt"] = shared_gpt_llm()
 
     state['messages'].append({
         "role": "system",
@@ -323,22 +310,14 @@ def init_llms_for_ocr(state: AgentState):
     """
     state = init_typed_dict(AgentState)
 
-    # OCR 专用客户端 (继续使用 Qwen-VL)
-    state["ocr_client"] = OpenAI(
-        # 若没有配置环境变量，请用百炼API Key将下行替换为：api_key="sk-xxx"
-        api_key=os.getenv('DASHSCOPE_API_KEY'),
-        base_url=os.getenv('DASHSCOPE_BASE_URL', "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"),
-    )
+    # OCR 专用客户端 (继续使用 Qwen-VL)，进程内共享，复用长连接
+    state["ocr_client"] = get_client("qwen")
     
     # 保留原有的 qwen 客户端指向OCR客户端，保持兼容性
     state["qwen"] = state["ocr_client"]
     
-    # 保留原有的 GPT 客户端
-    state["gpt"] = ChatOpenAI(
-        model="gpt-4o",
-        max_tokens=1024,
-        temperature=0.7
-    )
+    # 保留原有的 GPT 客户端（惰性创建）
+    state["gpt"] = shared_gpt_llm()
 
     state['messages'].append({
         "role": "system",
@@ -417,6 +396,7 @@ def create_input_node(state: AgentState):
     return state
 
 
+@traced("ocr")
 def ocr_node(state: AgentState):
     """Create a node for OCR using dedicated OCR client."""
     image_content = state['image_content']
@@ -465,9 +445,11 @@ def ocr_node(state: AgentState):
         """
     else:
         # 使用专门的 OCR 客户端
-        completion = state["ocr_client"].chat.completions.create(
-            model=os.getenv('QWEN_OCR_MODEL', "qwen-vl-ocr"),
-            messages=messages
+        ocr_model = os.getenv('QWEN_OCR_MODEL', "qwen-vl-ocr")
+        completion = chat_completion(
+            state["ocr_client"], ocr_model,
+            messages=messages,
+            kind="ocr"
         )
         text = completion.choices[0].message.content
     
@@ -482,12 +464,25 @@ def ocr_node(state: AgentState):
 def get_medical_llm_client(state: AgentState):
     """
     智能选择文本理解客户端
-    暂时全部使用Qwen，保证稳定性
+    默认使用Qwen；配置了 LLM_ENDPOINTS 时使用多后端池（见 endpoints.py）。
+    模型为快速模型 + QWEN_TEXT_MODEL 的级联（CASCADE=0 时为单个模型）
     """
+    model = cascade_model(os.getenv('QWEN_TEXT_MODEL', "qwen-max-0125"))
+    pool = get_endpoint_pool()
+    if pool is not None:
+        return pool, model
     # 直接使用Qwen客户端，确保稳定性
-    return state["qwen"], os.getenv('QWEN_TEXT_MODEL', "qwen-max-0125")
+    return state["qwen"], model
 
 
+def _report_context_calls(ledger) -> int:
+    """携带完整（压缩后）报告文本的调用次数；摘录、别名复核等不发送全文的调用不计"""
+    if ledger is None:
+        return 0
+    return sum(b["report_calls"] for b in ledger.to_dict()["by_prompt"].values())
+
+
+@traced("fill_form")
 def fill_form_node(state: AgentState):
     """
     智能分流版本的表格填充节点
@@ -502,6 +497,19 @@ def fill_form_node(state: AgentState):
     # 获取基本数据
     ocr = state['context']['ocr']
     formatted_table = state['formatted_table']
+
+    # 压缩OCR文本（去样板、跨页去重），压缩后的文本会进入本报告的每一次请求
+    compaction = None
+    if compaction_enabled():
+        with span("compact") as s:
+            ocr, compaction = compact_ocr_text(ocr)
+            s.set(**compaction)
+        current_span().set(ocr_tokens_saved=compaction["tokens_saved"])
+        print(f"🗜️ OCR文本压缩: {compaction['chars_before']} → {compaction['chars_after']} 字符"
+              f"（样板 {compaction['boilerplate_lines']} 行，重复页眉 {compaction['duplicate_lines']} 行，"
+              f"每次请求约节省 {compaction['tokens_saved']} tokens）")
+    ledger = current_ledger()
+    calls_before = _report_context_calls(ledger)
     row_index = state['row_index']
     
     # 智能选择文本理解客户端
@@ -519,22 +527,17 @@ def fill_form_node(state: AgentState):
     # ==============================================================
     print("📋 正在识别报告类型...")
     
-    classifier_prompt = REPORT_CLASSIFIER_PROMPT.format(ocr_text=ocr)
+    classifier_prompt = REPORT_CLASSIFIER_PROMPT.format()
     try:
-        completion = qwen.chat.completions.create(
-            model=medical_model,
-            messages=[
-                {'role': 'system', 'content': SYSTEM_PROMPT},
-                {'role': 'user', 'content': classifier_prompt}
-            ]
+        classification_result = json_completion(
+            qwen, medical_model,
+            messages=report_messages(SYSTEM_PROMPT, ocr, classifier_prompt),
+            kind="classifier", prompt="REPORT_CLASSIFIER_PROMPT"
         )
-        classifier_text = completion.choices[0].message.content
-        # print(f"分类结果原文: {classifier_text}")
         
-        # 🔍 调试信息：显示分类器原始响应
-        print(f"🔍 分类器原始响应: {classifier_text}")
+        # 🔍 调试信息：显示分类器解析结果
+        print(f"🔍 分类器响应: {classification_result}")
         
-        classification_result = safe_json_load(classifier_text)
         if classification_result and 'report_type' in classification_result:
             report_type = classification_result['report_type']
             confidence = classification_result.get('confidence', '未知')
@@ -549,6 +552,8 @@ def fill_form_node(state: AgentState):
         print(f"❌ 报告类型识别出错: {e}，默认按CTA处理")
         report_type = "CTA"
     
+    current_span().set(report_type=report_type)
+    
     # 初始化top_data
     top_data = {}
     
@@ -571,17 +576,13 @@ def fill_form_node(state: AgentState):
         
         # 提取顶部基本信息
         for row in header_data:
-            input_prompt = FILL_IN_FORM_PROMPT.format(ocr_text=ocr, key_info=row)
+            input_prompt = FILL_IN_FORM_PROMPT.format(key_info=row)
             try:
-                completion = qwen.chat.completions.create(
-                    model=medical_model,
-                    messages=[
-                        {'role': 'system', 'content': SYSTEM_PROMPT},
-                        {'role': 'user', 'content': input_prompt}
-                    ]
+                tmp = json_completion(
+                    qwen, medical_model,
+                    messages=report_messages(SYSTEM_PROMPT, ocr, input_prompt),
+                    kind="cta_header", prompt="FILL_IN_FORM_PROMPT"
                 )
-                text = completion.choices[0].message.content
-                tmp = safe_json_load(text)
                 if tmp is not None:
                     for k in tmp:
                         top_data[k] = tmp[k] if tmp[k] != "NO" else ""
@@ -590,22 +591,18 @@ def fill_form_node(state: AgentState):
         
         # 提取CTA专用的分类信息
         cta_prompts = [
-            FILLIN_PROMPT_2.format(ocr_text=ocr),  # 冠状动脉起源、走形及终止
-            FILLIN_PROMPT_3.format(ocr_text=ocr),  # 冠脉优势型
-            FILLIN_PROMPT_4.format(ocr_text=ocr)   # 异常描述
+            FILLIN_PROMPT_2.format(),  # 冠状动脉起源、走形及终止
+            FILLIN_PROMPT_3.format(),  # 冠脉优势型
+            FILLIN_PROMPT_4.format()   # 异常描述
         ]
         
-        for input_prompt in cta_prompts:
+        for prompt_id, input_prompt in zip(("FILLIN_PROMPT_2", "FILLIN_PROMPT_3", "FILLIN_PROMPT_4"), cta_prompts):
             try:
-                completion = qwen.chat.completions.create(
-                    model=medical_model,
-                    messages=[
-                        {'role': 'system', 'content': SYSTEM_PROMPT},
-                        {'role': 'user', 'content': input_prompt}
-                    ]
+                tmp = json_completion(
+                    qwen, medical_model,
+                    messages=report_messages(SYSTEM_PROMPT, ocr, input_prompt),
+                    kind="cta_category", prompt=prompt_id
                 )
-                text = completion.choices[0].message.content
-                tmp = safe_json_load(text)
                 if tmp is not None and 'key_name' in tmp and 'result' in tmp:
                     top_data[tmp['key_name']] = tmp['result']
             except Exception as e:
@@ -617,14 +614,18 @@ def fill_form_node(state: AgentState):
         import concurrent.futures
         from functools import partial
         
-        def process_location(location, ocr, qwen, row_index, system_prompt, model_name):
+        def process_location(location, ocr, qwen, row_index, system_prompt, model_name, report_index=None):
             """处理单个冠脉节段的函数，用于并行执行"""
             if location not in row_index:
                 return None, None, None
             
             ridx = row_index[location]
             
-            input_prompt = FILLIN_PROMPT_5.format(ocr_text=ocr, location=location)
+            input_prompt = FILLIN_PROMPT_5.format(location=location)
+            # 只发送报告开头和提到该节段的语句
+            context, excerpt = report_index.context_for(location) \
+                if report_index is not None and retrieval_enabled() else (ocr, False)
+            context_prompt = REPORT_EXCERPT_PROMPT if excerpt else REPORT_CONTEXT_PROMPT
             
             # 实现重试机制（指数退避）
             max_retries = 3
@@ -632,15 +633,11 @@ def fill_form_node(state: AgentState):
             
             while attempt < max_retries:
                 try:
-                    completion = qwen.chat.completions.create(
-                        model=model_name,
-                        messages=[
-                            {'role': 'system', 'content': system_prompt},
-                            {'role': 'user', 'content': input_prompt}
-                        ]
+                    tmp = json_completion(
+                        qwen, model_name,
+                        messages=report_messages(system_prompt, context, input_prompt, context_prompt),
+                        kind="segment", prompt="FILLIN_PROMPT_5", location=location, retries=attempt, excerpt=excerpt
                     )
-                    text = completion.choices[0].message.content
-                    tmp = safe_json_load(text)
                     return location, ridx, tmp
                 except Exception as e:
                     attempt += 1
@@ -662,11 +659,32 @@ def fill_form_node(state: AgentState):
             if location in row_index:
                 locations_to_process.append(location)
         
+        # 按节段检索相关语句的索引（知识库别名可选）
+        report_index = None
+        if retrieval_enabled() or mention_skip_enabled():
+            try:
+                from medical_agent.normalizer import load_alias_index
+                alias_index = load_alias_index()
+            except Exception:
+                alias_index = None
+            report_index = ReportIndex(ocr, alias_index)
+
         # 并行处理
-        process_func = partial(process_location, ocr=ocr, qwen=qwen, row_index=row_index, system_prompt=SYSTEM_PROMPT, model_name=medical_model)
+        process_func = partial(process_location, ocr=ocr, qwen=qwen, row_index=row_index, system_prompt=SYSTEM_PROMPT,
+                               model_name=medical_model, report_index=report_index)
         
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            results = list(executor.map(process_func, locations_to_process))
+        # 未提及或仅有阴性描述（“未见斑块及明显狭窄”）的节段直接填默认值，只为有所见的节段调用模型
+        skipped = []
+        if report_index is not None and mention_skip_enabled():
+            skipped = [loc for loc in locations_to_process if report_index.mention_status(loc) != "positive"]
+            locations_to_process = [loc for loc in locations_to_process if loc not in skipped]
+            print(f"⏭️ {len(skipped)} 个节段未提及或仅有阴性描述，不调用模型；{len(locations_to_process)} 个节段需要提取")
+
+        # with_context 让线程池中的调用挂在当前 span 下
+        with span("fill_form.segments", locations=len(locations_to_process), skipped=len(skipped)), \
+                concurrent.futures.ThreadPoolExecutor(max_workers=LLM_CONCURRENCY) as executor:
+            results = list(executor.map(with_context(process_func), locations_to_process))
+        results += [(loc, row_index[loc], dict(FILLIN_PROMPT_5_DEFAULT)) for loc in skipped]
         
         # 更新表格 - 只更新CTA相关的字段
         updatable_columns = ["类型", "症状", "数值", "单位"]
@@ -694,14 +712,11 @@ def fill_form_node(state: AgentState):
         try:
             # 使用通用提取prompt找出可能遗漏的冠脉相关数据
             cta_general_prompt = f"""
-我将给你一段冠脉CTA诊断报告经过OCR提取之后的文本。请从中提取所有具体的冠脉节段信息和测量数值，特别是那些可能没有包含在以下已知项目中的数据：
+**任务：**以上是一份冠脉CTA诊断报告。请从中提取所有具体的冠脉节段信息和测量数值，特别是那些可能没有包含在以下已知项目中的数据：
 
 **已知项目：**
 {', '.join(all_extracted_data.keys())}
 
-**医疗诊断报告：**
-{ocr}
-
 **提取规则：**
 1. 重点关注冠脉节段（如"左主干"、"前降支"、"回旋支"、"右冠"的各个分段）
 2. 提取斑块、狭窄、钙化等相关信息
@@ -718,15 +733,11 @@ def fill_form_node(state: AgentState):
 **只返回JSON，不要输出其他内容。**
 """
             
-            completion = qwen.chat.completions.create(
-                model=medical_model,
-                messages=[
-                    {'role': 'system', 'content': SYSTEM_PROMPT},
-                    {'role': 'user', 'content': cta_general_prompt}
-                ]
+            cta_data = json_completion(
+                qwen, medical_model,
+                messages=report_messages(SYSTEM_PROMPT, ocr, cta_general_prompt),
+                kind="cta_gapfill"
             )
-            cta_data_text = completion.choices[0].message.content
-            cta_data = safe_json_load(cta_data_text)
             
             if cta_data:
                 # 找出未匹配的数据
@@ -782,16 +793,12 @@ def fill_form_node(state: AgentState):
         # 先抽取头部信息（姓名/性别/年龄/设备/所见/提示等），缺失留空
         try:
             from medical_agent.prompts import ULTRASOUND_HEADER_PROMPT
-            header_prompt = ULTRASOUND_HEADER_PROMPT.format(ocr_text=ocr)
-            completion = qwen.chat.completions.create(
-                model=medical_model,
-                messages=[
-                    {'role': 'system', 'content': SYSTEM_PROMPT},
-                    {'role': 'user', 'content': header_prompt}
-                ]
-            )
-            text = completion.choices[0].message.content
-            header_json = safe_json_load(text) or {}
+            header_prompt = ULTRASOUND_HEADER_PROMPT.format()
+            header_json = json_completion(
+                qwen, medical_model,
+                messages=report_messages(SYSTEM_PROMPT, ocr, header_prompt),
+                kind="us_header", prompt="ULTRASOUND_HEADER_PROMPT"
+            ) or {}
             if isinstance(header_json, dict):
                 for k, v in header_json.items():
                     top_data[k] = v or ""
@@ -804,16 +811,12 @@ def fill_form_node(state: AgentState):
         # 保留原有“异常描述”提取作为补充（若 header_json 未给到）
         try:
             if not top_data.get('异常描述'):
-                input_4 = FILLIN_PROMPT_4.format(ocr_text=ocr)
-                completion = qwen.chat.completions.create(
-                    model=medical_model,
-                    messages=[
-                        {'role': 'system', 'content': SYSTEM_PROMPT},
-                        {'role': 'user', 'content': input_4}
-                    ]
+                input_4 = FILLIN_PROMPT_4.format()
+                tmp = json_completion(
+                    qwen, medical_model,
+                    messages=report_messages(SYSTEM_PROMPT, ocr, input_4),
+                    kind="abnormal", prompt="FILLIN_PROMPT_4"
                 )
-                text = completion.choices[0].message.content
-                tmp = safe_json_load(text)
                 if tmp is not None and 'key_name' in tmp and 'result' in tmp:
                     top_data[tmp['key_name']] = tmp['result']
         except Exception as e:
@@ -829,16 +832,12 @@ def fill_form_node(state: AgentState):
         candidates = {}
         try:
             from medical_agent.prompts import ULTRASOUND_ALL_MEASUREMENTS_PROMPT
-            cand_prompt = ULTRASOUND_ALL_MEASUREMENTS_PROMPT.format(ocr_text=ocr)
-            completion = qwen.chat.completions.create(
-                model=medical_model,
-                messages=[
-                    {'role': 'system', 'content': SYSTEM_PROMPT},
-                    {'role': 'user', 'content': cand_prompt}
-                ]
-            )
-            cand_text = completion.choices[0].message.content
-            cand_json = safe_json_load(cand_text) or {}
+            cand_prompt = ULTRASOUND_ALL_MEASUREMENTS_PROMPT.format()
+            cand_json = json_completion(
+                qwen, medical_model,
+                messages=report_messages(SYSTEM_PROMPT, ocr, cand_prompt),
+                kind="all_measurements", prompt="ULTRASOUND_ALL_MEASUREMENTS_PROMPT"
+            ) or {}
             if isinstance(cand_json, dict):
                 candidates = cand_json
         except Exception as e:
@@ -858,15 +857,13 @@ def fill_form_node(state: AgentState):
         
         # 知识库索引
         try:
-            from medical_agent.normalizer import _load_kb, _build_alias_index
-            kb = _load_kb()
-            alias_to_canonical, canonical_meta = _build_alias_index(kb)
+            from medical_agent.normalizer import load_alias_index
+            alias_to_canonical, canonical_meta = load_alias_index()
         except Exception as _e:
             alias_to_canonical, canonical_meta = {}, {}
         
         free_rows = []
         consumed_keys = set()
-        llm_cache: Dict[str, str] = {}
         
         def update_std_row_by_ridx(ridx: int, raw_value: str):
             pure_value, extracted_unit = separate_value_and_unit(str(raw_value))
@@ -877,14 +874,57 @@ def fill_form_node(state: AgentState):
                     if not cur_unit.strip():
                         formatted_table.at[ridx, "单位"] = extracted_unit
         
-        # 阶段1：标准表（精确 -> rapidfuzz -> 灰区Qwen校验）
-        for key, raw_value in candidates.items():
+        def std_row_for(name: str):
+            """标准表名称（或英文名）对应的行号"""
+            ridx = std_name_to_ridx.get(name.lower())
+            # 若直接中文名未命中，再遍历找名称匹配
+            if ridx is None:
+                for i in range(len(formatted_table)):
+                    if str(formatted_table.iloc[i]["名称"]).strip() == name:
+                        return i
+            return ridx
+        
+        # 名称解析记录库：之前报告中的模糊匹配与复核结论直接复用，本报告的新结论最后写回
+        kb_alias_keys = list(alias_to_canonical.keys()) if alias_to_canonical else []
+        store = get_resolution_store()
+        catalog = catalog_fingerprint(std_choices, kb_alias_keys) if store is not None else ""
+        known: Dict[str, Dict[str, Dict[str, Any]]] = {"std": {}, "kb": {}}
+        learned: Dict[str, List[Dict[str, Any]]] = {"std": [], "kb": []}
+        
+        def recall(stage: str, keys):
+            if store is None:
+                return
+            try:
+                known[stage] = store.lookup_many(stage, [normalize_name(k) for k in keys], catalog)
+            except Exception as e:
+                print(f"⚠️ 名称解析记录库查询失败: {e}")
+        
+        def learn(stage: str, key: str, target: str, source: str, score: float):
+            learned[stage].append({"name": normalize_name(key), "target": target, "source": source,
+                                   "confidence": round(score / 100, 3)})
+        
+        # 灰区复核：两个阶段的灰区项先全部收集，整份报告只发一次批量请求（ALIAS_BATCH=0 时逐项请求）
+        gray_items: Dict[str, Dict[str, Any]] = {}
+        
+        def add_gray_item(cache_key: str, query: str, cands: List[Dict[str, Any]]) -> str:
+            if cache_key not in gray_items:
+                gray_items[cache_key] = {"id": f"q{len(gray_items) + 1}", "query": query, "candidates": cands}
+            return cache_key
+        
+        def plan_std(key):
+            """阶段1的判定：("row", 行号) / ("gray", (灰区项, 分数)) / (None, None)"""
             q = _preclean_name(key)
             # exact (大小写不敏感)
             if q.lower() in std_name_to_ridx:
-                update_std_row_by_ridx(std_name_to_ridx[q.lower()], raw_value)
-                consumed_keys.add(key)
-                continue
+                return "row", std_name_to_ridx[q.lower()]
+            # 记录库（目标已不在标准表中时重新判断）
+            record = known["std"].get(normalize_name(key))
+            if record is not None:
+                if not record["target"]:
+                    return None, None
+                ridx = std_row_for(record["target"])
+                if ridx is not None:
+                    return "row", ridx
             # rapidfuzz
             best = process.extractOne(q, std_choices, scorer=fuzz.WRatio)
             if best:
@@ -892,9 +932,8 @@ def fill_form_node(state: AgentState):
                 if score >= 95:
                     ridx = std_name_to_ridx.get(choice.lower())
                     if ridx is not None:
-                        update_std_row_by_ridx(ridx, raw_value)
-                        consumed_keys.add(key)
-                        continue
+                        learn("std", key, str(formatted_table.iloc[ridx]["名称"]).strip(), "fuzzy", score)
+                        return "row", ridx
                 elif 80 <= score < 95:
                     # 灰区：取topK候选交给Qwen复核
                     topk = _rapid_topk(q, std_choices, k=8)
@@ -905,39 +944,30 @@ def fill_form_node(state: AgentState):
                             continue
                         eng = str(formatted_table.iloc[ridx].get("英文", "") or "").strip()
                         cands.append({"exact_name": str(formatted_table.iloc[ridx]["名称"]).strip(), "aliases": [eng] if eng else []})
-                    cache_key = f"std::{q}::{json.dumps(cands, ensure_ascii=False)}"
-                    match = llm_cache.get(cache_key)
-                    if match is None:
-                        match = _ask_qwen_alias(qwen, medical_model, key, cands)
-                        llm_cache[cache_key] = match or ""
-                    if match and match != "no_match":
-                        ridx = std_name_to_ridx.get(match.lower())
-                        # 若直接中文名未命中，再遍历找名称匹配
-                        if ridx is None:
-                            for i in range(len(formatted_table)):
-                                if str(formatted_table.iloc[i]["名称"]).strip() == match:
-                                    ridx = i
-                                    break
-                        if ridx is not None:
-                            update_std_row_by_ridx(ridx, raw_value)
-                            consumed_keys.add(key)
-                            continue
+                    return "gray", (add_gray_item(f"std::{normalize_name(key)}::{json.dumps(cands, ensure_ascii=False)}", key, cands), score)
+                else:
+                    learn("std", key, "", "fuzzy", score)
+            return None, None
         
-        # 阶段2：KB（rapidfuzz -> 灰区Qwen校验） -> 自由行
-        kb_alias_keys = list(alias_to_canonical.keys()) if alias_to_canonical else []
-        for key, raw_value in candidates.items():
-            if key in consumed_keys:
-                continue
+        def plan_kb(key):
+            """阶段2的判定：("canonical", 标准名) / ("gray", (灰区项, 分数)) / (None, None)"""
             q = _preclean_name(key).lower()
-            canonical = ""
             if q in alias_to_canonical:
-                canonical = alias_to_canonical[q]
-            elif kb_alias_keys:
+                return "canonical", alias_to_canonical[q]
+            # 记录库（标准名已不在知识库中时重新判断）
+            record = known["kb"].get(normalize_name(key))
+            if record is not None:
+                if not record["target"]:
+                    return None, None
+                if record["target"] in canonical_meta:
+                    return "canonical", record["target"]
+            if kb_alias_keys:
                 best = process.extractOne(q, kb_alias_keys, scorer=fuzz.WRatio)
                 if best:
                     cand_key, score, _ = best
                     if score >= 90:
-                        canonical = alias_to_canonical[cand_key]
+                        learn("kb", key, alias_to_canonical[cand_key], "fuzzy", score)
+                        return "canonical", alias_to_canonical[cand_key]
                     elif 80 <= score < 90:
                         # 灰区：取topK候选交给Qwen
                         topk = process.extract(q, kb_alias_keys, scorer=fuzz.WRatio, limit=8)
@@ -959,13 +989,53 @@ def fill_form_node(state: AgentState):
                                 aliases.extend(alias_field)
                                 canon_set.append({"exact_name": cn, "aliases": aliases})
                                 seen.add(cn)
-                        cache_key = f"kb::{q}::{json.dumps(canon_set, ensure_ascii=False)}"
-                        match = llm_cache.get(cache_key)
-                        if match is None:
-                            match = _ask_qwen_alias(qwen, medical_model, key, canon_set)
-                            llm_cache[cache_key] = match or ""
-                        if match and match != "no_match":
-                            canonical = match
+                        return "gray", (add_gray_item(f"kb::{normalize_name(key)}::{json.dumps(canon_set, ensure_ascii=False)}", key, canon_set), score)
+                    else:
+                        learn("kb", key, "", "fuzzy", score)
+            return None, None
+        
+        recall("std", candidates)
+        std_plans = {key: plan_std(key) for key in candidates}
+        # 标准表灰区项的知识库判定也提前计算，与其一起复核（标准表复核命中时不使用）
+        kb_keys = [key for key, (decision, _) in std_plans.items() if decision != "row"]
+        recall("kb", kb_keys)
+        kb_plans = {key: plan_kb(key) for key in kb_keys}
+        answers = _ask_qwen_alias_batch(qwen, medical_model, list(gray_items.values())) if gray_items else {}
+        gray_match = {cache_key: answers.get(item["id"], "") for cache_key, item in gray_items.items()}
+        
+        # 阶段1：标准表（精确 -> rapidfuzz -> 灰区Qwen校验）
+        for key, raw_value in candidates.items():
+            decision, value = std_plans[key]
+            if decision == "row":
+                update_std_row_by_ridx(value, raw_value)
+                consumed_keys.add(key)
+            elif decision == "gray":
+                cache_key, score = value
+                match = gray_match[cache_key]
+                ridx = std_row_for(match) if match and match != "no_match" else None
+                if ridx is not None:
+                    update_std_row_by_ridx(ridx, raw_value)
+                    consumed_keys.add(key)
+                # 复核失败（没有明确回答）时不记录
+                if match:
+                    learn("std", key, str(formatted_table.iloc[ridx]["名称"]).strip() if ridx is not None else "",
+                          "llm", score)
+        
+        # 阶段2：KB（rapidfuzz -> 灰区Qwen校验） -> 自由行
+        for key, raw_value in candidates.items():
+            if key in consumed_keys:
+                continue
+            decision, value = kb_plans[key]
+            canonical = ""
+            if decision == "canonical":
+                canonical = value
+            elif decision == "gray":
+                cache_key, score = value
+                match = gray_match[cache_key]
+                if match and match != "no_match":
+                    canonical = match
+                if match:
+                    learn("kb", key, canonical, "llm", score)
             
             if canonical:
                 meta = canonical_meta.get(canonical, {})
@@ -985,6 +1055,15 @@ def fill_form_node(state: AgentState):
                 })
                 consumed_keys.add(key)
         
+        if store is not None:
+            try:
+                for stage in ("std", "kb"):
+                    store.record_many(stage, learned[stage], catalog)
+                print(f"🗂️ 名称解析记录库: 复用 {len(known['std']) + len(known['kb'])} 条，"
+                      f"新增/更新 {len(learned['std']) + len(learned['kb'])} 条")
+            except Exception as e:
+                print(f"⚠️ 名称解析记录库写入失败: {e}")
+        
         # 阶段3：兜底自由行
         for key, raw_value in candidates.items():
             if key in consumed_keys:
@@ -1026,7 +1105,8 @@ def fill_form_node(state: AgentState):
     try:
         # 在保存前进行基于知识库的归一化
         from medical_agent.normalizer import normalize_table_with_kb
-        formatted_table = normalize_table_with_kb(formatted_table)
+        with span("fill_form.normalize"):
+            formatted_table = normalize_table_with_kb(formatted_table)
     except Exception as _e:
         # 归一化失败不影响主流程
         print(f"⚠️ 归一化步骤跳过: {_e}")
@@ -1061,15 +1141,14 @@ def fill_form_node(state: AgentState):
                     target_key=key,
                     candidate_names_json=_json.dumps(candidate_names, ensure_ascii=False)
                 )
-                completion = qwen.chat.completions.create(
-                    model=medical_model,
+                res = json_completion(
+                    qwen, medical_model,
                     messages=[
                         {'role': 'system', 'content': SYSTEM_PROMPT},
                         {'role': 'user', 'content': payload}
-                    ]
-                )
-                text = completion.choices[0].message.content
-                res = safe_json_load(text) or {}
+                    ],
+                    kind="key_pick", prompt="ULTRASOUND_KEY_NAME_PICK_PROMPT", target_key=key
+                ) or {}
                 match_name = ""
                 if isinstance(res, dict):
                     match_name = str(res.get("match", "") or "").strip()
@@ -1084,14 +1163,32 @@ def fill_form_node(state: AgentState):
     except Exception as _e:
         print(f"⚠️ 顶部关键测量值回填失败: {_e}")
 
-    save_df_to_cache(formatted_table, "qwen_cache")
+    with span("fill_form.save"):
+        # 检查日期随结果保存（parquet 元数据），跨报告查询按它筛选时间范围（见 query）
+        report_date = extract_report_date(state['context']['ocr'])
+        if report_date:
+            formatted_table.attrs["report_date"] = report_date
+        else:
+            formatted_table.attrs.pop("report_date", None)
+        save_df_to_cache(formatted_table, "qwen_cache")
 
-    # 加载并显示结果
-    df = load_df_from_cache("qwen_cache")
+        # 加载并显示结果
+        df = load_df_from_cache("qwen_cache")
     state['context']['df'] = df
     
-    print("🎯 显示结果...")
-    show_popup_with_df(df, top_data)
+    if gui_enabled():
+        print("🎯 显示结果...")
+        # GUI 仅在需要显示时才导入（tkinter 在无显示环境的主机上无法使用）
+        from medical_agent.gui import show_popup_with_df
+        show_popup_with_df(df, top_data)
+    else:
+        print("ℹ️ 未启用GUI（SHOW_GUI=0 或无显示环境），跳过结果弹窗")
+
+    if compaction and compaction["tokens_saved"] and ledger is not None:
+        # 按携带完整报告文本的调用次数估算总节省量
+        calls = _report_context_calls(ledger) - calls_before
+        current_span().set(ocr_tokens_saved_total=compaction["tokens_saved"] * calls)
+        print(f"🗜️ 本报告 {calls} 次模型调用，OCR压缩共节省约 {compaction['tokens_saved'] * calls} tokens")
 
     print("✨ 智能结构化提取完成！")
     return state
@@ -1137,17 +1234,6 @@ def show_results(state: AgentState):
         print("No response from the agent.")
     return state
 
-def _preclean_name(text: str) -> str:
-    import re
-    if not text:
-        return ""
-    s = str(text)
-    s = re.sub(r"[\(（][^\)）]*[\)）]", "", s)
-    s = re.sub(r"[%：:，,。·/\\]+", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-
 def _rapid_topk(query: str, choices: List[str], k: int = 10) -> List[tuple]:
     if not choices:
         return []
@@ -1161,23 +1247,66 @@ def _ask_qwen_alias(qwen_client, model_name: str, query: str, candidates: List[D
             query=query,
             candidates_json=json.dumps(candidates, ensure_ascii=False)
         )
-        completion = qwen_client.chat.completions.create(
-            model=model_name,
+        res = json_completion(
+            qwen_client, model_name,
             messages=[
                 {'role': 'system', 'content': SYSTEM_PROMPT},
                 {'role': 'user', 'content': payload}
-            ]
-        )
-        text = completion.choices[0].message.content
-        res = safe_json_load(text) or {}
+            ],
+            kind="alias", prompt="ALIAS_VALIDATION_PROMPT"
+        ) or {}
         match = res.get("match", "") if isinstance(res, dict) else ""
         return str(match)
     except Exception:
         return ""
 
+def _ask_qwen_alias_batch(qwen_client, model_name: str, items: List[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    批量复核灰区别名：一份报告的所有灰区项一次请求
+
+    Args:
+        qwen_client: 文本理解客户端
+        model_name (str): 模型
+        items (List[Dict]): 每项 {"id", "query", "candidates": [{"exact_name", "aliases"}]}
+
+    Returns:
+        Dict[str, str]: id → 选中的 exact_name 或 "no_match"；请求失败、缺少该 id 或回答不在该项候选中时为 ""
+    """
+    def checked(item, match):
+        match = str(match or "").strip()
+        return match if match == "no_match" or match in {c["exact_name"] for c in item["candidates"]} else ""
+
+    if os.getenv('ALIAS_BATCH', '1') == '0':
+        return {item["id"]: checked(item, _ask_qwen_alias(qwen_client, model_name, item["query"], item["candidates"]))
+                for item in items}
+    from medical_agent.prompts import ALIAS_BATCH_VALIDATION_PROMPT
+    batch_size = max(1, int(os.getenv('ALIAS_BATCH_SIZE', 40)))
+    answers = {}
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        try:
+            payload = ALIAS_BATCH_VALIDATION_PROMPT.format(items_json=json.dumps(chunk, ensure_ascii=False))
+            res = json_completion(
+                qwen_client, model_name,
+                messages=[
+                    {'role': 'system', 'content': SYSTEM_PROMPT},
+                    {'role': 'user', 'content': payload}
+                ],
+                kind="alias_batch", prompt="ALIAS_BATCH_VALIDATION_PROMPT", items=len(chunk)
+            ) or {}
+        except Exception as e:
+            print(f"⚠️ 批量别名校验失败: {e}")
+            res = {}
+        for item in chunk:
+            answers[item["id"]] = checked(item, res.get(item["id"]) if isinstance(res, dict) else "")
+    return answers
+
+
 # Build the complete agent
 def build_medical_agent():
     """Build a simplified medical agent with a single node."""
+    # LangGraph 仅在构建图时才导入，批量处理入口不需要加载
+    from langgraph.graph import StateGraph
     
     graph = StateGraph(AgentState)
     
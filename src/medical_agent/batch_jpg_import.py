@@ -3,25 +3,33 @@ import base64
 from pathlib import Path
 from dotenv import load_dotenv
 from PIL import Image
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 import glob
 import pandas as pd
-from agent import build_medical_agent, AgentState, init_llms, ocr_node, fill_form_node
+from agent import AgentState, init_llms, ocr_node, fill_form_node
 from utils import save_df_to_cache, load_df_from_cache, save_ocr_result, start_timer, end_timer_and_print
-from gui import show_popup_with_df
 import json
 import time
+from medical_agent.imaging import load_image_file_base64, build_image_content
+from medical_agent.clients import connection_stats
+from medical_agent.endpoints import print_endpoint_summary
+from medical_agent.tracing import print_trace_summary, span
+from medical_agent.llm import print_usage_summary, save_usage, usage_scope
+from medical_agent.dedup import (plan_deduplicated_batch, link_group_duplicates, link_confirmed_duplicate,
+                                 linked_result, record_result, record_text)
 
 # Load environment variables
 load_dotenv()
 
-def process_single_jpg_to_parquet(image_path: str, output_name: str = None) -> bool:
+def process_single_jpg_to_parquet(image_path: str, output_name: str = None,
+                                  near_duplicates: Optional[List[Tuple[str, int]]] = None) -> bool:
     """
     处理单张 JPG 图片并保存结果到独立的 parquet 文件
     
     Args:
         image_path (str): 图片文件路径
         output_name (str): 输出文件名（不含扩展名），如果为None则使用图片文件名
+        near_duplicates (List[Tuple[str, int]]): 版面近似的已有结果 [(输出名, 页距离)]，OCR 文本确认相同时链接，不再结构化
         
     Returns:
         bool: 处理是否成功
@@ -42,17 +50,11 @@ def process_single_jpg_to_parquet(image_path: str, output_name: str = None) -> b
         if output_name is None:
             output_name = img_file.stem  # 获取不含扩展名的文件名
         
-        # 读取并编码图片
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+        # 读取并编码图片（超出OCR模型像素预算时先缩小）
+        base64_image, mime = load_image_file_base64(image_path)
             
-        # 创建图片内容格式
-        image_content = {
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:image/jpeg;base64,{base64_image}"
-            }
-        }
+        # 创建图片内容格式（附带OCR模型像素预算）
+        image_content = build_image_content(base64_image, mime)
         
         # 创建初始状态
         initial_state = AgentState()
@@ -90,6 +92,10 @@ def process_single_jpg_to_parquet(image_path: str, output_name: str = None) -> b
             # 保存OCR结果
             ocr_text = state['context']['ocr']
             save_ocr_result(ocr_text, output_name or img_file.stem, "jpg")
+            record_text(output_name, ocr_text)
+            if link_confirmed_duplicate(image_path, output_name, ocr_text, near_duplicates):
+                end_timer_and_print(start_time, img_file.name, "单个JPG")
+                return True
             
             print(f"✅ {img_file.name} OCR完成")
             
@@ -100,22 +106,23 @@ def process_single_jpg_to_parquet(image_path: str, output_name: str = None) -> b
             if 'formatted_table' in state:
                 df = state['formatted_table']
                 
-                # 保存parquet文件
-                save_df_to_cache(df, output_name)
+                with span("export", output=output_name):
+                    # 保存parquet文件
+                    save_df_to_cache(df, output_name)
                 
-                # 同时导出xlsx文件到exports目录
-                export_dir = Path("exports/test_export")
-                export_dir.mkdir(parents=True, exist_ok=True)
-                xlsx_path = export_dir / f"{output_name}.xlsx"
+                    # 同时导出xlsx文件到exports目录
+                    export_dir = Path("exports/test_export")
+                    export_dir.mkdir(parents=True, exist_ok=True)
+                    xlsx_path = export_dir / f"{output_name}.xlsx"
                 
-                try:
-                    df.to_excel(xlsx_path, index=False, engine='openpyxl')
-                    print(f"✅ {img_file.name} 结构化完成，结果已保存到:")
-                    print(f"   - Parquet: {output_name}.parquet")
-                    print(f"   - Excel: {xlsx_path}")
-                except Exception as e:
-                    print(f"⚠️ Excel导出失败: {e}")
-                    print(f"✅ {img_file.name} 结构化完成，结果已保存到 {output_name}.parquet")
+                    try:
+                        df.to_excel(xlsx_path, index=False, engine='openpyxl')
+                        print(f"✅ {img_file.name} 结构化完成，结果已保存到:")
+                        print(f"   - Parquet: {output_name}.parquet")
+                        print(f"   - Excel: {xlsx_path}")
+                    except Exception as e:
+                        print(f"⚠️ Excel导出失败: {e}")
+                        print(f"✅ {img_file.name} 结构化完成，结果已保存到 {output_name}.parquet")
                 
                 end_timer_and_print(start_time, img_file.name, "单个JPG")
                 return True
@@ -173,30 +180,56 @@ def batch_process_jpg_directory(input_dir: str, output_dir: str = None) -> Dict[
         "total_files": len(jpg_files),
         "success_files": [],
         "failed_files": [],
+        "duplicate_files": [],
         "success_count": 0,
         "failed_count": 0
     }
     
+    # 重复文件检测：每组只处理一个代表文件，其余链接到代表文件的结果
+    output_name_for = lambda path: f"patient_{Path(path).stem}"
+    groups = plan_deduplicated_batch(jpg_files, output_name_for)
+    
     # 批量处理每个文件
-    for i, jpg_file in enumerate(jpg_files, 1):
-        file_name = Path(jpg_file).name
-        print(f"\n📝 [{i}/{len(jpg_files)}] 处理: {file_name}")
+    with span("batch", kind="jpg", input_dir=str(input_dir), files=len(jpg_files)) as batch_span, \
+            usage_scope() as batch_usage:
+        for i, group in enumerate(groups, 1):
+            jpg_file = group["representative"]
+            file_name = Path(jpg_file).name
+            print(f"\n📝 [{i}/{len(groups)}] 处理: {file_name}")
         
-        # 生成输出文件名（避免重名）
-        output_name = f"patient_{Path(jpg_file).stem}"
+            # 与此前批次已处理的文件重复，直接复用其结果
+            if group["reuse"]:
+                print(f"♻️ {file_name} 与已处理结果 {group['reuse']} 重复，跳过 OCR 与结构化")
+                results["duplicate_files"].extend(
+                    link_group_duplicates(group, group["reuse"], output_name_for, include_representative=True))
+                continue
         
-        # 处理单个文件（时间统计已在函数内部处理）
-        success = process_single_jpg_to_parquet(jpg_file, output_name)
+            # 生成输出文件名（避免重名）
+            output_name = group["output_name"]
         
-        if success:
-            results["success_files"].append(file_name)
-            results["success_count"] += 1
-        else:
-            results["failed_files"].append(file_name)
-            results["failed_count"] += 1
+            # 处理单个文件（时间统计已在函数内部处理）
+            with span("file", file=file_name) as file_span, usage_scope() as usage:
+                success = process_single_jpg_to_parquet(jpg_file, output_name, group["near_duplicates"])
+                file_span.set(ok=success, **usage.totals())
+            save_usage(usage, output_name)
         
-        # 短暂延迟，避免API调用过快
-        time.sleep(1)
+            # 版面近似且 OCR 文本确认相同时已链接到已有结果，组内其余文件也链接过去
+            linked = linked_result(output_name) if success and group["near_duplicates"] else None
+            if linked:
+                results["duplicate_files"].append(file_name)
+                results["duplicate_files"].extend(link_group_duplicates(group, linked, output_name_for))
+                record_result(group["content_hash"], linked)
+            elif success:
+                results["success_files"].append(file_name)
+                results["success_count"] += 1
+                record_result(group["content_hash"], output_name, group["page_hashes"])
+                results["duplicate_files"].extend(link_group_duplicates(group, output_name, output_name_for))
+            else:
+                results["failed_files"].append(file_name)
+                results["failed_count"] += 1
+        
+            # 短暂延迟，避免API调用过快
+            time.sleep(float(os.getenv('BATCH_FILE_DELAY', 1)))
     
     # 输出处理结果
     print("\n" + "=" * 50)
@@ -204,6 +237,13 @@ def batch_process_jpg_directory(input_dir: str, output_dir: str = None) -> Dict[
     print(f"   总文件数: {results['total_files']}")
     print(f"   成功处理: {results['success_count']}")
     print(f"   处理失败: {results['failed_count']}")
+    print(f"   重复跳过: {len(results['duplicate_files'])}")
+    for client_name, stats in connection_stats().items():
+        print(f"   连接复用({client_name}): {stats['reused']}/{stats['requests']} 次请求复用已有连接")
+    print_endpoint_summary()
+    results["usage"] = batch_usage.to_dict()
+    print_usage_summary(batch_usage, results['success_count'] + results['failed_count'])
+    print_trace_summary(batch_span.trace_id)
     
     if results["success_files"]:
         print("\n✅ 成功处理的文件:")
@@ -215,6 +255,11 @@ def batch_process_jpg_directory(input_dir: str, output_dir: str = None) -> Dict[
         for file_name in results["failed_files"]:
             print(f"   - {file_name}")
     
+    if results["duplicate_files"]:
+        print("\n🔗 重复文件（已链接到代表结果，见 cache/dedup.db 的 links 表）:")
+        for file_name in results["duplicate_files"]:
+            print(f"   - {file_name}")
+    
     print(f"\n💾 结果文件保存在:")
     print(f"   - Parquet: src/medical_agent/cache/")
     print(f"   - Excel: exports/test_export/")
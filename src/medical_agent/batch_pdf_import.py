@@ -1,123 +1,34 @@
 import os
-import base64
 from pathlib import Path
 from dotenv import load_dotenv
-from PIL import Image
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 import glob
 import pandas as pd
-from pdf2image import convert_from_path
-from agent import build_medical_agent, AgentState, init_llms, ocr_node, fill_form_node
+from agent import AgentState, init_llms, ocr_node, fill_form_node
 from utils import save_df_to_cache, load_df_from_cache, save_ocr_result, start_timer, end_timer_and_print
-from gui import show_popup_with_df
 import json
 import time
-import cv2
-import numpy as np
+from medical_agent.pdf_text import usable_text_layer_pages
+from medical_agent.pdf_ocr import ocr_pdf_pages
+from medical_agent.clients import connection_stats
+from medical_agent.endpoints import print_endpoint_summary
+from medical_agent.tracing import print_trace_summary, span
+from medical_agent.llm import print_usage_summary, save_usage, usage_scope
+from medical_agent.dedup import (plan_deduplicated_batch, link_group_duplicates, link_confirmed_duplicate,
+                                 linked_result, record_result, record_text)
 
 # Load environment variables
 load_dotenv()
 
-def preprocess_image(image: Image.Image) -> Image.Image:
-    """
-    图像预处理：灰度化、去噪、二值化，提高OCR识别准确率
-    
-    Args:
-        image (Image.Image): 原始图片
-        
-    Returns:
-        Image.Image: 处理后的图片
-    """
-    try:
-        # PIL Image 转 OpenCV 格式 (numpy array)
-        img_array = np.array(image)
-        
-        # 如果是RGB图像，转换为BGR格式（OpenCV标准）
-        if img_array.ndim == 3 and img_array.shape[2] == 3:
-            img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-        elif img_array.ndim == 3 and img_array.shape[2] == 4:
-            # 如果是RGBA，先转RGB再转BGR
-            img_rgb = cv2.cvtColor(img_array, cv2.COLOR_RGBA2RGB)
-            img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
-        else:
-            # 如果已经是灰度图，转为BGR
-            img_bgr = cv2.cvtColor(img_array, cv2.COLOR_GRAY2BGR)
-        
-        # 1. 灰度化
-        gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
-        
-        # 2. 去噪 - 使用中值滤波去除椒盐噪声
-        denoised = cv2.medianBlur(gray, 3)
-        
-        # 3. 二值化 - 使用Otsu's方法自动选择阈值
-        _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
-        # 4. 形态学操作去除小噪点
-        kernel = np.ones((2, 2), np.uint8)
-        binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-        
-        # 将处理后的图像转回PIL Image格式
-        processed_image = Image.fromarray(binary, mode='L')  # 'L'表示灰度模式
-        
-        # 转回RGB模式以保持与原有流程一致
-        processed_image = processed_image.convert('RGB')
-        
-        return processed_image
-        
-    except Exception as e:
-        print(f"⚠️ 图像预处理出错: {e}，使用原始图像")
-        # 如果预处理出错，返回原图
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        return image
-
-def pdf_to_images(pdf_path: str, dpi: int = 300) -> List[Image.Image]:
-    """
-    将PDF文件转换为图片列表
-    
-    Args:
-        pdf_path (str): PDF文件路径
-        dpi (int): 转换分辨率，默认300
-        
-    Returns:
-        List[Image.Image]: 图片列表
-    """
-    try:
-        images = convert_from_path(pdf_path, dpi=dpi)
-        print(f"✅ 成功将PDF转换为{len(images)}页图片")
-        return images
-    except Exception as e:
-        print(f"❌ PDF转换失败: {e}")
-        return []
-
-def image_to_base64(image: Image.Image) -> str:
-    """
-    将PIL图片转换为base64字符串
-    
-    Args:
-        image (Image.Image): PIL图片对象
-        
-    Returns:
-        str: base64编码的图片字符串
-    """
-    import io
-    
-    # 将图片保存到内存中的BytesIO对象
-    img_buffer = io.BytesIO()
-    image.save(img_buffer, format='JPEG', quality=95)
-    img_buffer.seek(0)
-    
-    # 转换为base64
-    img_base64 = base64.b64encode(img_buffer.read()).decode('utf-8')
-    return img_base64
-
-def process_single_pdf_to_parquet(pdf_path: str, output_name: str = None) -> bool:
+def process_single_pdf_to_parquet(pdf_path: str, output_name: str = None,
+                                  near_duplicates: Optional[List[Tuple[str, int]]] = None) -> bool:
     """
     处理单个 PDF 文件并保存结果到独立的 parquet 文件
     
     Args:
         pdf_path (str): PDF文件路径
         output_name (str): 输出文件名（不含扩展名），如果为None则使用PDF文件名
+        near_duplicates (List[Tuple[str, int]]): 版面近似的已有结果 [(输出名, 页距离)]，OCR 文本确认相同时链接，不再结构化
         
     Returns:
         bool: 处理是否成功
@@ -147,78 +58,13 @@ def process_single_pdf_to_parquet(pdf_path: str, output_name: str = None) -> boo
         if output_name is None:
             output_name = pdf_file.stem  # 获取不含扩展名的文件名
         
-        # 1. PDF转图片
-        images = pdf_to_images(pdf_path)
-        if not images:
-            end_timer_and_print(start_time, pdf_file.name, "单个PDF")
-            return False
-        
-        # 2. 图像预处理
-        processed_images = []
-        for i, img in enumerate(images):
-            processed_img = preprocess_image(img)
-            processed_images.append(processed_img)
-            print(f"✅ 预处理完成第{i+1}页")
-        
-        # 收集所有页面的OCR文本
-        all_ocr_texts = []
-        
-        for i, image in enumerate(processed_images):
-            print(f"正在处理第{i+1}页...")
-            
-            # 转换图片为base64
-            base64_image = image_to_base64(image)
-            
-            # 创建图片内容格式
-            image_content = {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{base64_image}"
-                }
-            }
-            
-            # 创建初始状态
-            initial_state = AgentState()
-            initial_state['image_content'] = image_content
-            initial_state['context'] = {
-                'process_start_time': start_time,
-                'current_file_name': pdf_file.name,
-                'file_type': "单个PDF"
-            }
-            
-            try:
-                # 只运行到OCR节点，获取文本
-                # 我们需要手动调用agent的各个节点
-                from agent import init_llms_for_ocr, ocr_node
-                
-                # 初始化（OCR专用，不创建表格）
-                state = init_llms_for_ocr(initial_state)
-                state['image_content'] = image_content
-                
-                # 设置OCR所需的messages格式
-                state['messages'] = [
-                    {
-                        "role": "user",
-                        "content": [
-                            image_content,
-                            {"type": "text", "text": "Read all the text in the image"},
-                        ],
-                    }
-                ]
-                
-                # 运行OCR (不设置DEBUG模式，真实调用API)
-                state = ocr_node(state)
-                
-                # 获取OCR结果
-                if 'context' in state and 'ocr' in state['context']:
-                    ocr_text = state['context']['ocr']
-                    all_ocr_texts.append(f"=== 第{i+1}页 ===\n{ocr_text}")
-                    print(f"✅ 第{i+1}页OCR完成")
-                else:
-                    print(f"⚠️ 第{i+1}页OCR未获取到文本")
-                    
-            except Exception as e:
-                print(f"❌ 处理第{i+1}页时出错: {e}")
+        # 0. 数字PDF：文字层完整可用时直接使用，跳过栅格化与OCR
+        with span("text_layer", file=pdf_file.name) as s:
+            all_ocr_texts = usable_text_layer_pages(pdf_path)
+            s.set(used=bool(all_ocr_texts))
+        if not all_ocr_texts:
+            # 1-2. 栅格化、预处理分诊并逐页OCR
+            all_ocr_texts = ocr_pdf_pages(pdf_path, pdf_file.name, initial_state['context'])
         
         # 4. 合并所有页面的OCR文本
         if all_ocr_texts:
@@ -227,6 +73,10 @@ def process_single_pdf_to_parquet(pdf_path: str, output_name: str = None) -> boo
             
             # 保存OCR结果
             save_ocr_result(combined_text, output_name or pdf_file.stem, "pdf")
+            record_text(output_name, combined_text)
+            if link_confirmed_duplicate(pdf_path, output_name, combined_text, near_duplicates):
+                end_timer_and_print(start_time, pdf_file.name, "单个PDF")
+                return True
             
             # 5. 对合并后的文本进行结构化提取
             print("开始结构化提取...")
@@ -252,22 +102,23 @@ def process_single_pdf_to_parquet(pdf_path: str, output_name: str = None) -> boo
                 if 'formatted_table' in final_state:
                     df = final_state['formatted_table']
                     
-                    # 保存parquet文件
-                    save_df_to_cache(df, output_name)
+                    with span("export", output=output_name):
+                        # 保存parquet文件
+                        save_df_to_cache(df, output_name)
                     
-                    # 同时导出xlsx文件到exports目录
-                    export_dir = Path("exports/test_export")
-                    export_dir.mkdir(parents=True, exist_ok=True)
-                    xlsx_path = export_dir / f"{output_name}.xlsx"
+                        # 同时导出xlsx文件到exports目录
+                        export_dir = Path("exports/test_export")
+                        export_dir.mkdir(parents=True, exist_ok=True)
+                        xlsx_path = export_dir / f"{output_name}.xlsx"
                     
-                    try:
-                        df.to_excel(xlsx_path, index=False, engine='openpyxl')
-                        print(f"✅ {pdf_file.name} 结构化完成，结果已保存到:")
-                        print(f"   - Parquet: {output_name}.parquet")
-                        print(f"   - Excel: {xlsx_path}")
-                    except Exception as e:
-                        print(f"⚠️ Excel导出失败: {e}")
-                        print(f"✅ {pdf_file.name} 结构化完成，结果已保存到 {output_name}.parquet")
+                        try:
+                            df.to_excel(xlsx_path, index=False, engine='openpyxl')
+                            print(f"✅ {pdf_file.name} 结构化完成，结果已保存到:")
+                            print(f"   - Parquet: {output_name}.parquet")
+                            print(f"   - Excel: {xlsx_path}")
+                        except Exception as e:
+                            print(f"⚠️ Excel导出失败: {e}")
+                            print(f"✅ {pdf_file.name} 结构化完成，结果已保存到 {output_name}.parquet")
                     
                     end_timer_and_print(start_time, pdf_file.name, "单个PDF")
                     return True
@@ -329,30 +180,56 @@ def batch_process_pdf_directory(input_dir: str, output_dir: str = None) -> Dict[
         "total_files": len(pdf_files),
         "success_files": [],
         "failed_files": [],
+        "duplicate_files": [],
         "success_count": 0,
         "failed_count": 0
     }
     
+    # 重复文件检测：每组只处理一个代表文件，其余链接到代表文件的结果
+    output_name_for = lambda path: f"patient_pdf_{Path(path).stem}"
+    groups = plan_deduplicated_batch(pdf_files, output_name_for)
+    
     # 批量处理每个文件
-    for i, pdf_file in enumerate(pdf_files, 1):
-        file_name = Path(pdf_file).name
-        print(f"\n📝 [{i}/{len(pdf_files)}] 处理: {file_name}")
+    with span("batch", kind="pdf", input_dir=str(input_dir), files=len(pdf_files)) as batch_span, \
+            usage_scope() as batch_usage:
+        for i, group in enumerate(groups, 1):
+            pdf_file = group["representative"]
+            file_name = Path(pdf_file).name
+            print(f"\n📝 [{i}/{len(groups)}] 处理: {file_name}")
         
-        # 生成输出文件名（避免重名）
-        output_name = f"patient_pdf_{Path(pdf_file).stem}"
+            # 与此前批次已处理的文件重复，直接复用其结果
+            if group["reuse"]:
+                print(f"♻️ {file_name} 与已处理结果 {group['reuse']} 重复，跳过 OCR 与结构化")
+                results["duplicate_files"].extend(
+                    link_group_duplicates(group, group["reuse"], output_name_for, include_representative=True))
+                continue
         
-        # 处理单个文件
-        success = process_single_pdf_to_parquet(pdf_file, output_name)
+            # 生成输出文件名（避免重名）
+            output_name = group["output_name"]
         
-        if success:
-            results["success_files"].append(file_name)
-            results["success_count"] += 1
-        else:
-            results["failed_files"].append(file_name)
-            results["failed_count"] += 1
+            # 处理单个文件
+            with span("file", file=file_name) as file_span, usage_scope() as usage:
+                success = process_single_pdf_to_parquet(pdf_file, output_name, group["near_duplicates"])
+                file_span.set(ok=success, **usage.totals())
+            save_usage(usage, output_name)
+        
+            # 版面近似且 OCR 文本确认相同时已链接到已有结果，组内其余文件也链接过去
+            linked = linked_result(output_name) if success and group["near_duplicates"] else None
+            if linked:
+                results["duplicate_files"].append(file_name)
+                results["duplicate_files"].extend(link_group_duplicates(group, linked, output_name_for))
+                record_result(group["content_hash"], linked)
+            elif success:
+                results["success_files"].append(file_name)
+                results["success_count"] += 1
+                record_result(group["content_hash"], output_name, group["page_hashes"])
+                results["duplicate_files"].extend(link_group_duplicates(group, output_name, output_name_for))
+            else:
+                results["failed_files"].append(file_name)
+                results["failed_count"] += 1
         
-        # 短暂延迟，避免API调用过快
-        time.sleep(2)  # PDF处理通常更复杂，增加延迟
+            # 短暂延迟，避免API调用过快
+            time.sleep(float(os.getenv('BATCH_FILE_DELAY', 2)))  # PDF处理通常更复杂，增加延迟
     
     # 输出处理结果
     print("\n" + "=" * 50)
@@ -360,6 +237,13 @@ def batch_process_pdf_directory(input_dir: str, output_dir: str = None) -> Dict[
     print(f"   总文件数: {results['total_files']}")
     print(f"   成功处理: {results['success_count']}")
     print(f"   处理失败: {results['failed_count']}")
+    print(f"   重复跳过: {len(results['duplicate_files'])}")
+    for client_name, stats in connection_stats().items():
+        print(f"   连接复用({client_name}): {stats['reused']}/{stats['requests']} 次请求复用已有连接")
+    print_endpoint_summary()
+    results["usage"] = batch_usage.to_dict()
+    print_usage_summary(batch_usage, results['success_count'] + results['failed_count'])
+    print_trace_summary(batch_span.trace_id)
     
     if results["success_files"]:
         print("\n✅ 成功处理的文件:")
@@ -371,6 +255,11 @@ def batch_process_pdf_directory(input_dir: str, output_dir: str = None) -> Dict[
         for file_name in results["failed_files"]:
             print(f"   - {file_name}")
     
+    if results["duplicate_files"]:
+        print("\n🔗 重复文件（已链接到代表结果，见 cache/dedup.db 的 links 表）:")
+        for file_name in results["duplicate_files"]:
+            print(f"   - {file_name}")
+    
     print(f"\n💾 结果文件保存在:")
     print(f"   - Parquet: src/medical_agent/cache/")
     print(f"   - Excel: exports/test_export/")
@@ -0,0 +1,142 @@
+"""
+模型级联：先用快速模型，结果不合格时升级到大模型
+
+get_medical_llm_client() 通过 cascade_model() 返回 ModelCascade 代替单个模型名；chat_completion() 收到 ModelCascade 时
+先用 QWEN_FAST_MODEL 调用，按提示词类型校验返回的 JSON（字段、取值范围、置信度），
+调用失败或校验不通过时再用 QWEN_TEXT_MODEL 调用一次。每种提示词类型的升级次数记入用量账本。
+
+    CASCADE=0               关闭级联，所有调用直接使用 QWEN_TEXT_MODEL
+    QWEN_FAST_MODEL         快速模型，默认 qwen-turbo
+    CASCADE_KINDS           先走快速模型的提示词类型（逗号分隔），默认为下面有校验规则的全部类型
+"""
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from medical_agent.retrieval import ReportIndex
+from medical_agent.structured import parse_response
+
+_SEGMENT_FIELDS = ("斑块种类", "类型", "症状", "数值", "狭窄程度", "闭塞")
+# 斑块种类的合法取值（FILLIN_PROMPT_5 的选项及其常见简写），整体精确匹配
+_PLAQUE_TYPES = {
+    "-", "软斑块", "非钙化", "非钙化斑块", "非钙化性斑块", "软斑块（非钙化性斑块）",
+    "混合", "混合斑块", "混合密度斑块", "硬斑块", "钙化", "钙化斑块", "钙化性斑块", "硬斑块（钙化性斑块）",
+}
+_DEFAULT_VALUES = ("-", "否")
+# 报告上下文（REPORT_CONTEXT_PROMPT / REPORT_EXCERPT_PROMPT 中两条分隔线之间）与提取的项目名称
+_REPORT_RE = re.compile(r"-----\n(.*?)\n-----", re.DOTALL)
+_LOCATION_RE = re.compile(r'(?:冠脉节段|测量项目)"([^"]+?)(?:\(名称\))?"')
+
+
+def cascade_enabled() -> bool:
+    return os.getenv('CASCADE', '1') != '0'
+
+
+def _user_text(messages: List[Dict[str, Any]]) -> str:
+    return "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "user")
+
+
+def _check_classifier(result: Any, messages) -> bool:
+    # 快速模型只在高置信度时采纳
+    return isinstance(result, dict) and result.get("report_type") in ("CTA", "Ultrasound") \
+        and result.get("confidence") == "高"
+
+
+def _has_findings(messages) -> bool:
+    """提示中的报告上下文对所提取的节段 / 项目有阳性所见"""
+    text = _user_text(messages)
+    report, location = _REPORT_RE.search(text), _LOCATION_RE.search(text)
+    if not report or not location:
+        return False
+    return ReportIndex(report.group(1)).mention_status(location.group(1)) == "positive"
+
+
+def _check_segment(result: Any, messages) -> bool:
+    if not isinstance(result, dict) or not all(field in result for field in _SEGMENT_FIELDS):
+        return False
+    values = {field: "-" if result[field] is None else str(result[field]).strip() for field in _SEGMENT_FIELDS}
+    plaque = values["斑块种类"].replace("(", "（").replace(")", "）").replace(" ", "")
+    if values["闭塞"] not in ("是", "否", "-") or plaque not in _PLAQUE_TYPES:
+        return False
+    # 上下文有阳性所见时，全部为默认值的结果视为漏检，交给大模型
+    return not (all(v in _DEFAULT_VALUES for v in values.values()) and _has_findings(messages))
+
+
+def _check_key_result(result: Any, messages) -> bool:
+    return isinstance(result, dict) and "key_name" in result and "result" in result
+
+
+def _check_non_empty_dict(result: Any, messages) -> bool:
+    return isinstance(result, dict) and bool(result)
+
+
+def _check_pick(result: Any, messages) -> bool:
+    # 只能原样返回候选中的名称；快速模型“没有匹配”时交给大模型再判断一次
+    if not isinstance(result, dict):
+        return False
+    match = str(result.get("match") or "")
+    return bool(match) and match != "no_match" and f'"{match}"' in _user_text(messages)
+
+
+# 提示词类型 → 校验函数 (解析后的 JSON, messages) -> 是否采纳快速模型的结果
+VALIDATORS: Dict[str, Callable[[Any, List[Dict[str, Any]]], bool]] = {
+    "classifier": _check_classifier,
+    "segment": _check_segment,
+    "ultrasound_location": _check_segment,
+    "cta_category": _check_key_result,
+    "abnormal": _check_key_result,
+    "cta_header": _check_non_empty_dict,
+    "us_header": _check_non_empty_dict,
+    "all_measurements": _check_non_empty_dict,
+    "cta_gapfill": _check_non_empty_dict,
+    "key_pick": _check_pick,
+    "alias": _check_pick,
+}
+
+
+class ModelCascade:
+    """快速模型 + 大模型；str() 为 "快速模型 → 大模型"，便于日志打印"""
+
+    def __init__(self, fast: str, strong: str, kinds: Optional[List[str]] = None):
+        self.fast = fast
+        self.strong = strong
+        self.kinds = set(kinds) if kinds is not None else set(VALIDATORS)
+
+    def routes(self, kind: str, client: Any = None) -> bool:
+        """该类型是否先走快速模型；后端池把两个模型映射到相同的后端模型时升级只会重复调用，不走级联"""
+        if kind not in self.kinds or kind not in VALIDATORS or self.fast == self.strong:
+            return False
+        backend_models = getattr(client, "backend_models", None)
+        return backend_models is None or backend_models(self.fast) != backend_models(self.strong)
+
+    def accept(self, kind: str, completion: Any, messages: List[Dict[str, Any]]) -> bool:
+        """快速模型的结果是否可以直接采纳"""
+        try:
+            text = completion.choices[0].message.content
+        except (AttributeError, IndexError):
+            return False
+        # 本地修复后合格的结果同样采纳，不必升级
+        data, status = parse_response(text or "", kind)
+        return status in ("ok", "repaired") and VALIDATORS[kind](data, messages)
+
+    def __str__(self) -> str:
+        return f"{self.fast} → {self.strong}"
+
+
+def cascade_model(strong: str) -> Any:
+    """
+    文本理解使用的模型
+
+    Args:
+        strong (str): 大模型名称（QWEN_TEXT_MODEL）
+
+    Returns:
+        ModelCascade 或 str: 关闭级联时直接返回大模型名称
+    """
+    if not cascade_enabled():
+        return strong
+    kinds = os.getenv('CASCADE_KINDS')
+    return ModelCascade(
+        os.getenv('QWEN_FAST_MODEL', "qwen-turbo"), strong,
+        [k.strip() for k in kinds.split(",") if k.strip()] if kinds else None,
+    )
@@ -0,0 +1,204 @@
+"""
+进程级共享 API 客户端
+
+init_llms / init_llms_for_ocr 在每个文件、每个 PDF 页面都会被调用。这里为每个后端只创建一个
+OpenAI 客户端，底层 httpx 连接池按配置的并发数保持长连接，避免每次调用都重新握手 TLS；
+很少用到的客户端（GPT、Baichuan）包装为惰性代理，首次真正调用时才创建。
+
+连接复用情况可以通过 connection_stats() 查看：每个请求计一次 requests，
+每次新建 TCP 连接计一次 new_connections（基于 httpx 的 trace 扩展）。
+"""
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional
+
+import httpx
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+# 同一后端允许的最大并发请求数（同时决定 CTA 分段并行提取的线程数）
+LLM_CONCURRENCY = int(os.getenv('LLM_CONCURRENCY', 3))
+# 为对冲请求（见 hedging）额外保留的连接数，也是同时未结束的对冲请求上限
+HEDGE_CONNECTIONS = int(os.getenv('HEDGE_CONNECTIONS', 2))
+# 空闲长连接保留时间（秒）
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 60))
+
+# 后端配置：名称 → (API Key 环境变量, Base URL 环境变量, 默认 Base URL, 默认 API Key)
+CLIENT_CONFIGS = {
+    # OCR 与文本理解 (Qwen，DashScope 兼容接口)
+    "qwen": ('DASHSCOPE_API_KEY', 'DASHSCOPE_BASE_URL',
+             "https://dashscope-intl.aliyuncs.com/compatible-mode/v1", None),
+    # 医疗推理 (本地部署的 Baichuan M2，本地部署通常不需要 API Key)
+    "baichuan": ('BAICHUAN_API_KEY', 'BAICHUAN_BASE_URL', 'http://localhost:8000/v1', 'not-needed'),
+}
+
+
+class ConnectionStats:
+    """单个后端的请求数与新建连接数（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def record_connection(self) -> None:
+        with self._lock:
+            self.new_connections += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            requests, connections = self.requests, self.new_connections
+        reused = max(requests - connections, 0)
+        return {
+            "requests": requests,
+            "new_connections": connections,
+            "reused": reused,
+            "reuse_ratio": round(reused / requests, 3) if requests else 0.0,
+        }
+
+
+class _TracingTransport(httpx.HTTPTransport):
+    """在每个请求上挂载 trace 回调，统计新建的 TCP 连接"""
+
+    def __init__(self, stats: ConnectionStats, **kwargs):
+        super().__init__(**kwargs)
+        self._stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self._stats.record_request()
+        previous = request.extensions.get("trace")
+
+        def trace(event_name: str, info: Dict[str, Any]) -> None:
+            if event_name == "connection.connect_tcp.complete":
+                self._stats.record_connection()
+            if previous is not None:
+                previous(event_name, info)
+
+        request.extensions = {**request.extensions, "trace": trace}
+        return super().handle_request(request)
+
+
+_clients: Dict[str, "OpenAI"] = {}
+_stats: Dict[str, ConnectionStats] = {}
+_lock = threading.Lock()
+_owner_pid = os.getpid()
+
+
+def _reset_after_fork() -> None:
+    # 连接池不能跨进程共享：子进程中丢弃父进程的客户端，按需重新创建
+    global _owner_pid
+    if os.getpid() != _owner_pid:
+        _clients.clear()
+        _stats.clear()
+        _owner_pid = os.getpid()
+
+
+def build_http_client(stats: ConnectionStats, concurrency: int = LLM_CONCURRENCY) -> httpx.Client:
+    """创建连接池大小与并发数匹配的 httpx 客户端"""
+    from openai import DefaultHttpxClient
+    limits = httpx.Limits(
+        max_connections=max(concurrency, 1) + HEDGE_CONNECTIONS,
+        max_keepalive_connections=max(concurrency, 1) + HEDGE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    return DefaultHttpxClient(transport=_TracingTransport(stats, limits=limits))
+
+
+def get_client(name: str) -> "OpenAI":
+    """
+    获取指定后端的共享 OpenAI 客户端（首次调用时创建）
+
+    Args:
+        name (str): CLIENT_CONFIGS 中的后端名称
+
+    Returns:
+        OpenAI: 进程内共享的客户端
+    """
+    with _lock:
+        _reset_after_fork()
+        client = _clients.get(name)
+        if client is None:
+            if name not in CLIENT_CONFIGS:
+                raise KeyError(f"未知的客户端: {name}")
+            # openai SDK 导入较慢，首次创建客户端时才导入
+            from openai import OpenAI
+            key_env, url_env, default_url, default_key = CLIENT_CONFIGS[name]
+            stats = _stats.setdefault(name, ConnectionStats())
+            client = OpenAI(
+                api_key=os.getenv(key_env, default_key),
+                base_url=os.getenv(url_env, default_url),
+                http_client=build_http_client(stats),
+            )
+            _clients[name] = client
+        return client
+
+
+def get_gpt_llm():
+    """GPT 客户端（langchain ChatOpenAI），仅在实际调用时创建"""
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model="gpt-4o",
+        max_tokens=1024,
+        temperature=0.7
+    )
+
+
+class LazyClient:
+    """惰性代理：首次访问属性时才调用 factory 创建真实客户端"""
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, name: str):
+        return getattr(self._get(), name)
+
+    def __repr__(self) -> str:
+        state = "已创建" if self._instance is not None else "未创建"
+        return f"<LazyClient {getattr(self._factory, '__name__', self._factory)} ({state})>"
+
+
+_gpt_llm = LazyClient(get_gpt_llm)
+
+
+def shared_gpt_llm() -> LazyClient:
+    """进程内共享的 GPT 惰性代理"""
+    return _gpt_llm
+
+
+def connection_stats(name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    连接复用统计
+
+    Args:
+        name (str): 后端名称，为 None 时返回全部后端
+
+    Returns:
+        Dict[str, Any]: {后端: {"requests", "new_connections", "reused", "reuse_ratio"}}
+    """
+    with _lock:
+        items = dict(_stats)
+    if name is not None:
+        return items[name].snapshot() if name in items else ConnectionStats().snapshot()
+    return {key: stats.snapshot() for key, stats in items.items()}
+
+
+def close_clients() -> None:
+    """关闭全部共享客户端的连接池"""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -0,0 +1,159 @@
+"""
+OCR 文本压缩
+
+OCR 文本会原样拼进同一份报告的每一次提取请求（分类、头部信息、55 个冠脉节段……），
+其中的每个多余字符都要乘以请求次数。fill_form_node 在提取之前先做压缩：
+    1. 全角字母/数字/符号转半角（保留中文标点），统一空白、去掉零宽字符
+    2. 多页报告中，后续页页眉/页脚处与前面页面重复的行（医院抬头、患者信息行）只保留第一次
+    3. 删除样板行：分页标记、“本报告仅供临床参考”类页脚、二维码说明、报告时间戳、空签名行
+样板规则可用 OCR_BOILERPLATE_FILE 指向的文本文件追加（每行一个正则，# 开头为注释），
+OCR_COMPACTION=0 关闭压缩。
+"""
+import math
+import os
+import re
+from typing import Dict, List, Tuple
+
+# 每页开头/结尾多少行视为页眉/页脚区域，参与跨页去重
+COMPACTION_EDGE_LINES = int(os.getenv('COMPACTION_EDGE_LINES', 6))
+OCR_BOILERPLATE_FILE = os.getenv('OCR_BOILERPLATE_FILE', '')
+
+# 与 OCR / 文字层通路生成的分页标记一致："=== 第N页 ==="
+_PAGE_MARKER_RE = re.compile(r"^=+\s*第\s*\d+\s*页\s*=+$")
+
+DEFAULT_BOILERPLATE_PATTERNS = [
+    r"^=+\s*第\s*\d+\s*页\s*=+$",                          # 分页标记
+    r"^第\s*\d+\s*页(\s*[/，,]?\s*共\s*\d+\s*页)?$",         # 页码
+    r"^(注[:：])?\s*(\d+[.、．])?\s*(本|此)报告仅供",          # 注：1.本报告仅供临床科室申请医生诊治参考！
+    r"二维码|扫码查看",                                     # 二维码链接图像，请妥善保存本报告！
+    r"^(报告|打印|审核)(时间|日期)[:：]\s*[\d\-/.: ]*$",      # 报告时间：2022-09-08 17:19:39
+    r"^(报告|审核|记录|诊断)(医师|医生)[:：]?\s*$",           # 未签名的签名栏
+]
+
+# 中文标点保留全角，其余全角 ASCII（！到～）转半角
+_KEEP_FULL_WIDTH = set("，：；（）！？")
+_HALF_WIDTH = {code: code - 0xFEE0 for code in range(0xFF01, 0xFF5F) if chr(code) not in _KEEP_FULL_WIDTH}
+_HALF_WIDTH.update({
+    0x3000: ord(" "),                                  # 全角空格
+    0x00A0: ord(" "),
+    0x200B: None, 0x200C: None, 0x200D: None, 0xFEFF: None,  # 零宽字符
+    0x339C: "mm", 0x339D: "cm", 0x33A1: "m²", 0x2103: "℃",
+})
+
+
+def compaction_enabled() -> bool:
+    return os.getenv('OCR_COMPACTION', '1') != '0'
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数（中文报告约 1.5 字符 / token）"""
+    return math.ceil(len(text) / 1.5)
+
+
+def load_boilerplate_patterns(path: str = None) -> List[re.Pattern]:
+    """
+    读取样板规则：内置规则 + OCR_BOILERPLATE_FILE 中的自定义正则
+
+    Args:
+        path (str): 自定义规则文件，默认 OCR_BOILERPLATE_FILE
+
+    Returns:
+        List[re.Pattern]: 编译后的规则（对去掉首尾空白的整行做 search）
+    """
+    patterns = list(DEFAULT_BOILERPLATE_PATTERNS)
+    path = path if path is not None else OCR_BOILERPLATE_FILE
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                patterns.extend(line.strip() for line in f if line.strip() and not line.lstrip().startswith("#"))
+        except OSError as e:
+            print(f"⚠️ 读取样板规则失败: {e}")
+    compiled = []
+    for pattern in patterns:
+        try:
+            compiled.append(re.compile(pattern))
+        except re.error as e:
+            print(f"⚠️ 忽略无效的样板规则 {pattern!r}: {e}")
+    return compiled
+
+
+def normalize_line(line: str) -> str:
+    """全角转半角、统一空白；版面对齐用的连续空格保留为两个，以免相邻两列粘连"""
+    line = line.translate(_HALF_WIDTH).replace("\t", "  ")
+    line = re.sub(r" {2,}", "  ", line)
+    return line.strip()
+
+
+def _split_pages(lines: List[str]) -> List[List[str]]:
+    pages: List[List[str]] = [[]]
+    for line in lines:
+        if _PAGE_MARKER_RE.match(line):
+            if pages[-1]:
+                pages.append([])
+            continue
+        pages[-1].append(line)
+    return [page for page in pages if page]
+
+
+def _dedupe_page_edges(pages: List[List[str]], edge: int) -> Tuple[List[List[str]], int]:
+    """后续页页眉/页脚区域中已在前面页面出现过的行删除，返回 (页面, 删除行数)"""
+    seen = set()
+    removed = 0
+    result = []
+    for page in pages:
+        content = [i for i, line in enumerate(page) if line]
+        edges = set(content[:edge] + content[-edge:]) if edge > 0 else set()
+        kept = []
+        for i, line in enumerate(page):
+            if i in edges and line in seen:
+                removed += 1
+                continue
+            kept.append(line)
+        seen.update(line for line in page if line)
+        result.append(kept)
+    return result, removed
+
+
+def compact_ocr_text(text: str, patterns: List[re.Pattern] = None) -> Tuple[str, Dict[str, int]]:
+    """
+    压缩 OCR 文本
+
+    Args:
+        text (str): OCR 文本（多页时包含 "=== 第N页 ===" 分页标记）
+        patterns (List[re.Pattern]): 样板规则，默认 load_boilerplate_patterns()
+
+    Returns:
+        Tuple[str, Dict[str, int]]: (压缩后的文本, 统计)
+            统计包含 chars_before / chars_after / boilerplate_lines / duplicate_lines / tokens_saved（每次请求）
+    """
+    patterns = load_boilerplate_patterns() if patterns is None else patterns
+    lines = [normalize_line(line) for line in (text or "").splitlines()]
+    pages, duplicates = _dedupe_page_edges(_split_pages(lines), COMPACTION_EDGE_LINES)
+
+    kept: List[str] = []
+    boilerplate = 0
+    for page in pages:
+        if kept and kept[-1]:
+            kept.append("")
+        for line in page:
+            if line and any(p.search(line) for p in patterns):
+                boilerplate += 1
+                continue
+            # 连续空行只保留一个
+            if not line and (not kept or not kept[-1]):
+                continue
+            kept.append(line)
+    compacted = "\n".join(kept).strip()
+
+    # 压缩后没有剩下内容（规则配置过宽）时退回原文，宁可多花 tokens 也不丢信息
+    if not compacted:
+        compacted = text or ""
+        boilerplate = duplicates = 0
+    stats = {
+        "chars_before": len(text or ""),
+        "chars_after": len(compacted),
+        "boilerplate_lines": boilerplate,
+        "duplicate_lines": duplicates,
+        "tokens_saved": max(0, estimate_tokens(text or "") - estimate_tokens(compacted)),
+    }
+    return compacted, stats
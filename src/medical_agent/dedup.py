@@ -0,0 +1,469 @@
+"""
+重复文件检测
+
+收件目录中经常出现同一份报告被扫描两次，或者 JPG 与其打印来源 PDF 同时存在的情况。
+这里为每个文件计算内容哈希（sha256）和逐页感知哈希（pHash）：
+    - sha256 完全相同的文件分为一组，只对代表文件做 OCR 和结构化提取，其余文件在
+      去重记录库中链接到代表文件的结果；此前批次处理过的相同文件直接复用结果
+    - pHash 只能说明版面相似：同一模板打印的不同患者报告距离只有 0–2。pHash 近似的文件
+      仍然 OCR，OCR 文本与候选结果的文本确认相同（数字完全一致、整体相似度达到
+      DEDUP_TEXT_SIMILARITY）后才跳过结构化提取并链接（见 link_confirmed_duplicate）
+
+内容哈希、页哈希、规范化文本与链接保存在 SQLite 记录库（cache/dedup.db，DEDUP_DB 可改），按键读写单行。
+"""
+import difflib
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from medical_agent.utils import CACHE_DIR
+
+# 两页 pHash 汉明距离不超过该值（共 64 位）即视为候选重复页（还需文本确认）
+DEDUP_MAX_DISTANCE = int(os.getenv('DEDUP_MAX_DISTANCE', 10))
+# 候选重复文件的 OCR 文本（规范化后）相似度达到该值、且所有数字一致时才视为同一份报告
+DEDUP_TEXT_SIMILARITY = float(os.getenv('DEDUP_TEXT_SIMILARITY', 0.97))
+# 计算感知哈希时PDF的栅格化分辨率，只需看清版面
+DEDUP_HASH_DPI = 36
+
+DEDUP_DB = os.getenv('DEDUP_DB', os.path.join(CACHE_DIR, "dedup.db"))
+
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png'}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    content_hash TEXT PRIMARY KEY,
+    output_name  TEXT NOT NULL,
+    created_at   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    output_name TEXT PRIMARY KEY,
+    page_count  INTEGER NOT NULL,
+    first_hash  TEXT NOT NULL,
+    hashes      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_count ON pages (page_count);
+CREATE TABLE IF NOT EXISTS texts (
+    output_name TEXT PRIMARY KEY,
+    text        TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS links (
+    output_name    TEXT PRIMARY KEY,
+    source         TEXT NOT NULL,
+    representative TEXT NOT NULL,
+    distance       INTEGER NOT NULL,
+    created_at     REAL NOT NULL
+);
+"""
+
+
+def dedup_enabled() -> bool:
+    return os.getenv('DEDUP', '1') != '0'
+
+
+def file_content_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """分块计算文件 sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def average_hash(gray: np.ndarray, hash_size: int = 8) -> int:
+    """aHash：缩放到 8x8 后与均值比较"""
+    small = cv2.resize(gray, (hash_size, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small > small.mean()).flatten()
+    return _bits_to_int(bits)
+
+
+def perceptual_hash(gray: np.ndarray, hash_size: int = 8, highfreq_factor: int = 4) -> int:
+    """pHash：32x32 DCT 的低频 8x8 系数与中位数比较"""
+    size = hash_size * highfreq_factor
+    small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:hash_size, :hash_size]
+    bits = (low > np.median(low[1:, 1:] if hash_size > 1 else low)).flatten()
+    return _bits_to_int(bits)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def page_hashes(path: str) -> List[int]:
+    """
+    计算文件每一页的 pHash
+
+    Args:
+        path (str): JPG/PNG 或 PDF 文件路径
+
+    Returns:
+        List[int]: 每页一个 64 位哈希；无法读取时返回空列表
+    """
+    suffix = Path(path).suffix.lower()
+    try:
+        if suffix in IMAGE_SUFFIXES:
+            gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            return [perceptual_hash(gray)] if gray is not None else []
+        if suffix == '.pdf':
+            from medical_agent.imaging import pdf_to_gray_arrays
+            return [perceptual_hash(page) for page in pdf_to_gray_arrays(path, dpi=DEDUP_HASH_DPI)]
+    except Exception as e:
+        print(f"⚠️ 计算感知哈希失败 {path}: {e}")
+    return []
+
+
+def _is_near_duplicate(a: List[int], b: List[int], max_distance: int) -> Optional[int]:
+    """页数相同且每页距离都不超过阈值时返回最大页距离，否则返回 None"""
+    if not a or len(a) != len(b):
+        return None
+    worst = max(hamming_distance(x, y) for x, y in zip(a, b))
+    return worst if worst <= max_distance else None
+
+
+def _representative_rank(path: str):
+    # 优先选择 PDF（可能带文字层、无扫描失真），其次无损格式、更大的文件，最后按路径排序保证稳定
+    suffix = Path(path).suffix.lower()
+    return (suffix != '.pdf', suffix in ('.jpg', '.jpeg'), -os.path.getsize(path), str(path))
+
+
+def group_duplicates(paths: List[str], max_distance: int = DEDUP_MAX_DISTANCE) -> List[Dict[str, Any]]:
+    """
+    将内容完全相同的文件分组，并标出逐页感知哈希近似的候选重复
+
+    Args:
+        paths (List[str]): 待处理文件（可混合 PDF 与图片）
+        max_distance (int): 页级 pHash 最大汉明距离
+
+    Returns:
+        List[Dict[str, Any]]: 每组 {"representative", "duplicates", "content_hash", "page_hashes", "near"}，
+        按输入顺序中首次出现的位置排列；"near" 为排在前面、pHash 近似的组的 [(代表文件, 页距离)]，
+        只是候选，需在 OCR 后用文本确认
+    """
+    infos = []
+    for path in paths:
+        try:
+            infos.append({"path": path, "content_hash": file_content_hash(path), "pages": None})
+        except OSError as e:
+            print(f"⚠️ 读取文件失败 {path}: {e}")
+            infos.append({"path": path, "content_hash": None, "pages": []})
+
+    # 1. 内容哈希完全相同
+    by_hash: Dict[str, List[Dict[str, Any]]] = {}
+    clusters: List[List[Dict[str, Any]]] = []
+    for info in infos:
+        key = info["content_hash"]
+        if key is not None and key in by_hash:
+            by_hash[key].append(info)
+            continue
+        cluster = [info]
+        clusters.append(cluster)
+        if key is not None:
+            by_hash[key] = cluster
+
+    # 2. 逐页感知哈希（每个内容哈希只计算一次），只记录候选
+    groups = []
+    for cluster in clusters:
+        members = [info["path"] for info in cluster]
+        representative = min(members, key=_representative_rank)
+        pages = page_hashes(representative) if cluster[0]["content_hash"] else []
+        near = []
+        for earlier in groups:
+            distance = _is_near_duplicate(earlier["page_hashes"], pages, max_distance)
+            if distance is not None:
+                near.append((earlier["representative"], distance))
+        groups.append({
+            "representative": representative,
+            "duplicates": [p for p in members if p != representative],
+            "content_hash": cluster[0]["content_hash"],
+            "page_hashes": pages,
+            "near": near,
+        })
+    return groups
+
+
+class DedupStore:
+    """
+    去重记录库（SQLite）；每次操作使用独立连接，批量处理的多个进程可以共用同一个数据库文件
+
+    results 按内容哈希、pages / texts / links 按输出名建主键，单个文件的查询与写入只涉及相关的行；
+    pHash 候选先按页数与首页哈希的汉明距离在 SQL 中过滤，再逐页比较
+    """
+
+    def __init__(self, path: str = DEDUP_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.create_function("hamming", 2, lambda a, b: hamming_distance(int(a, 16), int(b, 16)),
+                             deterministic=True)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def result_for_hash(self, content_hash: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT output_name FROM results WHERE content_hash = ?", (content_hash,)).fetchone()
+        return row["output_name"] if row else None
+
+    def near_pages(self, hashes: List[int], max_distance: int) -> List[Tuple[str, int]]:
+        """逐页 pHash 近似的输出名 [(输出名, 最大页距离)]"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT output_name, hashes FROM pages WHERE page_count = ? AND hamming(first_hash, ?) <= ?",
+                (len(hashes), f"{hashes[0]:016x}", max_distance),
+            ).fetchall()
+        found = []
+        for row in rows:
+            distance = _is_near_duplicate([int(h, 16) for h in row["hashes"].split(",")], hashes, max_distance)
+            if distance is not None:
+                found.append((row["output_name"], distance))
+        return found
+
+    def record_result(self, content_hash: str, output_name: str, hashes: Optional[List[int]] = None) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO results (content_hash, output_name, created_at) VALUES (?, ?, ?)",
+                         (content_hash, output_name, now))
+            if hashes:
+                conn.execute(
+                    "INSERT OR REPLACE INTO pages (output_name, page_count, first_hash, hashes) VALUES (?, ?, ?, ?)",
+                    (output_name, len(hashes), f"{hashes[0]:016x}", ",".join(f"{h:016x}" for h in hashes)),
+                )
+
+    def text_for(self, output_name: str) -> str:
+        with self._connect() as conn:
+            row = conn.execute("SELECT text FROM texts WHERE output_name = ?", (output_name,)).fetchone()
+        return row["text"] if row else ""
+
+    def record_text(self, output_name: str, text: str) -> None:
+        """保存输出的规范化文本，并清除该输出名此前的链接（重新处理后以新结果为准）"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR REPLACE INTO texts (output_name, text) VALUES (?, ?)", (output_name, text))
+            conn.execute("DELETE FROM links WHERE output_name = ?", (output_name,))
+            conn.execute("COMMIT")
+
+    def link_for(self, output_name: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM links WHERE output_name = ?", (output_name,)).fetchone()
+        return dict(row) if row else None
+
+    def record_link(self, output_name: str, source: str, representative: str, distance: int) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO links (output_name, source, representative, distance, created_at) "
+                "VALUES (?, ?, ?, ?, ?)", (output_name, source, representative, distance, time.time()),
+            )
+
+
+_stores: Dict[str, DedupStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_dedup_store(path: Optional[str] = None) -> DedupStore:
+    """进程内共享的去重记录库（按路径）"""
+    path = path or os.getenv('DEDUP_DB', DEDUP_DB)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = DedupStore(path)
+        return store
+
+
+def _result_exists(output_name: str) -> bool:
+    return os.path.exists(os.path.join(CACHE_DIR, f"{output_name}.parquet"))
+
+
+def lookup_processed(content_hash: Optional[str], db_path: Optional[str] = None) -> Optional[Tuple[str, int]]:
+    """
+    查找此前批次中处理过的内容完全相同的文件
+
+    Args:
+        content_hash (str): 文件 sha256
+
+    Returns:
+        Optional[Tuple[str, int]]: (结果输出名, 0)；结果文件已不存在时视为未处理
+    """
+    output_name = get_dedup_store(db_path).result_for_hash(content_hash) if content_hash else None
+    if output_name and _result_exists(output_name):
+        return output_name, 0
+    return None
+
+
+def near_processed(page_hashes: Optional[List[int]], max_distance: int = DEDUP_MAX_DISTANCE,
+                   db_path: Optional[str] = None) -> List[Tuple[str, int]]:
+    """
+    此前批次中逐页 pHash 近似的结果（只是候选，不能直接复用）
+
+    Returns:
+        List[Tuple[str, int]]: [(结果输出名, 页距离)]，按距离升序
+    """
+    if not page_hashes:
+        return []
+    found = [(name, distance) for name, distance in get_dedup_store(db_path).near_pages(page_hashes, max_distance)
+             if _result_exists(name)]
+    return sorted(found, key=lambda item: item[1])
+
+
+_PAGE_MARKER_RE = re.compile(r"=== 第\d+页 ===")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_report_text(text: str) -> str:
+    """去掉分页标记与所有空白，用于比较两次 OCR 的文本"""
+    return re.sub(r"\s+", "", _PAGE_MARKER_RE.sub("", text or ""))
+
+
+def texts_match(a: str, b: str, min_similarity: float = DEDUP_TEXT_SIMILARITY) -> bool:
+    """
+    两份规范化后的报告文本是否为同一份报告
+
+    所有数字（测量值、住院号、日期）必须逐个一致，其余文字的相似度达到阈值（容忍 OCR 的个别错字）
+    """
+    if not a or not b or _NUMBER_RE.findall(a) != _NUMBER_RE.findall(b):
+        return False
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio() >= min_similarity
+
+
+def record_text(output_name: str, ocr_text: str, db_path: Optional[str] = None) -> None:
+    """记录输出的 OCR 文本（供之后的候选重复确认），并清除该输出名此前的链接"""
+    if not dedup_enabled():
+        return
+    get_dedup_store(db_path).record_text(output_name, normalize_report_text(ocr_text))
+
+
+def link_confirmed_duplicate(path: str, output_name: str, ocr_text: str,
+                             candidates: Optional[List[Tuple[str, int]]],
+                             db_path: Optional[str] = None) -> Optional[str]:
+    """
+    OCR 文本与某个候选结果的文本确认相同时，将文件链接到该结果
+
+    Args:
+        path (str): 文件路径
+        output_name (str): 该文件原本的输出名
+        ocr_text (str): 该文件的 OCR 文本
+        candidates (List[Tuple[str, int]]): pHash 近似的候选 [(结果输出名, 页距离)]
+
+    Returns:
+        Optional[str]: 被链接到的结果输出名；没有确认的候选时为 None（需要正常结构化）
+    """
+    if not candidates or not dedup_enabled():
+        return None
+    store = get_dedup_store(db_path)
+    text = normalize_report_text(ocr_text)
+    for candidate, distance in candidates:
+        if candidate != output_name and _result_exists(candidate) and texts_match(text, store.text_for(candidate)):
+            record_duplicate_link(path, output_name, candidate, distance, db_path)
+            return candidate
+    print(f"🔎 {Path(path).name} 与 {len(candidates)} 个版面相似的结果文本不同，正常处理")
+    return None
+
+
+def linked_result(output_name: str, db_path: Optional[str] = None) -> Optional[str]:
+    """该输出名被链接到的结果输出名（没有链接时为 None）"""
+    link = get_dedup_store(db_path).link_for(output_name)
+    return link["representative"] if link else None
+
+
+def record_result(content_hash: Optional[str], output_name: str, page_hashes: Optional[List[int]] = None,
+                  db_path: Optional[str] = None) -> None:
+    """记录代表文件的内容哈希与逐页 pHash 对应的结果，供后续批次直接复用"""
+    if not content_hash:
+        return
+    get_dedup_store(db_path).record_result(content_hash, output_name, page_hashes)
+
+
+def record_duplicate_link(duplicate_path: str, duplicate_output: str, representative_output: str,
+                          distance: int = 0, db_path: Optional[str] = None) -> None:
+    """
+    将重复文件链接到代表文件的结果
+
+    Args:
+        duplicate_path (str): 重复文件路径
+        duplicate_output (str): 重复文件原本的输出名
+        representative_output (str): 代表文件的输出名（结果 parquet 文件名）
+        distance (int): 最大页级 pHash 距离，0 表示内容完全相同（大于 0 时文本已确认相同）
+    """
+    get_dedup_store(db_path).record_link(duplicate_output, str(duplicate_path), representative_output, distance)
+    print(f"🔗 {Path(duplicate_path).name} 与 {representative_output} 重复，已链接到其结果")
+
+
+def plan_deduplicated_batch(paths: List[str], output_name_fn: Callable[[str], str]) -> List[Dict[str, Any]]:
+    """
+    为批量处理生成去重后的任务列表
+
+    Args:
+        paths (List[str]): 待处理文件
+        output_name_fn (Callable[[str], str]): 文件路径 → 输出名
+
+    Returns:
+        List[Dict[str, Any]]: group_duplicates 的分组，另含 "output_name"（代表文件输出名）、
+        "reuse"（此前批次中内容完全相同的文件的输出名，存在时无需再处理）和
+        "near_duplicates"（pHash 近似的候选结果 [(输出名, 页距离)]，传给 link_confirmed_duplicate）
+    """
+    if not dedup_enabled():
+        groups = [{"representative": p, "duplicates": [], "content_hash": None, "page_hashes": [], "near": []}
+                  for p in paths]
+    else:
+        groups = group_duplicates(paths)
+        duplicate_count = sum(len(g["duplicates"]) for g in groups)
+        if duplicate_count:
+            print(f"🔁 检测到 {duplicate_count} 个重复文件，实际处理 {len(groups)} 个")
+    for group in groups:
+        group["output_name"] = output_name_fn(group["representative"])
+        group["reuse"] = None
+        group["near_duplicates"] = [(output_name_fn(p), d) for p, d in group["near"]]
+        if group["content_hash"]:
+            previous = lookup_processed(group["content_hash"])
+            if previous:
+                group["reuse"] = previous[0]
+            group["near_duplicates"] += near_processed(group["page_hashes"])
+    return groups
+
+
+def link_group_duplicates(group: Dict[str, Any], representative_output: str,
+                          output_name_fn: Callable[[str], str],
+                          include_representative: bool = False) -> List[str]:
+    """
+    将一组中的重复文件链接到代表结果
+
+    Args:
+        group (Dict[str, Any]): plan_deduplicated_batch 返回的分组
+        representative_output (str): 代表结果的输出名
+        output_name_fn (Callable[[str], str]): 文件路径 → 输出名
+        include_representative (bool): 代表文件本身也链接（复用此前批次结果时）
+
+    Returns:
+        List[str]: 被链接的文件名
+    """
+    members = list(group["duplicates"])
+    if include_representative:
+        members.insert(0, group["representative"])
+    linked = []
+    for path in members:
+        record_duplicate_link(path, output_name_fn(path), representative_output)
+        linked.append(Path(path).name)
+    return linked
@@ -0,0 +1,290 @@
+"""
+多后端负载均衡
+
+文本理解调用可以分摊到多个 OpenAI 兼容后端（DashScope、本地部署的 Baichuan 等）。
+LLM_ENDPOINTS 配置后端列表，逗号分隔，每项为 `名称[=模型][*权重]`，名称对应 clients.CLIENT_CONFIGS：
+
+    LLM_ENDPOINTS="qwen,baichuan=Baichuan-M2*2"
+
+  - 指定了模型的后端忽略调用方的模型名，一律使用该模型（本地服务通常只部署一个模型）；
+    全部后端都映射到同一模型时，级联的快速模型与大模型实际相同，不再升级（见 backend_models）
+  - JSON 模式按 后端 + 实际发送的模型 记录：某个后端以 400 拒绝 response_format 时，
+    只对该后端去掉参数在同一后端重试，不影响其他后端上的同名模型
+  - 选择后端：在熔断器允许的后端中选 (进行中请求数 + 1) × 平均耗时 / 权重 最小的一个
+    （ENDPOINT_BALANCE=least_outstanding 时只看进行中请求数 / 权重）
+  - 连接失败、超时、429 与 5xx 计为后端故障：请求立即转到下一个后端；连续 ENDPOINT_FAILURE_THRESHOLD
+    次故障后熔断 ENDPOINT_COOLDOWN 秒，之后放行一个试探请求，成功则恢复
+  - ENDPOINT_HEALTH_INTERVAL > 0 时后台定期请求 /models 做主动健康检查
+
+未配置 LLM_ENDPOINTS 时不启用，所有文本调用仍使用 Qwen 客户端。
+EndpointPool 提供与 OpenAI 客户端相同的 chat.completions.create 接口，可直接传给 chat_completion()。
+"""
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from medical_agent.clients import get_client
+from medical_agent.structured import json_mode_rejected, json_mode_supported
+
+ENDPOINT_FAILURE_THRESHOLD = int(os.getenv('ENDPOINT_FAILURE_THRESHOLD', 3))
+ENDPOINT_COOLDOWN = float(os.getenv('ENDPOINT_COOLDOWN', 30))
+ENDPOINT_HEALTH_INTERVAL = float(os.getenv('ENDPOINT_HEALTH_INTERVAL', 0))
+ENDPOINT_HEALTH_TIMEOUT = float(os.getenv('ENDPOINT_HEALTH_TIMEOUT', 5))
+# 平均耗时的指数滑动系数
+_EWMA_ALPHA = 0.2
+
+
+def endpoint_failure(error: BaseException) -> bool:
+    """是否属于后端故障（连接失败、超时、429、5xx）；400 等请求本身的错误换后端也无济于事"""
+    status = getattr(error, "status_code", None)
+    return status is None or status == 429 or status >= 500
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，冷却结束后放行一个试探请求（半开）"""
+
+    def __init__(self, threshold: int = ENDPOINT_FAILURE_THRESHOLD, cooldown: float = ENDPOINT_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            # 试探失败或连续失败：重新开始冷却
+            self.opened_at = time.monotonic()
+
+
+class Endpoint:
+    """一个后端：客户端名称、模型映射、权重及运行状态"""
+
+    def __init__(self, name: str, model: Optional[str] = None, weight: float = 1.0, client: Any = None):
+        self.name = name
+        self.model = model
+        self.weight = weight
+        self._client = client
+        self.breaker = CircuitBreaker()
+        self.outstanding = 0
+        self.latency: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def client(self):
+        # 每次取共享客户端：get_client 在 fork 后会重建连接池
+        return self._client if self._client is not None else get_client(self.name)
+
+    def score(self, mode: str) -> Tuple[float, float]:
+        """越小越优先；尚无耗时样本的后端按 0 计，先各试一次"""
+        load = self.outstanding / self.weight
+        if mode == "least_outstanding":
+            return load, 0.0
+        return (self.outstanding + 1) * (self.latency or 0.0) / self.weight, load
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "model": self.model, "weight": self.weight, "state": self.breaker.state,
+            "outstanding": self.outstanding, "requests": self.requests, "failures": self.failures,
+            "latency_s": round(self.latency, 3) if self.latency is not None else None,
+        }
+
+
+def parse_endpoints(spec: str) -> List[Endpoint]:
+    """解析 "qwen,baichuan=Baichuan-M2*2" 形式的后端列表"""
+    endpoints = []
+    for item in filter(None, (s.strip() for s in (spec or "").split(","))):
+        item, _, weight = item.partition("*")
+        name, _, model = item.partition("=")
+        endpoints.append(Endpoint(name.strip(), model.strip() or None, float(weight) if weight else 1.0))
+    return endpoints
+
+
+class EndpointPool:
+    """按负载与健康状况在多个后端之间分配请求"""
+
+    def __init__(self, endpoints: List[Endpoint], mode: Optional[str] = None):
+        if not endpoints:
+            raise ValueError("至少需要一个后端")
+        self.endpoints = endpoints
+        self.mode = mode or os.getenv('ENDPOINT_BALANCE', 'latency')
+        self._lock = threading.Lock()
+        self._health_thread: Optional[threading.Thread] = None
+        # 与 OpenAI 客户端相同的调用方式：pool.chat.completions.create(...)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        # llm._create 把 response_format 原样交给后端池，由 _send 按后端处理
+        self.handles_json_mode = True
+
+    def backend_models(self, model: str) -> frozenset:
+        """调用方的模型名在各后端上实际发送的模型"""
+        return frozenset(e.model or model for e in self.endpoints)
+
+    def _acquire(self, exclude: set) -> Optional[Endpoint]:
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.name not in exclude and e.breaker.state != "open"]
+            for endpoint in sorted(candidates, key=lambda e: e.score(self.mode)):
+                if endpoint.breaker.allow():
+                    endpoint.outstanding += 1
+                    endpoint.requests += 1
+                    return endpoint
+        return None
+
+    def _release(self, endpoint: Endpoint, seconds: float, error: Optional[BaseException]) -> None:
+        with self._lock:
+            endpoint.outstanding -= 1
+            if error is None:
+                endpoint.breaker.record_success()
+                endpoint.latency = seconds if endpoint.latency is None \
+                    else (1 - _EWMA_ALPHA) * endpoint.latency + _EWMA_ALPHA * seconds
+            elif endpoint_failure(error):
+                endpoint.failures += 1
+                endpoint.breaker.record_failure()
+            else:
+                # 请求本身的错误不影响后端健康状况，但半开试探需要释放
+                endpoint.breaker.probing = False
+
+    def _send(self, endpoint: Endpoint, model: str, messages: List[Dict[str, Any]], kwargs: Dict[str, Any]):
+        """向一个后端发送请求；该后端 + 模型不支持 JSON 模式时去掉 response_format"""
+        model = endpoint.model or model
+        json_key = f"{endpoint.name}|{model}"
+        if kwargs.get("response_format") and not json_mode_supported(json_key):
+            kwargs = {k: v for k, v in kwargs.items() if k != "response_format"}
+        try:
+            return endpoint.client.chat.completions.create(model=model, messages=messages, **kwargs)
+        except Exception as e:
+            if not kwargs.get("response_format") or not json_mode_rejected(json_key, e):
+                raise
+        kwargs = {k: v for k, v in kwargs.items() if k != "response_format"}
+        return endpoint.client.chat.completions.create(model=model, messages=messages, **kwargs)
+
+    def create(self, model: str, messages: List[Dict[str, Any]], **kwargs: Any):
+        """
+        选择后端发送 chat.completions 请求，后端故障时转到下一个后端
+
+        Args:
+            model (str): 调用方的模型名（后端配置了模型时被替换）
+            messages (List[Dict]): 消息列表
+            **kwargs: 透传给 create 的参数（timeout、response_format 等）
+
+        Returns:
+            ChatCompletion: 原始响应
+
+        Raises:
+            Exception: 所有可用后端都失败时抛出最后一个错误；没有可用后端时抛出 RuntimeError
+        """
+        tried: set = set()
+        last_error: Optional[BaseException] = None
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                if last_error is not None:
+                    raise last_error
+                raise RuntimeError("没有可用的模型后端（全部熔断）")
+            tried.add(endpoint.name)
+            start = time.perf_counter()
+            try:
+                completion = self._send(endpoint, model, messages, kwargs)
+            except Exception as e:
+                self._release(endpoint, time.perf_counter() - start, e)
+                if not endpoint_failure(e):
+                    raise
+                print(f"⚠️ 模型后端 {endpoint.name} 调用失败，尝试其他后端: {e}")
+                last_error = e
+                continue
+            self._release(endpoint, time.perf_counter() - start, None)
+            return completion
+
+    def health_check(self) -> Dict[str, bool]:
+        """主动探测各后端（GET /models），结果计入熔断器"""
+        results = {}
+        for endpoint in self.endpoints:
+            try:
+                endpoint.client.models.list(timeout=ENDPOINT_HEALTH_TIMEOUT)
+                error = None
+            except Exception as e:
+                error = e
+            # 探测耗时不计入平均耗时（/models 远快于推理请求）
+            with self._lock:
+                if error is None:
+                    endpoint.breaker.record_success()
+                elif endpoint_failure(error):
+                    endpoint.failures += 1
+                    endpoint.breaker.record_failure()
+            results[endpoint.name] = error is None
+        return results
+
+    def start_health_checks(self, interval: float = ENDPOINT_HEALTH_INTERVAL) -> None:
+        """后台定期健康检查（守护线程）"""
+        if interval <= 0 or self._health_thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.health_check()
+
+        self._health_thread = threading.Thread(target=loop, name="endpoint-health", daemon=True)
+        self._health_thread.start()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {e.name: e.snapshot() for e in self.endpoints}
+
+
+_pool: Optional[EndpointPool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_endpoint_pool() -> Optional[EndpointPool]:
+    """
+    进程内共享的后端池
+
+    Returns:
+        Optional[EndpointPool]: 未配置 LLM_ENDPOINTS 时返回 None
+    """
+    global _pool, _pool_pid
+    spec = os.getenv('LLM_ENDPOINTS', '')
+    if not spec.strip():
+        return None
+    with _pool_lock:
+        # 子进程重新创建，进行中请求数与熔断状态不跨进程共享
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = EndpointPool(parse_endpoints(spec))
+            _pool_pid = os.getpid()
+            _pool.start_health_checks()
+        return _pool
+
+
+def print_endpoint_summary() -> None:
+    """打印各后端的请求分布与健康状况"""
+    if _pool is None or _pool_pid != os.getpid():
+        return
+    for name, s in _pool.snapshot().items():
+        latency = f"{s['latency_s']:.2f}s" if s['latency_s'] is not None else "-"
+        print(f"   模型后端({name}): {s['requests']} 次请求，失败 {s['failures']} 次，"
+              f"平均耗时 {latency}，状态 {s['state']}")
@@ -0,0 +1,168 @@
+"""
+对冲请求与调用超时
+
+一份 CTA 报告的耗时取决于几十个节段请求中最慢的一个，偶发的 20–30 秒长尾会拖慢整份报告。
+hedged_call() 为每次模型调用：
+    1. 设置明确的超时（LLM_TIMEOUT / OCR_TIMEOUT 秒），不再无限等待
+    2. 按提示词类型统计最近的调用耗时；调用超过该类型的 HEDGE_PERCENTILE 分位数仍未返回时，
+       再发一次相同的请求，取先返回的结果
+    3. 对冲请求受全局预算约束：对冲次数不超过调用次数的 HEDGE_BUDGET（默认 5%）；
+       同时未结束的对冲不超过 HEDGE_CONNECTIONS（连接池为对冲保留的连接数，见 clients）
+败者请求无法中途取消，会占用连接直到服务端返回或超时，因此对冲名额在原请求与对冲请求都结束后才释放，
+正常调用不会因对冲而在连接池上排队。
+样本不足 HEDGE_MIN_SAMPLES 时不对冲。HEDGE=0 关闭对冲（超时仍然生效）。
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from medical_agent.clients import HEDGE_CONNECTIONS
+
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 60))
+OCR_TIMEOUT = float(os.getenv('OCR_TIMEOUT', 120))
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 95))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', 20))
+HEDGE_BUDGET = float(os.getenv('HEDGE_BUDGET', 0.05))
+# 每种类型保留的最近耗时样本数
+HEDGE_WINDOW = int(os.getenv('HEDGE_WINDOW', 200))
+# 对冲触发延迟的下限（秒），避免对很快的调用也发重复请求
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', 1.0))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def hedging_enabled() -> bool:
+    return os.getenv('HEDGE', '1') != '0'
+
+
+def call_timeout(kind: str) -> float:
+    """单次调用的超时（秒）：OCR 图片请求较慢，单独配置"""
+    return OCR_TIMEOUT if kind == "ocr" else LLM_TIMEOUT
+
+
+class LatencyTracker:
+    """按类型保存最近的调用耗时，给出对冲阈值"""
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+        self._window = window
+
+    def record(self, kind: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(kind, deque(maxlen=self._window)).append(seconds)
+
+    def threshold(self, kind: str, percentile: float = None, min_samples: int = None) -> Optional[float]:
+        """该类型耗时的分位数；样本不足时返回 None"""
+        percentile = HEDGE_PERCENTILE if percentile is None else percentile
+        min_samples = HEDGE_MIN_SAMPLES if min_samples is None else min_samples
+        with self._lock:
+            values = sorted(self._samples.get(kind, ()))
+        if not values or len(values) < min_samples:
+            return None
+        index = min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))
+        return max(values[index], HEDGE_MIN_DELAY)
+
+
+class HedgeBudget:
+    """全局对冲预算：对冲次数 ≤ 调用次数 × ratio，且同时未结束的对冲 ≤ max_outstanding"""
+
+    def __init__(self, ratio: float = HEDGE_BUDGET, max_outstanding: int = HEDGE_CONNECTIONS):
+        self.ratio = ratio
+        self.max_outstanding = max_outstanding
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.outstanding = 0
+
+    def record_call(self) -> None:
+        with self._lock:
+            self.calls += 1
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.calls * self.ratio or self.outstanding >= self.max_outstanding:
+                return False
+            self.hedges += 1
+            self.outstanding += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.outstanding -= 1
+
+
+tracker = LatencyTracker()
+budget = HedgeBudget()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=int(os.getenv('HEDGE_MAX_WORKERS', 64)),
+                                           thread_name_prefix="llm-hedge")
+        return _executor
+
+
+def _timed(kind: str, fn: Callable[[], Any]) -> Callable[[], Any]:
+    def run():
+        start = time.perf_counter()
+        result = fn()
+        tracker.record(kind, time.perf_counter() - start)
+        return result
+    return run
+
+
+def hedged_call(kind: str, fn: Callable[[float], Any]) -> Tuple[Any, Dict[str, Any]]:
+    """
+    执行一次模型调用，超过对冲阈值时发出重复请求
+
+    Args:
+        kind (str): 提示词类型，按类型分别统计耗时
+        fn (Callable[[float], Any]): 接收超时秒数、发起请求的函数
+
+    Returns:
+        Tuple[Any, Dict]: (先返回的结果, {"hedged": 是否发出了对冲请求, "hedge_won": 结果是否来自对冲请求})
+
+    Raises:
+        Exception: 所有已发出的请求都失败时，抛出原始请求的异常
+    """
+    timeout = call_timeout(kind)
+    request = _timed(kind, lambda: fn(timeout))
+    budget.record_call()
+    delay = tracker.threshold(kind) if hedging_enabled() else None
+    if delay is None or delay >= timeout:
+        return request(), {"hedged": False, "hedge_won": False}
+
+    primary: Future = _pool().submit(request)
+    done, _ = wait([primary], timeout=delay)
+    if done or not budget.try_acquire():
+        return primary.result(), {"hedged": False, "hedge_won": False}
+
+    hedge: Future = _pool().submit(request)
+    # 原请求与对冲请求都结束（败者的连接归还连接池）后才释放对冲名额
+    remaining, remaining_lock, release = [2], threading.Lock(), budget.release
+
+    def finished(_future: Future) -> None:
+        with remaining_lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            release()
+
+    primary.add_done_callback(finished)
+    hedge.add_done_callback(finished)
+
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                # 未完成的请求在后台结束，结果丢弃
+                return future.result(), {"hedged": True, "hedge_won": future is hedge}
+    return primary.result(), {"hedged": True, "hedge_won": False}
@@ -0,0 +1,368 @@
+"""
+OCR 图像处理公共工具
+
+OCR 模型（qwen-vl-ocr）会在服务端把图片缩放到 min_pixels ~ max_pixels 的像素区间内，
+超过 max_pixels 的部分只会增加上传体积、编码时间和服务端缩放时间。
+这里统一规划栅格化 DPI / 缩放比例和 JPEG 质量，使每页图片落在模型的像素预算附近。
+"""
+import base64
+import io
+import math
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# 与 qwen-vl-ocr 的请求参数一致（见 tests/test_qwen.py）
+OCR_MIN_PIXELS = int(os.getenv('OCR_MIN_PIXELS', 28 * 28 * 4))
+OCR_MAX_PIXELS = int(os.getenv('OCR_MAX_PIXELS', 28 * 28 * 1280))
+OCR_JPEG_QUALITY = int(os.getenv('OCR_JPEG_QUALITY', 85))
+
+# 预处理线程池大小：OpenCV 计算期间释放 GIL，线程数按可用核心数设置
+_AVAILABLE_CORES = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+PREPROCESS_WORKERS = int(os.getenv('PREPROCESS_WORKERS', _AVAILABLE_CORES))
+
+MIN_DPI = 72
+MAX_DPI = 300
+
+# 1 英寸 = 72 pt（PDF 页面尺寸单位）
+POINTS_PER_INCH = 72.0
+
+
+def plan_pdf_dpi(width_pt: float, height_pt: float, max_pixels: int = OCR_MAX_PIXELS) -> int:
+    """
+    根据PDF页面尺寸计算栅格化DPI，使单页像素数不超过 max_pixels
+
+    Args:
+        width_pt (float): 页面宽度（pt）
+        height_pt (float): 页面高度（pt）
+        max_pixels (int): 像素预算
+
+    Returns:
+        int: 栅格化DPI（限制在 MIN_DPI ~ MAX_DPI）
+    """
+    area_in2 = (width_pt / POINTS_PER_INCH) * (height_pt / POINTS_PER_INCH)
+    if area_in2 <= 0:
+        return MAX_DPI
+    dpi = int(math.sqrt(max_pixels / area_in2))
+    return max(MIN_DPI, min(MAX_DPI, dpi))
+
+
+def plan_pdf_dpi_for_file(pdf_path: str, max_pixels: int = OCR_MAX_PIXELS) -> int:
+    """
+    读取PDF首页尺寸（pdfinfo）并规划DPI，读取失败时退回 MAX_DPI
+
+    Args:
+        pdf_path (str): PDF文件路径
+        max_pixels (int): 像素预算
+
+    Returns:
+        int: 栅格化DPI
+    """
+    try:
+        from pdf2image import pdfinfo_from_path
+        info = pdfinfo_from_path(pdf_path)
+        # 形如 "595.276 x 841.89 pts (A4)"
+        size = str(info.get("Page size", "")).split("pts")[0]
+        width_pt, height_pt = [float(v) for v in size.split("x")]
+        return plan_pdf_dpi(width_pt, height_pt, max_pixels)
+    except Exception as e:
+        print(f"⚠️ 读取PDF页面尺寸失败，使用{MAX_DPI}dpi: {e}")
+        return MAX_DPI
+
+
+def plan_scale(width: int, height: int, max_pixels: int = OCR_MAX_PIXELS) -> float:
+    """
+    计算缩放比例（只缩小不放大），使 width*height 不超过 max_pixels
+
+    Returns:
+        float: 缩放比例，1.0 表示无需缩放
+    """
+    pixels = width * height
+    if pixels <= max_pixels or pixels == 0:
+        return 1.0
+    return math.sqrt(max_pixels / pixels)
+
+
+def plan_jpeg_quality(width: int, height: int, max_pixels: int = OCR_MAX_PIXELS) -> int:
+    """
+    规划JPEG编码质量
+
+    接近像素预算的页面使用默认质量；明显小于预算的图片（字号相对更小）
+    提高质量以保留笔画边缘。
+
+    Returns:
+        int: JPEG质量
+    """
+    if width * height < max_pixels / 4:
+        return min(95, OCR_JPEG_QUALITY + 5)
+    return OCR_JPEG_QUALITY
+
+
+def fit_to_pixel_budget(image: Image.Image, max_pixels: int = OCR_MAX_PIXELS) -> Image.Image:
+    """
+    将图片等比缩小到像素预算以内
+
+    Args:
+        image (Image.Image): 原始图片
+        max_pixels (int): 像素预算
+
+    Returns:
+        Image.Image: 缩放后的图片（无需缩放时返回原对象）
+    """
+    scale = plan_scale(image.width, image.height, max_pixels)
+    if scale >= 1.0:
+        return image
+    size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+    return image.resize(size, Image.LANCZOS)
+
+
+def encode_jpeg_base64(image: Image.Image, quality: Optional[int] = None) -> str:
+    """
+    按规划质量将PIL图片编码为base64 JPEG
+
+    Args:
+        image (Image.Image): PIL图片对象
+        quality (int): JPEG质量，为None时按 plan_jpeg_quality 规划
+
+    Returns:
+        str: base64编码的图片字符串
+    """
+    if quality is None:
+        quality = plan_jpeg_quality(image.width, image.height)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    img_buffer = io.BytesIO()
+    image.save(img_buffer, format='JPEG', quality=quality)
+    return base64.b64encode(img_buffer.getvalue()).decode('utf-8')
+
+
+def load_image_file_base64(image_path: str, max_pixels: int = OCR_MAX_PIXELS) -> Tuple[str, str]:
+    """
+    读取图片文件并编码为base64；超出像素预算时缩小后重新编码，否则直接发送原文件
+
+    Args:
+        image_path (str): 图片文件路径
+        max_pixels (int): 像素预算
+
+    Returns:
+        Tuple[str, str]: (base64字符串, MIME类型)
+    """
+    with Image.open(image_path) as image:
+        # Image.open 只读取文件头，获取尺寸不需要解码整张图
+        if image.width * image.height > max_pixels:
+            image.load()
+            resized = fit_to_pixel_budget(image, max_pixels)
+            return encode_jpeg_base64(resized), "image/jpeg"
+        mime = Image.MIME.get(image.format, "image/jpeg")
+
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8'), mime
+
+
+def build_image_content(base64_image: str, mime: str = "image/jpeg",
+                        min_pixels: int = OCR_MIN_PIXELS, max_pixels: int = OCR_MAX_PIXELS) -> Dict:
+    """
+    构建OCR请求中的图片内容，并带上 min_pixels/max_pixels
+
+    Args:
+        base64_image (str): base64编码的图片
+        mime (str): 图片MIME类型
+
+    Returns:
+        Dict: OpenAI 兼容格式的 image_url 内容
+    """
+    return image_content_from_data_url(f"data:{mime};base64,{base64_image}", min_pixels, max_pixels)
+
+
+def image_content_from_data_url(data_url: str, min_pixels: int = OCR_MIN_PIXELS,
+                                max_pixels: int = OCR_MAX_PIXELS) -> Dict:
+    """
+    用已构建好的 data URL 生成OCR请求中的图片内容
+
+    Args:
+        data_url (str): data:image/...;base64,... 字符串
+
+    Returns:
+        Dict: OpenAI 兼容格式的 image_url 内容
+    """
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": data_url
+        },
+        "min_pixels": min_pixels,
+        "max_pixels": max_pixels,
+    }
+
+
+# ----------------------------------------------------------------------
+# 精简图像通路：栅格化直接输出灰度 → numpy 缓冲区内完成预处理 → cv2.imencode → data URL
+# 相比 PIL → numpy → BGR → gray → PIL → RGB → BytesIO 的旧通路，每页少分配多份整页副本
+# ----------------------------------------------------------------------
+
+def pdf_to_gray_arrays(pdf_path: str, dpi: Optional[int] = None,
+                       max_pixels: int = OCR_MAX_PIXELS) -> List[np.ndarray]:
+    """
+    将PDF直接栅格化为灰度 numpy 数组（pdftoppm -gray）
+
+    Args:
+        pdf_path (str): PDF文件路径
+        dpi (int): 转换分辨率，为None时按像素预算规划
+        max_pixels (int): 像素预算
+
+    Returns:
+        List[np.ndarray]: 每页一个 uint8 灰度数组
+    """
+    from pdf2image import convert_from_path
+
+    if dpi is None:
+        dpi = plan_pdf_dpi_for_file(pdf_path, max_pixels)
+    try:
+        pages = []
+        for page in convert_from_path(pdf_path, dpi=dpi, grayscale=True):
+            if page.mode != 'L':
+                page = page.convert('L')
+            pages.append(fit_array_to_pixel_budget(np.asarray(page), max_pixels))
+            page.close()
+        print(f"✅ 成功将PDF转换为{len(pages)}页灰度图 ({dpi}dpi)")
+        return pages
+    except Exception as e:
+        print(f"❌ PDF转换失败: {e}")
+        return []
+
+
+def fit_array_to_pixel_budget(image: np.ndarray, max_pixels: int = OCR_MAX_PIXELS) -> np.ndarray:
+    """将 numpy 图像等比缩小到像素预算以内（INTER_AREA），无需缩放时原样返回"""
+    height, width = image.shape[:2]
+    scale = plan_scale(width, height, max_pixels)
+    if scale >= 1.0:
+        return image
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def to_gray_array(image) -> np.ndarray:
+    """将 PIL 图片或 numpy 数组转换为单通道 uint8 灰度数组（已是灰度时不复制）"""
+    if isinstance(image, Image.Image):
+        if image.mode != 'L':
+            image = image.convert('L')
+        return np.asarray(image)
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_RGBA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+
+_MORPH_KERNEL = np.ones((2, 2), np.uint8)
+
+
+def preprocess_array(gray: np.ndarray) -> np.ndarray:
+    """
+    图像预处理（numpy 版本）：去噪、Otsu 二值化、形态学闭运算
+
+    与原 PIL 通路（灰度化、中值滤波、二值化、闭运算）的处理步骤一致，但输入输出均为灰度数组，
+    中值滤波之后的步骤都在同一块缓冲区上原地完成。
+
+    Args:
+        gray (np.ndarray): uint8 灰度图
+
+    Returns:
+        np.ndarray: uint8 二值图（出错时返回输入的灰度图）
+    """
+    try:
+        # 1. 去噪 - 中值滤波去除椒盐噪声（输出新缓冲区，不修改输入）
+        binary = cv2.medianBlur(gray, 3)
+        # 2. 二值化 - Otsu 自动阈值（原地）
+        cv2.threshold(binary, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=binary)
+        # 3. 形态学闭运算去除小噪点（原地）
+        cv2.morphologyEx(binary, cv2.MORPH_CLOSE, _MORPH_KERNEL, dst=binary)
+        return binary
+    except Exception as e:
+        print(f"⚠️ 图像预处理出错: {e}，使用原始图像")
+        return gray
+
+
+_preprocess_executor: Optional[ThreadPoolExecutor] = None
+_preprocess_executor_lock = threading.Lock()
+
+
+def get_preprocess_executor() -> ThreadPoolExecutor:
+    """
+    获取进程内共享的预处理线程池（首次调用时创建）
+
+    批量处理时所有文档共用同一个线程池，避免每个文档各自创建线程。
+    线程池内部已并行，因此把 OpenCV 自身的并行线程数设为 1，防止线程超额订阅。
+    """
+    global _preprocess_executor
+    if _preprocess_executor is None:
+        with _preprocess_executor_lock:
+            if _preprocess_executor is None:
+                if PREPROCESS_WORKERS > 1:
+                    cv2.setNumThreads(1)
+                _preprocess_executor = ThreadPoolExecutor(
+                    max_workers=max(1, PREPROCESS_WORKERS),
+                    thread_name_prefix="preprocess",
+                )
+    return _preprocess_executor
+
+
+def submit_preprocess(pages: List[np.ndarray]) -> List[Future]:
+    """
+    将各页提交到共享线程池并发预处理
+
+    返回按页顺序排列的 Future，调用方可以按页等待结果，
+    第一页完成后即可开始 OCR，其余页面继续在后台处理。
+
+    Args:
+        pages (List[np.ndarray]): 灰度页面
+
+    Returns:
+        List[Future]: 每页一个 Future，结果为 preprocess_array 的输出
+    """
+    executor = get_preprocess_executor()
+    return [executor.submit(preprocess_array, page) for page in pages]
+
+
+def preprocess_pages(pages: List[np.ndarray]) -> List[np.ndarray]:
+    """并发预处理全部页面并按原顺序返回"""
+    return [future.result() for future in submit_preprocess(pages)]
+
+
+def encode_jpeg_array(image: np.ndarray, quality: Optional[int] = None) -> np.ndarray:
+    """
+    用 cv2.imencode 将图像编码为 JPEG，结果为单个 uint8 缓冲区
+
+    Args:
+        image (np.ndarray): 灰度或 BGR 图像
+        quality (int): JPEG质量，为None时按 plan_jpeg_quality 规划
+
+    Returns:
+        np.ndarray: JPEG 字节缓冲区
+    """
+    if quality is None:
+        quality = plan_jpeg_quality(image.shape[1], image.shape[0])
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError("JPEG编码失败")
+    return buffer
+
+
+def jpeg_data_url(buffer, mime: str = "image/jpeg") -> str:
+    """
+    由编码缓冲区直接生成 data URL
+
+    base64 直接读取缓冲区（不经过 BytesIO/tobytes），只产生一份 base64 结果和最终字符串。
+    """
+    encoded = base64.b64encode(memoryview(buffer))
+    return f"data:{mime};base64," + encoded.decode('ascii')
+
+
+def array_to_data_url(image: np.ndarray, quality: Optional[int] = None) -> str:
+    """灰度/二值 numpy 图像 → JPEG data URL"""
+    return jpeg_data_url(encode_jpeg_array(image, quality))
@@ -0,0 +1,320 @@
+"""
+LLM 调用封装与用量统计
+
+所有 chat.completions 调用都经过 chat_completion()：每次调用记录模型、提示词模板、
+prompt/completion tokens、耗时和重试次数，写入当前 span（见 tracing），并累加到当前的用量账本。
+
+账本通过 usage_scope() 嵌套：批量处理为整个批次开一个账本，每份报告再开一个子账本，
+子账本的记录同时计入父账本。每份报告的用量由 save_usage() 写到结果旁边的
+cache/<输出名>.usage.json，批次汇总由 print_usage_summary() 打印。
+
+同一份报告的几十次调用用 report_messages() 组装消息：系统提示和 OCR 文本在前、任务问题在后，
+前缀逐字节相同，提供商的前缀缓存可以命中；命中的 tokens 记在 cached_tokens 中。
+
+model 参数为 cascade.ModelCascade 时先调用快速模型，结果不合格再升级到大模型，升级次数记在 escalations 中。
+每次请求都带超时，慢于近期分位数时发出对冲请求（见 hedging），对冲次数记在 hedges 中。
+需要 JSON 结果的调用使用 json_completion()：请求 JSON 模式，按 schema 解析，先本地修复再重新请求（见 structured），
+修复次数与解析失败次数记在 repaired / parse_failures 中。
+并发的相同请求合并为一次调用（见 singleflight），被合并的次数记在 coalesced 中（不计 calls 与 tokens）。
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from medical_agent.cascade import ModelCascade
+from medical_agent.hedging import hedged_call
+from medical_agent.singleflight import coalesced_call, request_key
+from medical_agent.prompts import REPORT_CONTEXT_PROMPT
+from medical_agent.structured import (STRUCTURED_REREQUESTS, json_mode_key, json_mode_rejected, json_mode_supported,
+                                      parse_response, response_format_for)
+from medical_agent.tracing import span
+from medical_agent.utils import CACHE_DIR
+
+_COUNTERS = ("calls", "errors", "retries", "escalations", "hedges", "coalesced", "repaired", "parse_failures",
+             "report_calls", "prompt_tokens", "cached_tokens", "completion_tokens", "latency_s")
+# report_calls：携带完整报告上下文（REPORT_CONTEXT_PROMPT）的调用数，摘录与只发送名称的调用不计
+_REPORT_CONTEXT_HEAD = REPORT_CONTEXT_PROMPT.split("{ocr_text}")[0]
+
+_current_ledger: contextvars.ContextVar[Optional["UsageLedger"]] = contextvars.ContextVar(
+    "medical_agent_usage", default=None)
+
+
+def _empty() -> Dict[str, float]:
+    return {key: 0 for key in _COUNTERS}
+
+
+class UsageLedger:
+    """按提示词类型和模型累计调用次数与 tokens（线程安全）"""
+
+    def __init__(self, parent: Optional["UsageLedger"] = None):
+        self.parent = parent
+        self._lock = threading.Lock()
+        self.by_prompt: Dict[str, Dict[str, float]] = {}
+        self.by_model: Dict[str, Dict[str, float]] = {}
+
+    def add(self, kind: str, model: str, prompt_tokens: int, completion_tokens: int,
+            latency: float, retries: int, ok: bool, cached_tokens: int = 0, escalated: bool = False,
+            hedged: bool = False, coalesced: bool = False, full_report: bool = False) -> None:
+        with self._lock:
+            for bucket in (self.by_prompt.setdefault(kind, _empty()), self.by_model.setdefault(model, _empty())):
+                # 共用其他请求结果的调用没有发出请求，只计合并次数
+                if coalesced:
+                    bucket["coalesced"] += 1
+                    continue
+                bucket["calls"] += 1
+                bucket["errors"] += 0 if ok else 1
+                bucket["retries"] += 1 if retries else 0
+                bucket["escalations"] += 1 if escalated else 0
+                bucket["hedges"] += 1 if hedged else 0
+                bucket["report_calls"] += 1 if full_report else 0
+                bucket["prompt_tokens"] += prompt_tokens
+                bucket["cached_tokens"] += cached_tokens
+                bucket["completion_tokens"] += completion_tokens
+                bucket["latency_s"] += latency
+        if self.parent is not None:
+            self.parent.add(kind, model, prompt_tokens, completion_tokens, latency, retries, ok, cached_tokens,
+                            escalated, hedged, coalesced, full_report)
+
+    def record_parse(self, kind: str, status: str) -> None:
+        """记录一次 JSON 解析结果（structured.parse_response 的状态）"""
+        if status not in ("repaired", "invalid", "failed"):
+            return
+        with self._lock:
+            bucket = self.by_prompt.setdefault(kind, _empty())
+            bucket["repaired" if status == "repaired" else "parse_failures"] += 1
+        if self.parent is not None:
+            self.parent.record_parse(kind, status)
+
+    def totals(self) -> Dict[str, float]:
+        with self._lock:
+            total = _empty()
+            for bucket in self.by_prompt.values():
+                for key in _COUNTERS:
+                    total[key] += bucket[key]
+        total["latency_s"] = round(total["latency_s"], 3)
+        total["total_tokens"] = total["prompt_tokens"] + total["completion_tokens"]
+        return total
+
+    def to_dict(self) -> Dict[str, Any]:
+        def rounded(buckets):
+            return {name: {**b, "latency_s": round(b["latency_s"], 3)} for name, b in buckets.items()}
+        with self._lock:
+            by_prompt, by_model = rounded(self.by_prompt), rounded(self.by_model)
+        return {"totals": self.totals(), "by_prompt": by_prompt, "by_model": by_model}
+
+
+@contextmanager
+def usage_scope() -> Iterator[UsageLedger]:
+    """开启一个用量账本（嵌套时记录同时计入外层账本）"""
+    ledger = UsageLedger(parent=_current_ledger.get())
+    token = _current_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current_ledger.reset(token)
+
+
+def current_ledger() -> Optional[UsageLedger]:
+    return _current_ledger.get()
+
+
+def report_messages(system_prompt: str, ocr_text: str, task: str,
+                    context_prompt: str = REPORT_CONTEXT_PROMPT) -> List[Dict[str, Any]]:
+    """
+    组装针对某份报告的消息：系统提示 + 报告上下文在前（同一报告的所有请求共享），任务问题在后
+
+    Args:
+        system_prompt (str): 系统提示
+        ocr_text (str): 报告的 OCR 文本（或逐项目检索出的摘录）
+        task (str): 具体任务（已格式化的提示词模板）
+        context_prompt (str): 上下文模板，摘录使用 REPORT_EXCERPT_PROMPT
+
+    Returns:
+        List[Dict]: 消息列表
+    """
+    return [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': context_prompt.format(ocr_text=ocr_text) + task},
+    ]
+
+
+def carries_full_report(messages: List[Dict[str, Any]]) -> bool:
+    """消息中是否带有完整的报告上下文（report_messages 使用 REPORT_CONTEXT_PROMPT 组装）"""
+    return any(m.get("role") == "user" and isinstance(m.get("content"), str)
+               and m["content"].startswith(_REPORT_CONTEXT_HEAD) for m in messages)
+
+
+def _usage_tokens(completion: Any) -> Dict[str, int]:
+    usage = getattr(completion, "usage", None)
+    # OpenAI 兼容接口在 prompt_tokens_details.cached_tokens 中返回前缀缓存命中的 tokens
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        cached = details.get("cached_tokens")
+    else:
+        cached = getattr(details, "cached_tokens", 0)
+    return {
+        "prompt_tokens": int(getattr(usage, "prompt_tokens", 0) or 0),
+        "cached_tokens": int(cached or 0),
+        "completion_tokens": int(getattr(usage, "completion_tokens", 0) or 0),
+    }
+
+
+def chat_completion(client, model: Union[str, ModelCascade], messages: List[Dict[str, Any]], kind: str,
+                    prompt: Optional[str] = None, retries: int = 0,
+                    response_format: Optional[Dict[str, Any]] = None, **attrs: Any):
+    """
+    调用 chat.completions.create 并记录用量
+
+    Args:
+        client: OpenAI 兼容客户端
+        model (str | ModelCascade): 模型名称，或快速模型 + 大模型的级联
+        messages (List[Dict]): 消息列表
+        kind (str): 调用类型（classifier / segment / key_pick 等），span 名称为 "llm.<kind>"
+        prompt (str): 提示词模板名称，默认与 kind 相同
+        retries (int): 本次调用之前已重试的次数
+        response_format (Dict): 请求 JSON 模式时为 {"type": "json_object"}；后端不支持时自动去掉
+        **attrs: 额外的 span 属性（location、target_key 等）
+
+    Returns:
+        ChatCompletion: 原始响应（级联时为被采纳的那次调用）
+    """
+    if isinstance(model, ModelCascade):
+        if not model.routes(kind, client):
+            return _create(client, model.strong, messages, kind, prompt, retries, attrs, response_format)
+        try:
+            completion = _create(client, model.fast, messages, kind, prompt, retries, attrs, response_format)
+            if model.accept(kind, completion, messages):
+                return completion
+            reason = "rejected"
+        except Exception as e:
+            reason = type(e).__name__
+        return _create(client, model.strong, messages, kind, prompt, retries, attrs, response_format, escalated=reason)
+    return _create(client, model, messages, kind, prompt, retries, attrs, response_format)
+
+
+def _create(client, model: str, messages: List[Dict[str, Any]], kind: str, prompt: Optional[str],
+            retries: int, attrs: Dict[str, Any], response_format: Optional[Dict[str, Any]] = None,
+            escalated: Optional[str] = None):
+    if escalated:
+        attrs = {**attrs, "escalated": escalated}
+    with span(f"llm.{kind}", prompt=prompt or kind, model=model, retries=retries, **attrs) as s:
+        start = time.perf_counter()
+        tokens = {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        hedge = {"hedged": False}
+        coalesced = False
+        ok = False
+
+        def send(**extra):
+            # 合并在对冲外层：对冲发出的重复请求不会与原请求合并
+            return coalesced_call(kind, request_key(client, model, messages, extra.get("response_format")),
+                                  lambda: hedged_call(kind, lambda timeout: client.chat.completions.create(
+                                      model=model, messages=messages, timeout=timeout, **extra)))
+
+        try:
+            # 后端池按各后端实际发送的模型自行处理 JSON 模式
+            pooled = getattr(client, "handles_json_mode", False)
+            json_key = json_mode_key(client, model)
+            extra = {"response_format": response_format} \
+                if response_format and (pooled or json_mode_supported(json_key)) else {}
+            try:
+                (completion, hedge), coalesced = send(**extra)
+            except Exception as e:
+                if not extra or pooled or not json_mode_rejected(json_key, e):
+                    raise
+                (completion, hedge), coalesced = send()
+            if coalesced:
+                s.set(coalesced=True)
+            else:
+                tokens = _usage_tokens(completion)
+                s.set(**tokens)
+                if hedge["hedged"]:
+                    s.set(**hedge)
+            ok = True
+            return completion
+        finally:
+            ledger = _current_ledger.get()
+            if ledger is not None:
+                ledger.add(kind, model, tokens["prompt_tokens"], tokens["completion_tokens"],
+                           time.perf_counter() - start, retries, ok, tokens["cached_tokens"], bool(escalated),
+                           hedge["hedged"] and not coalesced, coalesced, carries_full_report(messages))
+
+
+def json_completion(client, model: Union[str, ModelCascade], messages: List[Dict[str, Any]], kind: str,
+                    prompt: Optional[str] = None, retries: int = 0, **attrs: Any) -> Any:
+    """
+    调用模型并解析 JSON 结果（JSON 模式 + schema 校验 + 本地修复，仍不合格时重新请求）
+
+    Args:
+        与 chat_completion() 相同
+
+    Returns:
+        Any: 解析后的 JSON；重新请求后仍不符合 schema 时返回最后一次能解析出的内容，完全无法解析时为 None
+
+    Raises:
+        Exception: 调用本身失败时抛出（由调用方的重试逻辑处理）
+    """
+    response_format = response_format_for(messages)
+    data = None
+    for attempt in range(STRUCTURED_REREQUESTS + 1):
+        completion = chat_completion(client, model, messages, kind, prompt, retries + attempt, response_format, **attrs)
+        parsed, status = parse_response(completion.choices[0].message.content or "", kind)
+        ledger = _current_ledger.get()
+        if ledger is not None:
+            ledger.record_parse(kind, status)
+        if status in ("ok", "repaired"):
+            return parsed
+        data = parsed if parsed is not None else data
+        if attempt < STRUCTURED_REREQUESTS:
+            print(f"⚠️ {kind} 返回的 JSON 无法解析或不符合格式，重新请求")
+    return data
+
+
+def save_usage(ledger: UsageLedger, output_name: str) -> Optional[str]:
+    """将单份报告的用量写到 cache/<输出名>.usage.json"""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = os.path.join(CACHE_DIR, f"{output_name}.usage.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(ledger.to_dict(), f, ensure_ascii=False, indent=2)
+        return path
+    except Exception as e:
+        print(f"⚠️ 保存用量统计失败: {e}")
+        return None
+
+
+def print_usage_summary(ledger: UsageLedger, reports: int = 0) -> None:
+    """打印批次的调用次数与 token 用量（按提示词类型，按 tokens 降序）"""
+    totals = ledger.totals()
+    if not totals["calls"]:
+        return
+    per_report = f"，平均每份报告 {totals['calls'] / reports:.1f} 次调用 / {totals['total_tokens'] / reports:.0f} tokens" \
+        if reports else ""
+    cache_rate = totals["cached_tokens"] / totals["prompt_tokens"] if totals["prompt_tokens"] else 0
+    print(f"\n🧮 模型用量: {totals['calls']} 次调用，prompt {totals['prompt_tokens']} "
+          f"(缓存命中 {totals['cached_tokens']}，{cache_rate:.0%}) + "
+          f"completion {totals['completion_tokens']} tokens{per_report}")
+    print(f"   {'类型':<20}{'调用':>6}{'失败':>6}{'重试':>6}{'升级':>6}{'对冲':>6}{'prompt tok':>12}{'cached':>10}"
+          f"{'compl tok':>11}{'耗时s':>9}")
+    buckets = ledger.to_dict()["by_prompt"]
+    for kind, b in sorted(buckets.items(), key=lambda kv: -(kv[1]["prompt_tokens"] + kv[1]["completion_tokens"])):
+        print(f"   {kind:<20}{b['calls']:>6}{b['errors']:>6}{b['retries']:>6}{b['escalations']:>6}{b['hedges']:>6}"
+              f"{b['prompt_tokens']:>12}{b['cached_tokens']:>10}{b['completion_tokens']:>11}{b['latency_s']:>9.2f}")
+    # 级联升级率：升级次数 / 快速模型调用次数
+    rates = [f"{kind} {b['escalations'] / max(b['calls'] - b['escalations'], 1):.0%}"
+             for kind, b in buckets.items() if b["escalations"]]
+    if rates:
+        print(f"   级联升级率: {'，'.join(rates)}")
+    # 请求合并：共用在途相同请求结果的次数
+    if totals["coalesced"]:
+        merged = [f"{kind} {b['coalesced']}" for kind, b in buckets.items() if b["coalesced"]]
+        print(f"   请求合并: {totals['coalesced']} 次（{'，'.join(merged)}）")
+    # JSON 解析：本地修复次数与修复后仍不合格（需要重新请求）的比例
+    if totals["repaired"] or totals["parse_failures"]:
+        failures = [f"{kind} {b['parse_failures'] / max(b['calls'], 1):.0%}"
+                    for kind, b in buckets.items() if b["parse_failures"]]
+        print(f"   JSON 解析: 本地修复 {totals['repaired']} 次，不合格 {totals['parse_failures']} 次"
+              + (f"（{'，'.join(failures)}）" if failures else ""))
@@ -37,6 +37,26 @@ def _build_alias_index(kb: List[Dict[str, Any]]) -> Tuple[Dict[str, str], Dict[s
     return alias_to_canonical, canonical_to_meta
 
 
+_alias_index_cache: Dict[Tuple[str, float], Tuple[Dict[str, str], Dict[str, Dict[str, Any]]]] = {}
+
+
+def load_alias_index() -> Tuple[Dict[str, str], Dict[str, Dict[str, Any]]]:
+    """Load the KB and build its alias index, cached by file path and mtime.
+
+    Long-running workers reuse the index across reports and only rebuild it
+    after medical_terms.json changes. Raises FileNotFoundError without a KB.
+    """
+    if not KB_PATH.exists():
+        raise FileNotFoundError(f"Knowledge base not found: {KB_PATH}")
+    key = (str(KB_PATH.resolve()), KB_PATH.stat().st_mtime)
+    index = _alias_index_cache.get(key)
+    if index is None:
+        index = _build_alias_index(_load_kb())
+        _alias_index_cache.clear()
+        _alias_index_cache[key] = index
+    return index
+
+
 def _match_name(name: str, alias_to_canonical: Dict[str, str]) -> str:
     """Return canonical name using exact or fuzzy match, else empty string."""
     if not name:
@@ -74,13 +94,11 @@ def normalize_table_with_kb(df: pd.DataFrame) -> pd.DataFrame:
         return df
 
     try:
-        kb = _load_kb()
+        alias_to_canonical, canonical_meta = load_alias_index()
     except FileNotFoundError:
         # no KB, skip
         return df
 
-    alias_to_canonical, canonical_meta = _build_alias_index(kb)
-
     df = df.copy()
     for i in range(len(df)):
         name = str(df.at[i, "名称"]) if "名称" in df.columns else ""
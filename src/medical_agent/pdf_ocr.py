@@ -0,0 +1,106 @@
+"""
+PDF 逐页 OCR（批量导入与单文件处理共用）
+
+栅格化为灰度页 → 共享线程池上预处理与分诊（见 triage）→ 按页顺序 OCR 内容页。
+分诊跳过的页面（空白页、第1页的低信息页）不做 OCR；所有页面都被跳过时，对信息量最大的一页 OCR 兜底。
+"""
+from typing import Any, Dict, List, Optional
+
+from medical_agent.imaging import array_to_data_url, image_content_from_data_url, pdf_to_gray_arrays
+from medical_agent.tracing import current_span, span, traced
+from medical_agent.triage import better_fallback, record_triage, skip_ocr, submit_preprocess_and_triage
+
+
+@traced("ocr.page")
+def ocr_page_image(image, page_no: int, file_name: str,
+                   state_context: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    对单页预处理后的图像运行OCR节点
+
+    Args:
+        image (np.ndarray): 预处理后的页面
+        page_no (int): 页码（从1开始）
+        file_name (str): PDF文件名
+        state_context (Dict): 写入智能体状态 context 的额外字段（处理开始时间、文件名等）
+
+    Returns:
+        Optional[str]: OCR文本，失败时返回 None
+    """
+    # 流水线模块按 `from agent import ...` 导入（与调用方共用同一个 agent 模块）
+    from agent import AgentState, init_llms_for_ocr, ocr_node
+
+    print(f"正在处理第{page_no}页...")
+    current_span().set(file=file_name, page=page_no)
+
+    # 编码为JPEG并直接生成 data URL（附带OCR模型像素预算）
+    image_content = image_content_from_data_url(array_to_data_url(image))
+
+    initial_state = AgentState()
+    initial_state['image_content'] = image_content
+    initial_state['context'] = dict(state_context or {})
+
+    try:
+        # 初始化（OCR专用，不创建表格），只运行OCR节点
+        state = init_llms_for_ocr(initial_state)
+        state['image_content'] = image_content
+        state = ocr_node(state)
+
+        if 'context' in state and 'ocr' in state['context']:
+            print(f"✅ 第{page_no}页OCR完成")
+            return state['context']['ocr']
+        print(f"⚠️ 第{page_no}页OCR未获取到文本")
+    except Exception as e:
+        print(f"❌ 处理第{page_no}页时出错: {e}")
+    return None
+
+
+def ocr_pdf_pages(pdf_path: str, file_name: str, state_context: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    栅格化PDF并逐页OCR（分诊跳过空白/低信息页）
+
+    Args:
+        pdf_path (str): PDF文件路径
+        file_name (str): PDF文件名
+        state_context (Dict): 传给每页OCR的智能体状态 context 字段
+
+    Returns:
+        List[str]: ["=== 第N页 ===\nOCR文本", ...]
+    """
+    # 1. PDF直接栅格化为灰度图
+    with span("rasterize", file=file_name) as s:
+        pages = pdf_to_gray_arrays(pdf_path)
+        s.set(pages=len(pages))
+    if not pages:
+        return []
+
+    # 2. 图像预处理与页面分诊（提交到共享线程池并发执行，OCR 按页顺序等待结果）
+    preprocess_futures = submit_preprocess_and_triage(pages)
+    pages = None  # 原始灰度页由线程池任务持有，处理完即可释放
+
+    all_ocr_texts = []
+    # 分诊判定为空白的页面（以及第1页的低信息页）不做OCR，保留信息量最大的一页作为兜底
+    fallback_page = None
+    content_pages = 0
+
+    for i, future in enumerate(preprocess_futures):
+        image, decision = future.result()
+        print(f"✅ 预处理完成第{i+1}页")
+        record_triage(file_name, i + 1, decision)
+        if skip_ocr(decision, i + 1):
+            print(f"⏭️ 第{i+1}页判定为 {decision['label']}，跳过OCR")
+            fallback_page = better_fallback(fallback_page, (i, image, decision))
+            continue
+
+        content_pages += 1
+        ocr_text = ocr_page_image(image, i + 1, file_name, state_context)
+        if ocr_text is not None:
+            all_ocr_texts.append(f"=== 第{i+1}页 ===\n{ocr_text}")
+
+    if content_pages == 0 and fallback_page is not None:
+        i, image, _ = fallback_page
+        print(f"⚠️ 所有页面均被分诊跳过，对信息量最大的第{i+1}页进行OCR")
+        ocr_text = ocr_page_image(image, i + 1, file_name, state_context)
+        if ocr_text is not None:
+            all_ocr_texts.append(f"=== 第{i+1}页 ===\n{ocr_text}")
+
+    return all_ocr_texts
@@ -0,0 +1,144 @@
+"""
+数字 PDF 文字层快速通道
+
+超声工作站直接导出的 PDF 自带文字层。用 poppler 的 pdftotext（pdf2image 本身即依赖 poppler）
+直接提取文本，判定完整可用时跳过栅格化和 OCR；扫描件、缺少 ToUnicode 映射导致乱码的 PDF、
+以及含有扫描图片页的混合 PDF 仍走 OCR 通路。
+"""
+import os
+import re
+import subprocess
+from typing import Dict, List, Optional
+
+# 每页至少需要的有效字符数（汉字、字母、数字）
+TEXT_LAYER_MIN_CHARS = int(os.getenv('TEXT_LAYER_MIN_CHARS', 40))
+# 乱码字符占比上限
+TEXT_LAYER_MAX_GARBAGE = float(os.getenv('TEXT_LAYER_MAX_GARBAGE', 0.05))
+POPPLER_TIMEOUT = 30
+
+_CID_RE = re.compile(r"\(cid:\d+\)")
+_PDFIMAGES_ROW_RE = re.compile(r"^\s*(\d+)\s+\d+\s+(image|mask|smask|stencil)\b")
+
+
+def text_layer_enabled() -> bool:
+    return os.getenv('PDF_TEXT_LAYER', '1') != '0'
+
+
+def extract_text_layer(pdf_path: str) -> Optional[List[str]]:
+    """
+    用 pdftotext -layout 提取每页文字层（保留版面，表格列对齐）
+
+    Args:
+        pdf_path (str): PDF文件路径
+
+    Returns:
+        Optional[List[str]]: 每页文本；poppler 不可用或提取失败时返回 None
+    """
+    try:
+        result = subprocess.run(
+            ["pdftotext", "-layout", "-enc", "UTF-8", "-q", str(pdf_path), "-"],
+            capture_output=True, timeout=POPPLER_TIMEOUT, check=True,
+        )
+    except FileNotFoundError:
+        print("⚠️ 未找到 pdftotext（poppler），跳过文字层提取")
+        return None
+    except (subprocess.SubprocessError, OSError) as e:
+        print(f"⚠️ 文字层提取失败: {e}")
+        return None
+
+    pages = result.stdout.decode('utf-8', errors='replace').split('\f')
+    # pdftotext 在最后一页之后也会输出换页符
+    if pages and not pages[-1].strip():
+        pages = pages[:-1]
+    return pages
+
+
+def _is_garbage(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        ch == '\ufffd'
+        or 0xE000 <= code <= 0xF8FF              # 私有区：字体缺少 ToUnicode 映射
+        or (code < 0x20 and ch not in '\n\r\t')  # 控制字符
+        # 拉丁补充区：中文字体编码错位时的典型乱码（保留医学报告中常见的符号）
+        or (0x80 <= code <= 0xFF and ch not in '°±×·µ²³')
+    )
+
+
+def text_quality(text: str) -> Dict[str, float]:
+    """
+    统计单页文本质量
+
+    Returns:
+        Dict[str, float]: meaningful（汉字/字母/数字个数）、garbage_ratio（乱码占比）
+    """
+    cid_count = len(_CID_RE.findall(text))
+    text = _CID_RE.sub("", text)
+    chars = [ch for ch in text if not ch.isspace()]
+    meaningful = sum(1 for ch in chars if ch.isalnum())
+    garbage = sum(1 for ch in chars if _is_garbage(ch)) + cid_count
+    total = len(chars) + cid_count
+    return {
+        "meaningful": meaningful,
+        "garbage_ratio": garbage / total if total else 0.0,
+    }
+
+
+def is_usable_page_text(text: str) -> bool:
+    quality = text_quality(text)
+    return quality["meaningful"] >= TEXT_LAYER_MIN_CHARS and quality["garbage_ratio"] <= TEXT_LAYER_MAX_GARBAGE
+
+
+def pages_with_images(pdf_path: str) -> Optional[set]:
+    """用 pdfimages -list 找出含有图片的页码（从1开始），失败时返回 None"""
+    try:
+        result = subprocess.run(
+            ["pdfimages", "-list", str(pdf_path)],
+            capture_output=True, timeout=POPPLER_TIMEOUT, check=True, text=True,
+        )
+    except (subprocess.SubprocessError, OSError):
+        return None
+    pages = set()
+    for line in result.stdout.splitlines():
+        m = _PDFIMAGES_ROW_RE.match(line)
+        if m:
+            pages.add(int(m.group(1)))
+    return pages
+
+
+def usable_text_layer_pages(pdf_path: str) -> List[str]:
+    """
+    判断 PDF 文字层是否完整可用，可用时返回按页格式化的文本
+
+    每一页都必须有足够的有效字符且乱码占比低；没有文字的页只有在不含图片时
+    （空白页）才允许存在，否则说明是扫描页，整份文件回退到 OCR。
+
+    Args:
+        pdf_path (str): PDF文件路径
+
+    Returns:
+        List[str]: ["=== 第N页 ===\\n文本", ...]，与 OCR 通路的页文本格式一致；不可用时返回空列表
+    """
+    if not text_layer_enabled():
+        return []
+    pages = extract_text_layer(pdf_path)
+    if not pages:
+        return []
+
+    empty_pages = []
+    for i, text in enumerate(pages, 1):
+        if not text.strip():
+            empty_pages.append(i)
+        elif not is_usable_page_text(text):
+            print(f"ℹ️ 第{i}页文字层不完整或为乱码，使用OCR")
+            return []
+
+    if len(empty_pages) == len(pages):
+        return []
+    if empty_pages:
+        image_pages = pages_with_images(pdf_path)
+        if image_pages is None or image_pages & set(empty_pages):
+            print(f"ℹ️ 第{empty_pages}页没有文字层（可能为扫描页），使用OCR")
+            return []
+
+    print(f"⚡ 使用PDF文字层，跳过栅格化与OCR（{len(pages) - len(empty_pages)}页）")
+    return [f"=== 第{i}页 ===\n{text.rstrip()}" for i, text in enumerate(pages, 1) if text.strip()]
@@ -1,7 +1,26 @@
-FILL_IN_FORM_PROMPT = """
-我将给你一段医生诊断报告经过OCR提取之后的文本。基于以下文本，判断是否在报告中提及了以下关键信息。如果提及了，请从文本中总结或提取出以下内容并返回给我，如果没有提及，请返回NO给我
+# 报告上下文前缀：同一份报告的所有提取请求都以「系统提示 + 本前缀」开头，各任务的问题放在最后，
+# 这样一份报告的几十次请求共享同一段前缀，提供商的前缀缓存（prompt caching）可以直接复用。
+# 下面带 OCR 文本的任务模板都不再包含 {ocr_text}，由 llm.report_messages() 拼接在本前缀之后。
+REPORT_CONTEXT_PROMPT = """
+我将给你一段医疗诊断报告经过OCR提取之后的文本，之后是针对这份报告的具体任务。
 **医疗诊断报告：**
+-----
 {ocr_text}
+-----
+"""
+
+# 逐项目请求只发送报告开头和提到该项目的语句（见 retrieval.ReportIndex）
+REPORT_EXCERPT_PROMPT = """
+我将给你一份医疗诊断报告的摘录：报告开头的基本信息，以及报告中提到该项目的全部语句（报告其余部分未提及该项目），之后是具体任务。
+**医疗诊断报告：**
+-----
+{ocr_text}
+-----
+"""
+
+
+FILL_IN_FORM_PROMPT = """
+**任务：**基于以上报告，判断是否在报告中提及了以下关键信息。如果提及了，请从文本中总结或提取出以下内容并返回给我，如果没有提及，请返回NO给我。请返回标准JSON格式。
 **关键信息/指标：**
 {key_info}
 **返回格式：**
@@ -25,9 +44,7 @@ FILL_IN_FORM_PROMPT = """
 
 
 FILLIN_PROMPT_2 = """
-我将给你一段医生诊断报告经过OCR提取之后的文本。基于以下文本，判断该患者的“冠状动脉起源、走形及终止”是正常还是异常。请回复正常或者异常，并简要给出理由。
-**医疗诊断报告：**
-{ocr_text}
+**任务：**基于以上报告，判断该患者的“冠状动脉起源、走形及终止”是正常还是异常。请回复正常或者异常，并简要给出理由。请返回标准JSON格式。
 **返回格式：**
 {{
 "key_name": "冠状动脉起源、走形及终止", # 固定
@@ -45,9 +62,7 @@ FILLIN_PROMPT_2 = """
 
 
 FILLIN_PROMPT_3 = """
-我将给你一段医生诊断报告经过OCR提取之后的文本。基于以下文本，判断该患者的属于“右冠优势型”， “左冠优势型”， 还是“均衡型”。请回复判断结果，并简要给出理由。请返回标准JSON格式。
-**医疗诊断报告：**
-{ocr_text}
+**任务：**基于以上报告，判断该患者的属于“右冠优势型”， “左冠优势型”， 还是“均衡型”。请回复判断结果，并简要给出理由。请返回标准JSON格式。
 **返回格式：**
 {{
 "key_name": "冠脉优势型",  # 固定
@@ -65,9 +80,7 @@ FILLIN_PROMPT_3 = """
 
 
 FILLIN_PROMPT_4 = """
-我将给你一段医生诊断报告经过OCR提取之后的文本。基于以下文本，提取“异常描述”。如果没有任何异常描述，请返回“NO”给我。请返回标准JSON格式。
-**医疗诊断报告：**
-{ocr_text}
+**任务：**基于以上报告，提取“异常描述”。如果没有任何异常描述，请返回“NO”给我。请返回标准JSON格式。
 **返回格式：**
 {{
 "key_name": "异常描述",  # 固定
@@ -78,7 +91,7 @@ FILLIN_PROMPT_4 = """
 
 
 FILLIN_PROMPT_5 = """
-我将给你一段医生诊断报告经过OCR提取之后的文本。请你基于以下文本，提取冠脉节段"{location}(名称)"的以下字段信息：
+**任务：**请你基于以上报告，提取冠脉节段"{location}(名称)"的以下字段信息：
 - 斑块种类
 - 类型
 - 症状
@@ -94,9 +107,6 @@ FILLIN_PROMPT_5 = """
 - "狭窄程度"可选：局限性狭窄（长度＜10mm）、阶段性狭窄（10-20mm）、弥漫性狭窄（＞20mm）；
 - 其余字段如未提及请填写"-"。
 
-**医疗诊断报告：**
-{ocr_text}
-
 **返回格式：**
 {{
 "斑块种类": "value_斑块种类",
@@ -110,17 +120,17 @@ FILLIN_PROMPT_5 = """
 **只返回JSON，不要输出其他内容。**
 """
 
+# 报告未提及或仅有阴性描述的节段不调用模型，直接使用该默认结果
+FILLIN_PROMPT_5_DEFAULT = {"斑块种类": "-", "类型": "-", "症状": "-", "数值": "-", "狭窄程度": "-", "闭塞": "否"}
+
 
 REPORT_CLASSIFIER_PROMPT = """
-我将给你一段医疗报告经过OCR提取之后的文本。请你判断这份报告主要是关于什么类型的检查。
+**任务：**请你判断以上报告主要是关于什么类型的检查。
 
 请仔细阅读报告内容，然后判断它是：
 1. **冠脉CTA报告** - 主要描述冠状动脉血管结构、斑块、狭窄程度等
 2. **心脏超声报告** - 主要描述心脏腔室尺寸、心功能、血流速度等生理功能指标
 
-**医疗诊断报告：**
-{ocr_text}
-
 **判断依据：**
 - 如果报告中主要包含"左主干"、"前降支"、"回旋支"、"右冠"、"斑块"、"狭窄"、"钙化"等词汇，则为冠脉CTA报告
 - 如果报告中主要包含"射血分数"、"舒张期"、"收缩期"、"房室腔"、"瓣膜"、"血流速度"、"多普勒"等词汇，则为心脏超声报告
@@ -137,7 +147,7 @@ REPORT_CLASSIFIER_PROMPT = """
 
 
 ULTRASOUND_EXTRACT_PROMPT = """
-我将给你一段心脏超声诊断报告经过OCR提取之后的文本。请你基于以下文本，**仅为超声测量项目"{location}"**提取以下字段信息：
+**任务：**以上是一份心脏超声诊断报告。请你基于该报告，**仅为超声测量项目"{location}"**提取以下字段信息：
 - 斑块种类
 - 类型  
 - 症状
@@ -160,9 +170,6 @@ ULTRASOUND_EXTRACT_PROMPT = """
 
 {dynamic_alias_rules}
 
-**医疗诊断报告：**
-{ocr_text}
-
 **返回格式：**
 {{
 "斑块种类": "-",
@@ -178,7 +185,7 @@ ULTRASOUND_EXTRACT_PROMPT = """
 
 # 新增：超声头部信息抽取（严格缺失留空）
 ULTRASOUND_HEADER_PROMPT = """
-你是一名超声报告抽取助手。请从以下OCR文本中，仅提取心脏超声报告的头部信息。严格遵守：若某字段在文本中未明确给出，返回空字符串。不要推测或补全。
+**任务：**你是一名超声报告抽取助手。请从以上OCR文本中，仅提取心脏超声报告的头部信息。严格遵守：若某字段在文本中未明确给出，返回空字符串。不要推测或补全。
 
 需要抽取并返回的字段键名（必须完全一致）：
 - 姓名
@@ -201,26 +208,18 @@ ULTRASOUND_HEADER_PROMPT = """
 - "超声所见"与"超声提示"通常是段落或多行内容，请截取对应标题下的全部文本，直到下一个大标题或文本结束。
 - 如果没有明确的标题，请根据常见格式定位（例如“超声所见:”、“所见：”、“超声提示:”、“提示：”）。
 
-OCR文本：
------
-{ocr_text}
------
 仅返回一个严格的JSON对象，键为上述字段名，值为字符串（没有则为空字符串）：
 """
 
 # 新增：从全文提取全部“测量项目 → 数值(可含单位)”的字典
 ULTRASOUND_ALL_MEASUREMENTS_PROMPT = """
-请从以下心脏超声报告文本中，抽取所有"测量项目 → 数值"的映射，尽量保留紧随数值后的单位（若有）。
+**任务：**请从以上心脏超声报告文本中，抽取所有"测量项目 → 数值"的映射，尽量保留紧随数值后的单位（若有）。
 
 严格要求：
 - 只返回 JSON 对象，键是测量项目名称（原文或报告常用写法），值是字符串形式的数值（可包含单位，如 "18mmHg" 或 "59%"）。
 - 不要推测不存在的项目；找不到就不要返回该键。
 - 不要汇总或改写名称，保留原文或常用写法，以便后续标准化。
 
-心脏超声OCR文本：
------
-{ocr_text}
------
 仅返回 JSON 对象：
 """
 
@@ -273,6 +272,20 @@ query：{query}
 仅返回严格 JSON，例如 {{"match":"左心室射血分数"}} 或 {{"match":"no_match"}}。不要返回多余文字。
 """
 
+# 批量别名校验：一份报告的所有灰区项一次请求，按 id 返回每项的 exact_name 或 no_match
+ALIAS_BATCH_VALIDATION_PROMPT = """
+你是医学术语规范化助手。下面每一项给出一个 query 和它的 candidates，请逐项判断 query 是否与该项 candidates 中的某一项表示同一测量项目（可能是变体、简称、同义写法）。
+严格要求：
+- 各项独立判断，只能从该项自己的 candidates 里选择
+- 只有在把握充分时，才选出一个 exact_name；否则该项返回 "no_match"
+- 每个 id 都必须出现在结果中
+
+输入（JSON 数组，每项包含 id、query、candidates）：
+{items_json}
+
+仅返回严格 JSON 对象，键为 id，值为选中的 exact_name 或 "no_match"，例如 {{"q1":"左心室射血分数","q2":"no_match"}}。不要返回多余文字。
+"""
+
 # 从最终输出表格中回填关键指标：给表格JSON与同义词映射，请仅在表内查找并返回数值（可附单位），未找到留空
 ULTRASOUND_KEYS_FROM_TABLE_PROMPT = """
 你将获得一张“已经整理好的心脏超声输出表格”的JSON表示（数组，每项是一行，字段包含：名称、英文、数值、单位）。
@@ -329,6 +342,7 @@ ULTRASOUND_KEY_NAME_MATCH_PROMPT = """
 """
 
 # 单键匹配：给出一个 target_key 与候选名称列表，请只从候选中选出与 target_key 同义/全称/常用写法最一致的一个名称；不确定则返回空字符串。
+# 同一份报告的各个 target_key 共用候选列表，因此候选列表在前、target_key 放在最后，便于前缀缓存。
 ULTRASOUND_KEY_NAME_PICK_PROMPT = """
 你是医学术语匹配助手。请判断 target_key 的规范含义（全称/中文），并在 candidate_names 列表中找出与其同义/等价的一个名称。
 严格要求：
@@ -337,6 +351,6 @@ ULTRASOUND_KEY_NAME_PICK_PROMPT = """
 - 仅返回严格 JSON：{{"match": "候选中的某一项或空字符串"}}，不要输出其他文字。
 
 输入：
-- target_key: {target_key}
 - candidate_names (JSON): {candidate_names_json}
+- target_key: {target_key}
 """
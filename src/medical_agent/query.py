@@ -0,0 +1,460 @@
+"""
+跨报告测量值查询
+
+每个病例的结构化结果以独立 parquet 保存在 cache 目录下（见 utils.save_df_to_cache）。
+本模块把这些文件增量汇总为按测量项排序的索引分片（含解析后的数值列）：每次更新只把新增或修改的病例
+写成新分片、重写包含过期病例的分片（每个分片的病例数有上限），小分片过多时再合并。查询时通过 pyarrow.dataset 做列裁剪与
+谓词下推，只读取命中的 row group。
+
+时间范围按报告的检查日期（report_date，提取时写入结果 parquet 的元数据，见 utils.extract_report_date）
+筛选；没有识别出日期的病例在按日期筛选时不会命中。按处理时间筛选时使用 date_field="processed_at"。
+
+示例：
+    from medical_agent.query import build_measurement_index, query_measurements
+    build_measurement_index()
+    df = query_measurements("LVEF", "<", 40, since="2025-07-01", until="2025-10-01")
+"""
+import itertools
+import json
+import os
+import re
+import time
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from medical_agent.utils import CACHE_DIR
+
+INDEX_DIR = os.path.join(CACHE_DIR, "_index")
+# 索引分片目录：每个分片为 <名称>.parquet + <名称>.metrics.parquet（测量项目录）+ <名称>.cases.json（病例清单）
+PARTS_DIR = "parts"
+CASES_SUFFIX = ".cases.json"
+# 单个分片最多包含的病例数：修改或删除病例时只重写所在分片，重写量不随病例总数增长
+INDEX_PART_CASES = int(os.getenv('QUERY_INDEX_PART_CASES', 10000))
+# 未满分片（病例数 < INDEX_PART_CASES）超过该值时合并
+INDEX_MAX_PARTS = int(os.getenv('QUERY_INDEX_MAX_PARTS', 16))
+_part_seq = itertools.count()
+
+# 旧版单文件索引
+LEGACY_INDEX_FILE = "measurements.parquet"
+LEGACY_CATALOG_FILE = "metrics.parquet"
+LEGACY_MANIFEST_FILE = "manifest.json"
+
+# 不属于单个病例的缓存文件
+EXCLUDED_CACHE_FILES = {"qwen_cache"}
+
+# 单个 row group 的行数：按 metric 排序后，row group 统计信息即可支持 metric 过滤下推
+ROW_GROUP_SIZE = 64 * 1024
+
+INDEX_SCHEMA = pa.schema([
+    ("metric", pa.string()),        # 查询键：优先取括号内简写，否则取中文名
+    ("case_id", pa.string()),       # 病例（parquet 文件名，不含扩展名）
+    ("report_date", pa.timestamp("ms")),   # 报告的检查日期（无法识别时为空）
+    ("processed_at", pa.timestamp("ms")),  # 结果文件的修改时间（处理时间，重新处理后会变化）
+    ("名称", pa.string()),
+    ("英文", pa.string()),
+    ("数值", pa.string()),
+    ("单位", pa.string()),
+    ("value", pa.float64()),        # 解析出的单一数值，复合值（如 200x160）为空
+])
+
+# 从病例文件读取的列
+RAW_COLUMNS = ("名称", "英文", "数值", "单位")
+
+# 默认返回列（不含 名称/英文 等长字符串列，减少转换开销）
+DEFAULT_COLUMNS = ["case_id", "metric", "数值", "单位", "value", "report_date", "processed_at"]
+DATE_FIELDS = ("report_date", "processed_at")
+
+_NAME_ABBR_RE = re.compile(r"^(.*?)[\(（]([^\)）]*)[\)）]\s*$")
+_NUMBER_RE = r"(-?\d+(?:\.\d+)?)"
+_COMPOUND_RE = r"\d\s*[x×*]\s*\d"
+
+_OPS = {
+    "<": pc.less,
+    "<=": pc.less_equal,
+    ">": pc.greater,
+    ">=": pc.greater_equal,
+    "==": pc.equal,
+    "!=": pc.not_equal,
+}
+
+
+def _split_name(name: str):
+    """将 "左心室射血分数(LVEF)" 拆分为 ("左心室射血分数", "LVEF")"""
+    name = str(name or "").strip()
+    m = _NAME_ABBR_RE.match(name)
+    if m:
+        return m.group(1).strip(), m.group(2).strip()
+    return name, ""
+
+
+def _metric_key(name: str) -> str:
+    base, abbr = _split_name(name)
+    return abbr or base
+
+
+def _parse_numeric(values: pd.Series) -> pd.Series:
+    """从数值字符串中解析单一数值；复合值与无数字的值返回 NaN"""
+    s = values.fillna("").astype(str)
+    numbers = pd.to_numeric(s.str.extract(_NUMBER_RE, expand=False), errors="coerce")
+    numbers[s.str.contains(_COMPOUND_RE, regex=True)] = float("nan")
+    return numbers
+
+
+def _list_case_files(cache_dir: str) -> Dict[str, int]:
+    """返回 {case_id: mtime_ns}，使用 os.scandir 避免逐个 stat"""
+    cases = {}
+    if not os.path.isdir(cache_dir):
+        return cases
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if not entry.is_file() or not entry.name.endswith(".parquet"):
+                continue
+            case_id = entry.name[:-len(".parquet")]
+            if case_id in EXCLUDED_CACHE_FILES:
+                continue
+            cases[case_id] = entry.stat().st_mtime_ns
+    return cases
+
+
+def _report_date(schema: pa.Schema) -> Optional[pd.Timestamp]:
+    """结果 parquet 元数据（DataFrame.attrs）中的检查日期"""
+    attrs = (schema.metadata or {}).get(b"PANDAS_ATTRS")
+    try:
+        value = json.loads(attrs).get("report_date") if attrs else None
+        return pd.Timestamp(value) if value else None
+    except (ValueError, AttributeError):
+        return None
+
+
+def _read_case(cache_dir: str, case_id: str, mtime_ns: int) -> Optional[pa.Table]:
+    """读取单个病例的原始测量列（附加 case_id 与时间列），清洗与数值解析在 _normalize_rows 中按批进行"""
+    path = os.path.join(cache_dir, f"{case_id}.parquet")
+    try:
+        schema = pq.read_schema(path)
+        available = set(schema.names)
+        if "名称" not in available or "数值" not in available:
+            return None
+        table = pq.read_table(path, columns=[c for c in RAW_COLUMNS if c in available])
+    except Exception as e:
+        print(f"⚠️ 读取 {path} 失败，跳过: {e}")
+        return None
+
+    n = table.num_rows
+    columns = {}
+    for col in RAW_COLUMNS:
+        values = table[col] if col in available else pa.nulls(n, pa.string())
+        columns[col] = values.cast(pa.string()) if values.type != pa.string() else values
+    report_date = _report_date(schema)
+    columns["case_id"] = pa.array([case_id] * n, pa.string())
+    columns["report_date"] = pa.array([report_date.to_pydatetime() if report_date is not None else None] * n,
+                                      pa.timestamp("ms"))
+    columns["processed_at"] = pa.array([mtime_ns // 1_000_000] * n, pa.int64()).cast(pa.timestamp("ms"))
+    return pa.table(columns)
+
+
+def _normalize_rows(table: pa.Table) -> pa.Table:
+    """去掉空值行，补充 metric 与 value 列，转换为 INDEX_SCHEMA"""
+    df = table.to_pandas()
+    df = df[df["数值"].notna()]
+    df = df[~df["数值"].str.strip().isin(["", "-", "NO"])]
+    df = df.fillna({"英文": "", "单位": ""}).astype({"名称": str})
+    df["metric"] = df["名称"].map(_metric_key)
+    df["value"] = _parse_numeric(df["数值"])
+    return pa.Table.from_pandas(df[INDEX_SCHEMA.names], schema=INDEX_SCHEMA, preserve_index=False)
+
+
+def _parts_dir(index_dir: str) -> str:
+    return os.path.join(index_dir, PARTS_DIR)
+
+
+def _part_path(index_dir: str, part: str, suffix: str = ".parquet") -> str:
+    return os.path.join(_parts_dir(index_dir), part + suffix)
+
+
+def _remove_part(index_dir: str, part: str) -> None:
+    # 先删病例清单（提交标记），之后中断也只会留下未提交的文件，下次加载时清理
+    for suffix in (CASES_SUFFIX, ".metrics.parquet", ".parquet"):
+        try:
+            os.remove(_part_path(index_dir, part, suffix))
+        except FileNotFoundError:
+            pass
+
+
+def _load_parts(index_dir: str) -> Dict[str, Dict[str, int]]:
+    """
+    已提交的索引分片 {分片名: {case_id: mtime_ns}}
+
+    病例清单（.cases.json）最后写入，作为分片的提交标记；没有清单的文件（写入中断）与格式过期的分片被删除，
+    其中的病例不在任何清单里，下次构建时会重新读取
+    """
+    parts_dir = _parts_dir(index_dir)
+    if not os.path.isdir(parts_dir):
+        return {}
+    names = os.listdir(parts_dir)
+    committed = {n[:-len(CASES_SUFFIX)] for n in names if n.endswith(CASES_SUFFIX)}
+    parts = {}
+    for part in sorted(committed):
+        try:
+            if not pq.read_schema(_part_path(index_dir, part)).remove_metadata().equals(INDEX_SCHEMA):
+                raise ValueError("索引格式已变化")
+            with open(_part_path(index_dir, part, CASES_SUFFIX), "r", encoding="utf-8") as f:
+                parts[part] = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 索引分片 {part} 不可用，将重新构建其中的病例: {e}")
+            _remove_part(index_dir, part)
+    for name in names:
+        part = name.split(".", 1)[0]
+        if part not in committed:
+            os.remove(os.path.join(parts_dir, name))
+    return parts
+
+
+def _write_part(index_dir: str, table: pa.Table, cases: Dict[str, int]) -> str:
+    """写入一个按 metric 排序的分片、它的测量项目录与病例清单（最后写入）"""
+    os.makedirs(_parts_dir(index_dir), exist_ok=True)
+    part = f"part-{time.time_ns():020d}-{os.getpid()}-{next(_part_seq)}"
+    table = table.sort_by([("metric", "ascending"), ("case_id", "ascending")])
+    pq.write_table(table, _part_path(index_dir, part), row_group_size=ROW_GROUP_SIZE)
+    # 测量项目录：名称解析只需读取这些小表，无需扫描索引
+    catalog = table.group_by(["metric", "名称", "英文"]).aggregate([("case_id", "count")])
+    pq.write_table(catalog.rename_columns(["metric", "名称", "英文", "count"]),
+                   _part_path(index_dir, part, ".metrics.parquet"))
+    tmp_path = _part_path(index_dir, part, CASES_SUFFIX + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cases, f)
+    os.replace(tmp_path, _part_path(index_dir, part, CASES_SUFFIX))
+    return part
+
+
+def _write_parts(index_dir: str, table: pa.Table, cases: Dict[str, int]) -> List[str]:
+    """按 INDEX_PART_CASES 把病例分组，每组写成一个分片"""
+    ids = sorted(cases)
+    if len(ids) <= INDEX_PART_CASES:
+        return [_write_part(index_dir, table, cases)]
+    parts = []
+    for start in range(0, len(ids), INDEX_PART_CASES):
+        chunk = ids[start:start + INDEX_PART_CASES]
+        rows = table.filter(pc.is_in(table["case_id"], value_set=pa.array(chunk)))
+        parts.append(_write_part(index_dir, rows, {c: cases[c] for c in chunk}))
+    return parts
+
+
+def _remove_legacy_index(index_dir: str) -> None:
+    # 旧版单文件索引（每次更新整体重写）
+    for name in (LEGACY_INDEX_FILE, LEGACY_CATALOG_FILE, LEGACY_MANIFEST_FILE):
+        path = os.path.join(index_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def compact_measurement_index(index_dir: str = INDEX_DIR) -> int:
+    """
+    合并未满的分片（病例数 < INDEX_PART_CASES），按 INDEX_PART_CASES 重新分组写出
+
+    未满分片超过 INDEX_MAX_PARTS 时由 build_measurement_index 自动执行；已满的分片不会被重写。
+
+    Returns:
+        int: 参与合并的分片数（不超过 1 个时不合并）
+    """
+    parts = {part: cases for part, cases in _load_parts(index_dir).items() if len(cases) < INDEX_PART_CASES}
+    if len(parts) <= 1:
+        return len(parts)
+    table = pa.concat_tables([pq.read_table(_part_path(index_dir, part)) for part in parts])
+    cases = {case: mtime for part_cases in parts.values() for case, mtime in part_cases.items()}
+    written = _write_parts(index_dir, table, cases)
+    for part in parts:
+        _remove_part(index_dir, part)
+    print(f"🗜️ 测量值索引已合并: {len(parts)} 个分片 → {len(written)}")
+    return len(parts)
+
+
+def build_measurement_index(cache_dir: str = CACHE_DIR, index_dir: str = INDEX_DIR) -> Dict[str, int]:
+    """
+    增量构建/更新测量值索引
+
+    只读取新增或修改过的病例文件（按 mtime 判断），写成新分片；修改或删除的病例只重写包含它们的分片
+    （每个分片至多 INDEX_PART_CASES 个病例）。未满分片超过 INDEX_MAX_PARTS 时合并（见 compact_measurement_index）。
+
+    Args:
+        cache_dir (str): 病例 parquet 所在目录
+        index_dir (str): 索引输出目录
+
+    Returns:
+        Dict[str, int]: 统计信息（cases / added / removed / rows / parts）
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    _remove_legacy_index(index_dir)
+    parts = _load_parts(index_dir)
+    indexed = {case: (part, mtime) for part, cases in parts.items() for case, mtime in cases.items()}
+
+    current = _list_case_files(cache_dir)
+    changed = {c for c, m in current.items() if c not in indexed or indexed[c][1] != m}
+    removed = set(indexed) - set(current)
+
+    if changed or removed:
+        # 1. 重写包含过期病例的分片（只剩下未变化的病例）
+        stale = (changed | removed) & set(indexed)
+        for part in sorted({indexed[c][0] for c in stale}):
+            keep = {c: m for c, m in parts[part].items() if c not in stale}
+            if keep:
+                table = pq.read_table(_part_path(index_dir, part))
+                table = table.filter(pc.is_in(table["case_id"], value_set=pa.array(sorted(keep))))
+            os.remove(_part_path(index_dir, part, CASES_SUFFIX))
+            if keep:
+                _write_part(index_dir, table, keep)
+            _remove_part(index_dir, part)
+
+        # 2. 新增与修改的病例写成新分片（没有测量值的病例也记入清单，避免重复读取）
+        if changed:
+            tables = [t for t in (_read_case(cache_dir, c, current[c]) for c in sorted(changed)) if t is not None]
+            table = _normalize_rows(pa.concat_tables(tables)) if tables else INDEX_SCHEMA.empty_table()
+            _write_parts(index_dir, table, {c: current[c] for c in changed})
+
+        if sum(len(cases) < INDEX_PART_CASES for cases in _load_parts(index_dir).values()) > INDEX_MAX_PARTS:
+            compact_measurement_index(index_dir)
+
+    parts = _load_parts(index_dir)
+    stats = {"cases": len(current), "added": len(changed), "removed": len(removed),
+             "rows": sum(pq.read_metadata(_part_path(index_dir, p)).num_rows for p in parts), "parts": len(parts)}
+    if changed or removed:
+        print(f"✅ 测量值索引已更新: {stats}")
+    return stats
+
+
+def _dataset(index_dir: str) -> ds.Dataset:
+    if not os.path.isdir(_parts_dir(index_dir)):
+        raise FileNotFoundError(f"❌ 测量值索引不存在，请先运行 build_measurement_index(): {index_dir}")
+    paths = [_part_path(index_dir, part) for part in _load_parts(index_dir)]
+    return ds.dataset(paths, schema=INDEX_SCHEMA, format="parquet")
+
+
+def list_metrics(index_dir: str = INDEX_DIR) -> pd.DataFrame:
+    """列出索引中的全部测量项（metric、名称、英文）及其出现次数"""
+    if not os.path.isdir(_parts_dir(index_dir)):
+        raise FileNotFoundError(f"❌ 测量项目录不存在，请先运行 build_measurement_index(): {index_dir}")
+    catalogs = [pq.read_table(_part_path(index_dir, part, ".metrics.parquet")) for part in _load_parts(index_dir)]
+    if not catalogs:
+        return pd.DataFrame(columns=["metric", "名称", "英文", "count"])
+    catalog = pa.concat_tables(catalogs).group_by(["metric", "名称", "英文"]).aggregate([("count", "sum")])
+    df = catalog.rename_columns(["metric", "名称", "英文", "count"]).to_pandas()
+    return df.sort_values("count", ascending=False, ignore_index=True)
+
+
+def resolve_metrics(name: str, index_dir: str = INDEX_DIR, fuzzy: bool = False) -> List[str]:
+    """
+    将用户输入的名称解析为索引中的 metric 列表
+
+    只做 metric/名称/中文名/英文 精确匹配（大小写不敏感）。metric 子串匹配（例如 "LAD" 命中 pLAD、mLAD、dLAD）
+    会扩大范围（"EF" 也会命中 LVEF、RVEF），只在 fuzzy=True 时使用。
+
+    Args:
+        name (str): 测量项名称/简写/英文
+        index_dir (str): 索引目录
+        fuzzy (bool): 没有精确匹配时是否退回子串匹配
+
+    Returns:
+        List[str]: 命中的 metric，没有任何匹配时为空
+
+    Raises:
+        ValueError: 没有精确匹配、只有子串匹配且未开启 fuzzy 时（错误信息列出候选 metric）
+    """
+    query = str(name).strip().lower()
+    metrics = list_metrics(index_dir)
+    base = metrics["名称"].map(lambda n: _split_name(n)[0])
+    exact = (
+        (metrics["metric"].str.lower() == query)
+        | (metrics["名称"].str.lower() == query)
+        | (base.str.lower() == query)
+        | (metrics["英文"].fillna("").str.lower() == query)
+    )
+    hits = metrics.loc[exact, "metric"]
+    if hits.empty:
+        candidates = sorted(set(metrics.loc[metrics["metric"].str.lower().str.contains(query, regex=False), "metric"]))
+        if candidates and not fuzzy:
+            raise ValueError(f"测量项 {name} 没有精确匹配，可能的 metric: {', '.join(candidates)}"
+                             f"（传入 metric 列表，或 fuzzy=True 使用全部候选）")
+        return candidates
+    return sorted(set(hits))
+
+
+def _time_filter(since, until, date_field: str = "report_date"):
+    if date_field not in DATE_FIELDS:
+        raise ValueError(f"不支持的时间字段: {date_field}（可选 {', '.join(DATE_FIELDS)}）")
+    expr = None
+    if since is not None:
+        expr = pc.field(date_field) >= pa.scalar(pd.Timestamp(since).to_pydatetime(), pa.timestamp("ms"))
+    if until is not None:
+        upper = pc.field(date_field) < pa.scalar(pd.Timestamp(until).to_pydatetime(), pa.timestamp("ms"))
+        expr = upper if expr is None else expr & upper
+    return expr
+
+
+def query_measurements(
+    name: Union[str, List[str]],
+    op: Optional[str] = None,
+    value: Optional[float] = None,
+    since=None,
+    until=None,
+    columns: Optional[List[str]] = None,
+    index_dir: str = INDEX_DIR,
+    date_field: str = "report_date",
+    fuzzy: bool = False,
+) -> pd.DataFrame:
+    """
+    按测量项与数值条件查询所有病例
+
+    Args:
+        name: 测量项名称/简写/英文，或 metric 列表
+        op (str): 比较运算符（<, <=, >, >=, ==, !=），为 None 时不做数值过滤
+        value (float): 比较值（给出 op 时必填）
+        since, until: 时间范围 [since, until)，可为字符串或时间戳
+        date_field (str): 按哪个时间筛选：report_date（检查日期，默认）或 processed_at（处理时间）
+        columns (List[str]): 返回列，默认为 DEFAULT_COLUMNS
+        index_dir (str): 索引目录
+        fuzzy (bool): 名称没有精确匹配时是否按 metric 子串匹配（见 resolve_metrics）
+
+    Returns:
+        pd.DataFrame: 命中的测量记录
+    """
+    metrics = [name] if isinstance(name, str) else list(name)
+    if isinstance(name, str):
+        metrics = resolve_metrics(name, index_dir, fuzzy) or metrics
+
+    expr = pc.field("metric").isin(metrics)
+    if op is not None:
+        if op not in _OPS:
+            raise ValueError(f"不支持的运算符: {op}")
+        if value is None:
+            raise ValueError(f"运算符 {op} 需要比较值 value")
+        expr = expr & _OPS[op](pc.field("value"), pa.scalar(float(value)))
+    time_expr = _time_filter(since, until, date_field)
+    if time_expr is not None:
+        expr = expr & time_expr
+
+    table = _dataset(index_dir).to_table(columns=columns or DEFAULT_COLUMNS, filter=expr)
+    return table.to_pandas()
+
+
+def measurement_distribution(name: str, bins: int = 10, since=None, until=None,
+                             index_dir: str = INDEX_DIR, date_field: str = "report_date",
+                             fuzzy: bool = False) -> Dict[str, pd.DataFrame]:
+    """
+    统计某个测量项的数值分布
+
+    Returns:
+        Dict[str, pd.DataFrame]: {"summary": 按 metric 的描述统计, "histogram": 分箱计数}
+    """
+    df = query_measurements(name, since=since, until=until,
+                            columns=["metric", "value"], index_dir=index_dir, date_field=date_field, fuzzy=fuzzy)
+    df = df.dropna(subset=["value"])
+    if df.empty:
+        return {"summary": pd.DataFrame(), "histogram": pd.DataFrame()}
+    summary = df.groupby("metric")["value"].describe()
+    histogram = (pd.cut(df["value"], bins=bins).value_counts(sort=False)
+                   .rename_axis("range").reset_index(name="count"))
+    return {"summary": summary, "histogram": histogram}
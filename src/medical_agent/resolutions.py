@@ -0,0 +1,277 @@
+"""
+名称解析记录库
+
+超声分支把报告中的原始项目名（"左房前后径"、"EF(Teich)"）依次经过 精确匹配 → rapidfuzz → 灰区 LLM 复核
+对应到标准表的行或知识库条目。同样的名称在每份报告里都会出现，ResolutionStore（SQLite，cache/resolutions.db）
+把每次非精确匹配的结论按 (阶段, 规范化名称) 保存下来，下一份报告先查记录库，命中时不再做模糊匹配和 LLM 调用：
+
+    stage       std（标准表）/ kb（知识库）
+    target      标准表名称或知识库标准名；空字符串表示“确认无匹配”
+    source      fuzzy（模糊匹配分数达到阈值）/ llm（灰区复核结论）/ manual（人工指定，自动结论不会覆盖）
+    confidence  得出结论时的模糊匹配分数（0–1），manual 为 1
+    catalog     得出结论时标准表与知识库名称的指纹
+
+有匹配的记录只要目标仍存在于标准表 / 知识库就继续使用；“无匹配”的记录只在 catalog 未变时使用
+（新增了知识库条目后需要重新判断）。RESOLUTION_STORE=0 关闭。
+
+查看与清理（在仓库根目录运行）：
+    PYTHONPATH=src python -m medical_agent.resolutions list --source llm
+    PYTHONPATH=src python -m medical_agent.resolutions set "EF(Teich)" "左心室射血分数(LVEF)" --stage std
+    PYTHONPATH=src python -m medical_agent.resolutions purge --source llm --older-than 30
+"""
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from medical_agent.utils import CACHE_DIR
+
+RESOLUTION_DB = os.getenv('RESOLUTION_DB', os.path.join(CACHE_DIR, "resolutions.db"))
+
+STAGES = ("std", "kb")
+SOURCES = ("fuzzy", "llm", "manual")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS resolutions (
+    stage       TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    target      TEXT NOT NULL,
+    source      TEXT NOT NULL,
+    confidence  REAL,
+    catalog     TEXT,
+    hits        INTEGER NOT NULL DEFAULT 0,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL,
+    last_used_at REAL,
+    PRIMARY KEY (stage, name)
+);
+CREATE INDEX IF NOT EXISTS resolutions_source ON resolutions (source, updated_at);
+"""
+# 键格式版本（PRAGMA user_version）；1：键保留括号内的限定词
+_KEY_VERSION = 1
+
+
+def resolution_store_enabled() -> bool:
+    return os.getenv('RESOLUTION_STORE', '1') != '0'
+
+
+def preclean_name(text: str) -> str:
+    """去掉括号内容与标点，用于模糊匹配"""
+    if not text:
+        return ""
+    s = str(text)
+    s = re.sub(r"[\(（][^\)）]*[\)）]", "", s)
+    s = re.sub(r"[%：:，,。·/\\]+", " ", s)
+    s = re.sub(r"\s+", " ", s).strip()
+    return s
+
+
+def normalize_name(text: str) -> str:
+    """
+    记录库的键：全角 / 半角统一（NFKC）、转小写、合并空白
+
+    保留括号内的限定词："EF(Teich)" 与 "EF(Simpson)" 是不同的测量项目，不能共用一条结论。
+    preclean_name() 只用于模糊匹配打分
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", str(text or ""))).strip().casefold()
+
+
+def catalog_fingerprint(*names: Iterable[str]) -> str:
+    """标准表 / 知识库名称集合的指纹；集合变化后“无匹配”的记录失效"""
+    digest = hashlib.sha1()
+    for group in names:
+        for name in sorted(set(group)):
+            digest.update(name.encode("utf-8") + b"\0")
+        digest.update(b"\1")
+    return digest.hexdigest()[:16]
+
+
+class ResolutionStore:
+    """名称解析记录库；每次操作使用独立连接，批量处理的多个进程可以共用同一个数据库文件"""
+
+    def __init__(self, path: str = RESOLUTION_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            if conn.execute("PRAGMA user_version").fetchone()[0] < _KEY_VERSION:
+                # 旧版本的键去掉了限定词（"EF(Teich)" 记为 "ef"），自动结论作废重新学习，人工指定保留
+                conn.execute("DELETE FROM resolutions WHERE source != 'manual'")
+                conn.execute(f"PRAGMA user_version = {_KEY_VERSION}")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def lookup_many(self, stage: str, names: Iterable[str], catalog: str) -> Dict[str, Dict[str, Any]]:
+        """
+        查询一批名称的记录，并累加命中次数
+
+        Args:
+            stage (str): std / kb
+            names (Iterable[str]): 规范化后的名称（由调用方规范化）
+            catalog (str): 当前的 catalog_fingerprint()
+
+        Returns:
+            Dict[str, Dict]: 名称 → 记录；“无匹配”的记录在 catalog 变化后不返回。
+                有匹配的记录由调用方确认目标仍然存在
+        """
+        names = list(dict.fromkeys(n for n in names if n))
+        if not names:
+            return {}
+        found = {}
+        with self._connect() as conn:
+            for start in range(0, len(names), 500):
+                chunk = names[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT * FROM resolutions WHERE stage = ? AND name IN ({', '.join('?' * len(chunk))})",
+                    (stage, *chunk),
+                ).fetchall()
+                for row in rows:
+                    if row["target"] or row["source"] == "manual" or row["catalog"] == catalog:
+                        found[row["name"]] = dict(row)
+            if found:
+                conn.execute(
+                    f"UPDATE resolutions SET hits = hits + 1, last_used_at = ? "
+                    f"WHERE stage = ? AND name IN ({', '.join('?' * len(found))})",
+                    (time.time(), stage, *found),
+                )
+        return found
+
+    def record_many(self, stage: str, decisions: Iterable[Dict[str, Any]], catalog: str) -> int:
+        """
+        保存一批自动结论（不覆盖 manual 记录）
+
+        Args:
+            stage (str): std / kb
+            decisions (Iterable[Dict]): 每项 {"name", "target", "source", "confidence"}
+            catalog (str): 得出结论时的 catalog_fingerprint()
+
+        Returns:
+            int: 写入的条数
+        """
+        now = time.time()
+        rows = [(stage, d["name"], d.get("target") or "", d["source"], d.get("confidence"), catalog, now, now)
+                for d in decisions if d.get("name")]
+        if not rows:
+            return 0
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO resolutions (stage, name, target, source, confidence, catalog, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (stage, name) DO UPDATE SET target = excluded.target, source = excluded.source, "
+                "confidence = excluded.confidence, catalog = excluded.catalog, updated_at = excluded.updated_at "
+                "WHERE resolutions.source != 'manual'",
+                rows,
+            )
+        return len(rows)
+
+    def set_manual(self, stage: str, name: str, target: str) -> None:
+        """人工指定（target 为空表示确认无匹配）；自动结论不会覆盖"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO resolutions (stage, name, target, source, confidence, catalog, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'manual', 1.0, NULL, ?, ?) "
+                "ON CONFLICT (stage, name) DO UPDATE SET target = excluded.target, source = 'manual', "
+                "confidence = 1.0, catalog = NULL, updated_at = excluded.updated_at",
+                (stage, name, target, now, now),
+            )
+
+    def _where(self, stage: Optional[str], source: Optional[str], name: Optional[str],
+               older_than: Optional[float]):
+        clauses, params = [], []
+        for column, value in (("stage", stage), ("source", source), ("name", name)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if older_than is not None:
+            clauses.append("updated_at < ?")
+            params.append(time.time() - older_than * 86400)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def entries(self, stage: Optional[str] = None, source: Optional[str] = None, name: Optional[str] = None,
+                older_than: Optional[float] = None) -> List[Dict[str, Any]]:
+        """按条件列出记录（older_than 为天数），按命中次数降序"""
+        where, params = self._where(stage, source, name, older_than)
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT * FROM resolutions{where} ORDER BY hits DESC, name", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def purge(self, stage: Optional[str] = None, source: Optional[str] = None, name: Optional[str] = None,
+              older_than: Optional[float] = None) -> int:
+        """删除符合条件的记录，返回删除条数"""
+        where, params = self._where(stage, source, name, older_than)
+        with self._connect() as conn:
+            return conn.execute(f"DELETE FROM resolutions{where}", params).rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT stage, source, COUNT(*) AS n FROM resolutions GROUP BY stage, source").fetchall()
+        return {f"{row['stage']}/{row['source']}": row["n"] for row in rows}
+
+
+_stores: Dict[str, ResolutionStore] = {}
+
+
+def get_resolution_store() -> Optional[ResolutionStore]:
+    """进程内共享的记录库；RESOLUTION_STORE=0 或无法打开时返回 None"""
+    if not resolution_store_enabled():
+        return None
+    path = os.getenv('RESOLUTION_DB', RESOLUTION_DB)
+    store = _stores.get(path)
+    if store is None:
+        try:
+            store = _stores[path] = ResolutionStore(path)
+        except sqlite3.Error as e:
+            print(f"⚠️ 无法打开名称解析记录库 {path}: {e}")
+            return None
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看与维护名称解析记录库")
+    parser.add_argument("--db", default=RESOLUTION_DB)
+    sub = parser.add_subparsers(dest="command", required=True)
+    for command in ("list", "purge"):
+        p = sub.add_parser(command)
+        p.add_argument("--stage", choices=STAGES)
+        p.add_argument("--source", choices=SOURCES)
+        p.add_argument("--name", help="原始名称（按 normalize_name 规范化后查找）")
+        p.add_argument("--older-than", type=float, help="只处理超过该天数未更新的记录")
+    p = sub.add_parser("set", help="人工指定名称的解析结果")
+    p.add_argument("name")
+    p.add_argument("target", nargs="?", default="", help="标准表名称或知识库标准名；省略表示无匹配")
+    p.add_argument("--stage", choices=STAGES, default="std")
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    store = ResolutionStore(args.db)
+    name = normalize_name(args.name) if getattr(args, "name", None) else None
+    if args.command == "list":
+        for e in store.entries(args.stage, args.source, name, args.older_than):
+            confidence = f"{e['confidence']:.2f}" if e["confidence"] is not None else "-"
+            print(f"{e['stage']:<4} {e['name']:<24} → {e['target'] or '(无匹配)':<28} "
+                  f"{e['source']:<7} {confidence:>5}  命中 {e['hits']}")
+    elif args.command == "purge":
+        print(f"🧹 已删除 {store.purge(args.stage, args.source, name, args.older_than)} 条记录")
+    elif args.command == "set":
+        store.set_manual(args.stage, name, args.target.strip())
+        print(f"✅ 已记录: {args.stage} {args.name} → {args.target or '(无匹配)'}")
+    else:
+        print(f"📊 名称解析记录: {store.counts()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+逐项目的相关语句检索
+
+CTA 分支对标准表的每个项目（冠脉节段 / 测量项目）各发一次 FILLIN_PROMPT_5 请求，但一个项目通常只在
+一两句话里出现（“左回旋支中远段管壁可见非钙化斑块……”）。ReportIndex 把报告切成句子，按项目的
+中文名、缩写（pLAD / mLAD、LVEF 等）、知识库别名和所属血管建立索引，每个请求只发送：
+    报告开头几行（检查项目、患者信息等共享头部） + 提到该项目的句子
+没有句子提到该项目时只发送头部，模型按“未提及”返回 "-"；冠脉节段找不到描述该节段的句子时发送全文。
+节段句常省略血管名（“左前降支：”标签行下的“中段：……”，或“左前降支近段……。中段……”），
+split_units() 给这类句子附上沿用的主语（标签行或前一个写了血管名的句子），检索与提及判断都带着主语。
+CONTEXT_RETRIEVAL=0 关闭，所有请求仍发送完整报告。
+
+mention_status() 进一步按冠脉层级（血管 → 近/中/远段，对角支/钝缘支按序号）判断节段在报告中
+是未提及、仅有阴性描述（“未见斑块及明显狭窄”），还是有阳性所见；前两种直接填默认值，不调用模型。
+报告头部的句子同样参与判断；无法确定时按阳性处理（宁可多调用一次模型）。
+SEGMENT_MENTION_SKIP=0 关闭，所有节段仍逐个请求。
+"""
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# 共享头部：报告开头的非空行数与字符上限
+RETRIEVAL_HEADER_LINES = int(os.getenv('RETRIEVAL_HEADER_LINES', 4))
+RETRIEVAL_HEADER_CHARS = int(os.getenv('RETRIEVAL_HEADER_CHARS', 200))
+# 检索结果超过全文的该比例时直接发送全文（节省有限，不值得冒漏检的风险）
+RETRIEVAL_MAX_FRACTION = float(os.getenv('RETRIEVAL_MAX_FRACTION', 0.6))
+
+# 冠脉血管及其常见写法；节段名称中出现血管名时，提到该血管的句子都视为相关
+# （“左前降支近段……；中段……；远段……” 中的“中段”只能从句首的血管名确定）
+CORONARY_VESSEL_ALIASES: Dict[str, List[str]] = {
+    "左主干": ["左主干", "左冠状动脉主干", "LM", "LMCA"],
+    "前降支": ["前降支", "LAD", "pLAD", "mLAD", "dLAD"],
+    "对角支": ["对角支", "D1", "D2"],
+    "回旋支": ["回旋支", "LCX", "LCx", "pLCX", "mLCX", "dLCX"],
+    "钝缘支": ["钝缘支", "OM", "OM1", "OM2"],
+    "中间支": ["中间支", "RI", "Ramus"],
+    "右冠": ["右冠", "RCA", "pRCA", "mRCA", "dRCA"],
+    "后降支": ["后降支", "PDA", "R-PDA", "L-PDA"],
+    "左室后支": ["左室后支", "PLV", "PLB", "R-PLB", "L-PLB"],
+}
+
+# 缩写前缀对应的节段：pLAD / mRCA / dLCX
+_PART_PREFIX = {"p": "近", "m": "中", "d": "远"}
+_ORDINALS = {"一": "1", "二": "2", "三": "3", "1": "1", "2": "2", "3": "3"}
+
+_ITEM_NAME_RE = re.compile(r"^(.*?)\s*[(（]([^()（）]*)[)）]\s*$")
+_CLAUSE_SPLIT_RE = re.compile(r"[；;]")
+_PART_RE = re.compile(r"([近中远]+)段")
+_ORDINAL_RE = re.compile(r"第([一二三123])|(?<![A-Za-z])(?:D|OM)([123])(?![0-9])", re.IGNORECASE)
+# 阴性描述（删除后再看是否还有阳性所见）
+_NEGATION_RE = re.compile(r"(未见|未发现|无明显|无)[^，,。；;]*")
+# 钙化积分、起源、优势型等描述涉及血管但不是节段所见（由 CTA 头部信息和分类提示提取）
+_SUMMARY_CLAUSE_RE = re.compile(r"积分|评分|起源|优势型")
+_POSITIVE_RE = re.compile(r"斑块|狭窄|闭塞|钙化|支架|桥|瘤|扩张|夹层|\d+(?:\.\d+)?\s*%")
+_SENTENCE_END_RE = re.compile(r"(?<=[。！？])")
+_LABEL_ONLY_RE = re.compile(r"^[^，。；：:]{1,12}[：:]$")
+# 以节段开头、省略了血管名的句子（“中段管壁可见……”、“中远段：……”、“第二对角支……”）
+_SEGMENT_LEAD_RE = re.compile(r"^[（(]?(?:[近中远]+段|第[一二三123])")
+
+
+def retrieval_enabled() -> bool:
+    return os.getenv('CONTEXT_RETRIEVAL', '1') != '0'
+
+
+def item_aliases(name: str, alias_index: Optional[Tuple[Dict[str, str], Dict[str, dict]]] = None) -> Set[str]:
+    """
+    项目名称的所有写法
+
+    Args:
+        name (str): 标准表中的名称，如 "三尖瓣环收缩期位移(TAPSE)"、"左前降支中段(mLAD)"
+        alias_index: normalizer.load_alias_index() 的结果，用于补充知识库别名
+
+    Returns:
+        Set[str]: 中文名、括号内缩写、知识库别名以及所属冠脉血管的写法
+    """
+    name = (name or "").strip()
+    match = _ITEM_NAME_RE.match(name)
+    cn, abbr = (match.group(1).strip(), match.group(2).strip()) if match else (name, "")
+    aliases = {a for a in (name, cn, abbr) if a and a != "NA"}
+
+    if alias_index is not None:
+        alias_to_canonical, canonical_to_meta = alias_index
+        canonical = alias_to_canonical.get(cn.lower()) or alias_to_canonical.get(abbr.lower(), "")
+        meta = canonical_to_meta.get(canonical) or {}
+        extra = meta.get("别名") or []
+        if isinstance(extra, str):
+            extra = [a.strip() for a in extra.split(";")]
+        aliases.update(a for a in [canonical, meta.get("测量值简写", ""), *extra] if a)
+
+    for vessel, vessel_aliases in CORONARY_VESSEL_ALIASES.items():
+        if vessel in cn or any(_contains(name, a) for a in vessel_aliases[1:]):
+            aliases.update(vessel_aliases)
+    return aliases
+
+
+def mention_skip_enabled() -> bool:
+    return os.getenv('SEGMENT_MENTION_SKIP', '1') != '0'
+
+
+def parse_segment(name: str) -> Optional[Tuple[str, Set[str], Optional[str]]]:
+    """
+    解析冠脉节段名称
+
+    Args:
+        name (str): 如 "左前降支近段(pLAD)"、"第一对角支(D1)"、"右冠状动脉"
+
+    Returns:
+        Optional[Tuple[str, Set[str], Optional[str]]]: (血管, 节段集合{近/中/远}，空集表示整支, 序号)；
+            不是冠脉节段时返回 None
+    """
+    match = _ITEM_NAME_RE.match((name or "").strip())
+    cn, abbr = (match.group(1), match.group(2).strip()) if match else (name or "", "")
+    vessel = next((v for v, aliases in CORONARY_VESSEL_ALIASES.items()
+                   if v in cn or any(a.lower() == abbr.lower() for a in aliases[1:])), None)
+    if vessel is None:
+        return None
+    parts = set("".join(_PART_RE.findall(cn)))
+    if not parts and len(abbr) > 1 and abbr[0] in _PART_PREFIX and abbr[1:].isupper():
+        parts = {_PART_PREFIX[abbr[0]]}
+    ordinal = _ORDINAL_RE.search(f"{cn} {abbr}")
+    return vessel, parts, _ORDINALS[ordinal.group(1) or ordinal.group(2)] if ordinal else None
+
+
+def _clause_vessels(clause: str) -> Set[str]:
+    return {v for v, aliases in CORONARY_VESSEL_ALIASES.items() if any(_contains(clause, a) for a in aliases)}
+
+
+def _is_negative(clause: str) -> bool:
+    """删去阴性短语后不再有斑块、狭窄、百分比等阳性所见"""
+    return bool(_NEGATION_RE.search(clause)) and not _POSITIVE_RE.search(_NEGATION_RE.sub("", clause))
+
+
+def _alias_pattern(alias: str) -> re.Pattern:
+    # 拉丁字母缩写要求前后不是字母，避免 "LA" 命中 "LAD"
+    escaped = re.escape(alias)
+    if re.search(r"[A-Za-z]", alias):
+        return re.compile(rf"(?<![A-Za-z]){escaped}(?![A-Za-z])", re.IGNORECASE)
+    return re.compile(escaped)
+
+
+def _contains(text: str, alias: str) -> bool:
+    return bool(_alias_pattern(alias).search(text))
+
+
+def split_sentences(text: str) -> List[str]:
+    """按行和句号切分；分号、逗号不切，保留“近段……；中段……”中省略的主语"""
+    return [sentence for sentence, _, _ in split_units(text)]
+
+
+def split_units(text: str) -> List[Tuple[str, str, Set[str]]]:
+    """
+    切分句子，并为省略血管名的节段句附上沿用的主语
+
+    主语来自“左前降支：”这样的标签行（对其下各行都有效，直到下一个标签行或写了其他血管的句子），
+    或同一段落中前一个以血管名开头的句子（只对以“近/中/远段”、“第N”开头的句子有效）。空行结束段落。
+
+    Args:
+        text (str): 报告文本
+
+    Returns:
+        List[Tuple[str, str, Set[str]]]: [(句子, 主语文本, 主语血管)]；没有沿用主语时为 ("…", "", set())
+    """
+    units = []
+    subject, vessels, sticky = "", set(), False
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if not line:
+            subject, vessels, sticky = "", set(), False
+            continue
+        if _LABEL_ONLY_RE.match(line):
+            label_vessels = _clause_vessels(line)
+            if label_vessels:
+                subject, vessels, sticky = line, label_vessels, True
+            elif not _SEGMENT_LEAD_RE.match(line):
+                # “印象：”等其他标签结束沿用
+                subject, vessels, sticky = "", set(), False
+            continue
+        for sentence in (s.strip() for s in _SENTENCE_END_RE.split(line) if s.strip()):
+            first = _CLAUSE_SPLIT_RE.split(sentence)[0]
+            own = set() if _SUMMARY_CLAUSE_RE.search(first) else _clause_vessels(first)
+            if own:
+                units.append((sentence, "", set()))
+                subject, vessels, sticky = sentence, own, False
+            elif vessels and (sticky or _SEGMENT_LEAD_RE.match(sentence)):
+                units.append((sentence, subject, vessels))
+            else:
+                units.append((sentence, "", set()))
+                if not sticky:
+                    subject, vessels = "", set()
+    return units
+
+
+class ReportIndex:
+    """一份报告的句子索引；同一份报告的所有项目共用"""
+
+    def __init__(self, text: str, alias_index=None):
+        self.text = text or ""
+        self.alias_index = alias_index
+        self.units = split_units(self.text)
+        self.sentences = [sentence for sentence, _, _ in self.units]
+        self.header = self._header()
+
+    def _header(self) -> str:
+        lines = [line.strip() for line in self.text.splitlines() if line.strip()][:RETRIEVAL_HEADER_LINES]
+        return "\n".join(lines)[:RETRIEVAL_HEADER_CHARS]
+
+    def relevant_sentences(self, aliases: Iterable[str]) -> List[str]:
+        """提到任一写法的句子（连同沿用的主语一起匹配，主语放在句子前面）"""
+        patterns = [_alias_pattern(a) for a in aliases if a]
+        found: List[str] = []
+        for sentence, subject, _ in self.units:
+            if any(p.search(f"{subject}{sentence}") for p in patterns):
+                if subject and subject not in found:
+                    found.append(subject)
+                if sentence not in found:
+                    found.append(sentence)
+        return found
+
+    def context_for(self, name: str) -> Tuple[str, bool]:
+        """
+        单个项目的上下文
+
+        Args:
+            name (str): 标准表中的项目名称
+
+        Returns:
+            Tuple[str, bool]: (上下文文本, 是否为检索后的摘录)；摘录不比全文小多少，
+                或冠脉节段找不到描述该节段的句子时返回 (全文, False)
+        """
+        segment = parse_segment(name)
+        if segment is not None and not self._segment_clauses(*segment):
+            return self.text, False
+        sentences = [s for s in self.relevant_sentences(item_aliases(name, self.alias_index))
+                     if s not in self.header]
+        excerpt = "\n".join([self.header, *sentences]).strip()
+        if len(excerpt) > RETRIEVAL_MAX_FRACTION * len(self.text):
+            return self.text, False
+        return excerpt, True
+
+    def _segment_clauses(self, vessel: str, parts: Set[str], ordinal: Optional[str]) -> List[str]:
+        """报告中描述该节段的分句；未写血管名的分句沿用同一句中前面出现的血管或句子沿用的主语"""
+        clauses = []
+        for sentence, _, carried in self.units:
+            current: Set[str] = set(carried)
+            for clause in _CLAUSE_SPLIT_RE.split(sentence):
+                if _SUMMARY_CLAUSE_RE.search(clause):
+                    continue
+                current = _clause_vessels(clause) or current
+                if vessel not in current:
+                    continue
+                clause_parts = set("".join(_PART_RE.findall(clause)))
+                if parts and clause_parts and not parts & clause_parts:
+                    continue
+                ordinals = {_ORDINALS[a or b] for a, b in _ORDINAL_RE.findall(clause)}
+                if ordinal and ordinals and ordinal not in ordinals:
+                    continue
+                clauses.append(clause)
+        return clauses
+
+    def mention_status(self, name: str) -> str:
+        """
+        项目在报告中的提及情况
+
+        Args:
+            name (str): 标准表中的项目名称
+
+        Returns:
+            str: "absent"（未提及）/ "negative"（仅阴性描述）/ "positive"（有所见，需要调用模型）；
+                非冠脉项目只区分 absent 与 positive
+        """
+        segment = parse_segment(name)
+        if segment is None:
+            return "positive" if self.relevant_sentences(item_aliases(name, self.alias_index)) else "absent"
+        clauses = self._segment_clauses(*segment)
+        if not clauses:
+            # 节段本身的写法（“前降支中段”、“mLAD”）出现在报告中却没有对应的分句：无法确定，按阳性处理
+            _, parts, ordinal = segment
+            match = _ITEM_NAME_RE.match(name.strip())
+            written = [a.strip() for a in (match.groups() if match else (name,)) if a.strip() and a.strip() != "NA"]
+            if (parts or ordinal) and any(_contains(self.text, a) or _contains(self.text, a.lstrip("左右"))
+                                          for a in written):
+                return "positive"
+            return "absent"
+        return "negative" if all(_is_negative(c) for c in clauses) else "positive"
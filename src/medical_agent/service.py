@@ -0,0 +1,456 @@
+"""
+常驻结构化提取服务
+
+批量脚本每次运行都要重新导入依赖、读取标准测量表和知识库、创建 API 客户端。服务模式下
+这些只在 worker 进程启动时做一次：
+
+    HTTP 接口   接收图片 / PDF / 文本，写入上传目录并入队
+    任务队列    SQLite（cache/jobs.db），进程重启后未完成的任务会重新排队
+    worker 池   预热后的常驻进程，逐个领取任务，复用已加载的表格模板、知识库索引和长连接客户端
+
+接口：
+    POST /jobs?kind=jpg|pdf|text&name=<原文件名>   请求体为文件内容（text 为 UTF-8 文本）
+    GET  /jobs/<id>                               任务状态
+    GET  /jobs/<id>/result                        结构化结果（表格行）与用量统计
+    GET  /health                                  各状态任务数与存活 worker 数
+
+用法（在仓库根目录运行，标准测量表等按相对路径读取）：
+    PYTHONPATH=src python -m medical_agent.service --port 8765 --workers 2
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from medical_agent.utils import CACHE_DIR
+
+SERVICE_HOST = os.getenv('SERVICE_HOST', '127.0.0.1')
+SERVICE_PORT = int(os.getenv('SERVICE_PORT', 8765))
+SERVICE_WORKERS = int(os.getenv('SERVICE_WORKERS', 2))
+SERVICE_DB = os.getenv('SERVICE_DB', os.path.join(CACHE_DIR, "jobs.db"))
+SERVICE_UPLOAD_DIR = os.getenv('SERVICE_UPLOAD_DIR', os.path.join(CACHE_DIR, "uploads"))
+# 单个上传文件大小上限（MB）
+SERVICE_MAX_UPLOAD_MB = float(os.getenv('SERVICE_MAX_UPLOAD_MB', 50))
+# 队列为空时 worker 的轮询间隔（秒）
+SERVICE_POLL_INTERVAL = float(os.getenv('SERVICE_POLL_INTERVAL', 0.5))
+# 任务最多尝试次数（worker 崩溃或处理失败后重新排队）
+SERVICE_MAX_ATTEMPTS = int(os.getenv('SERVICE_MAX_ATTEMPTS', 2))
+# 检查 worker 进程存活的间隔（秒）
+SERVICE_SUPERVISE_INTERVAL = float(os.getenv('SERVICE_SUPERVISE_INTERVAL', 5))
+
+JOB_KINDS = ("jpg", "pdf", "text")
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    name        TEXT,
+    source_path TEXT NOT NULL,
+    output_name TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    worker      TEXT,
+    error       TEXT,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+
+class JobQueue:
+    """SQLite 持久化任务队列；每次操作使用独立连接，可在多进程、多线程中共用同一个数据库文件"""
+
+    def __init__(self, path: str = SERVICE_DB, max_attempts: int = SERVICE_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, kind: str, source_path: str, name: str = "", job_id: Optional[str] = None,
+               output_name: Optional[str] = None) -> str:
+        """
+        新建任务
+
+        Args:
+            kind (str): jpg / pdf / text
+            source_path (str): 已保存的输入文件路径
+            name (str): 原始文件名（仅用于展示）
+            job_id (str): 任务ID，为 None 时自动生成
+            output_name (str): 结果文件名（不含扩展名），为 None 时使用 job_<任务ID>
+
+        Returns:
+            str: 任务ID
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"不支持的任务类型: {kind}")
+        job_id = job_id or uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, name, source_path, output_name, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, name, source_path, output_name or f"job_{job_id}", QUEUED, time.time()),
+            )
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """原子地领取最早的排队任务，没有任务时返回 None"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, started_at = ? WHERE id = ?",
+                (RUNNING, worker, time.time(), row["id"]),
+            )
+            conn.execute("COMMIT")
+        job = dict(row)
+        job.update(status=RUNNING, worker=worker, attempts=job["attempts"] + 1)
+        return job
+
+    def complete(self, job_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, error = NULL, finished_at = ? WHERE id = ?",
+                         (DONE, time.time(), job_id))
+
+    def fail(self, job_id: str, error: str) -> str:
+        """
+        记录失败；未达到最大尝试次数时重新排队
+
+        Returns:
+            str: 任务的新状态
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            status = QUEUED if row is not None and row["attempts"] < self.max_attempts else FAILED
+            conn.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                         (status, error, time.time() if status == FAILED else None, job_id))
+        return status
+
+    def release_worker(self, worker: str, error: str) -> int:
+        """
+        worker 进程退出后处理它领取的任务：未达到最大尝试次数时重新排队，否则标记失败
+
+        Returns:
+            int: 处理的任务数
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT id, attempts FROM jobs WHERE worker = ? AND status = ?",
+                                (worker, RUNNING)).fetchall()
+            for row in rows:
+                if row["attempts"] < self.max_attempts:
+                    conn.execute("UPDATE jobs SET status = ?, worker = NULL, error = ? WHERE id = ?",
+                                 (QUEUED, error, row["id"]))
+                else:
+                    conn.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                                 (FAILED, error, time.time(), row["id"]))
+            conn.execute("COMMIT")
+        return len(rows)
+
+    def requeue_running(self) -> int:
+        """服务启动时把上次未完成（running）的任务重新排队，返回数量"""
+        with self._connect() as conn:
+            return conn.execute("UPDATE jobs SET status = ?, worker = NULL WHERE status = ?",
+                                (QUEUED, RUNNING)).rowcount
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+
+# ==============================================================
+# worker
+# ==============================================================
+
+def _load_processors() -> Dict[str, Any]:
+    # 批量脚本按 `from agent import ...` 的方式导入，需要模块目录在 sys.path 中
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    if module_dir not in sys.path:
+        sys.path.insert(0, module_dir)
+    from batch_jpg_import import process_single_jpg_to_parquet
+    from batch_pdf_import import process_single_pdf_to_parquet
+    from text_extract import extract_from_text
+
+    def process_text(path: str, output_name: str) -> bool:
+        with open(path, encoding="utf-8") as f:
+            return extract_from_text(f.read(), output_name)
+
+    return {"jpg": process_single_jpg_to_parquet, "pdf": process_single_pdf_to_parquet, "text": process_text}
+
+
+def warm_up() -> Dict[str, Any]:
+    """导入流水线并预先加载标准表模板、知识库索引和 API 客户端"""
+    processors = _load_processors()
+    from medical_agent.clients import get_client
+    from medical_agent.normalizer import load_alias_index
+    from medical_agent.table_format import create_formatted_df
+
+    create_formatted_df()
+    try:
+        load_alias_index()
+    except FileNotFoundError as e:
+        print(f"⚠️ {e}")
+    get_client("qwen")
+    return processors
+
+
+def run_job(queue: JobQueue, job: Dict[str, Any], processors: Dict[str, Any]) -> str:
+    """
+    处理单个任务并更新队列状态
+
+    Returns:
+        str: 任务的最终状态
+    """
+    from medical_agent.llm import save_usage, usage_scope
+    from medical_agent.tracing import span
+
+    error = "结构化提取失败"
+    try:
+        with span("job", job_id=job["id"], kind=job["kind"], file=job["name"]) as s, usage_scope() as usage:
+            ok = processors[job["kind"]](job["source_path"], job["output_name"])
+            s.set(ok=ok)
+        save_usage(usage, job["output_name"])
+    except Exception as e:
+        ok, error = False, f"{type(e).__name__}: {e}"
+    if ok:
+        queue.complete(job["id"])
+        return DONE
+    return queue.fail(job["id"], error)
+
+
+def worker_main(worker_name: str, db_path: str, stop_event) -> None:
+    """worker 进程入口：预热后循环领取任务，直到 stop_event 被设置"""
+    processors = warm_up()
+    queue = JobQueue(db_path)
+    print(f"🟢 {worker_name} 已就绪 (pid {os.getpid()})")
+    while not stop_event.is_set():
+        job = queue.claim(worker_name)
+        if job is None:
+            stop_event.wait(SERVICE_POLL_INTERVAL)
+            continue
+        print(f"📝 {worker_name} 处理任务 {job['id']} ({job['kind']}, 第{job['attempts']}次)")
+        status = run_job(queue, job, processors)
+        print(f"{'✅' if status == DONE else '❌'} 任务 {job['id']}: {status}")
+
+
+class WorkerPool:
+    """维护固定数量的 worker 进程，进程意外退出时处理它未完成的任务并重新拉起"""
+
+    def __init__(self, size: int, db_path: str, target: Callable[[str, str, Any], None] = worker_main):
+        self.size = size
+        self.db_path = db_path
+        self.target = target
+        self.queue = JobQueue(db_path)
+        self.stop_event = multiprocessing.Event()
+        self.processes: List[multiprocessing.Process] = []
+        self._supervisor: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _spawn(self, index: int) -> multiprocessing.Process:
+        process = multiprocessing.Process(
+            target=self.target, args=(f"worker-{index}", self.db_path, self.stop_event),
+            name=f"medical-agent-worker-{index}", daemon=True,
+        )
+        process.start()
+        return process
+
+    def start(self) -> "WorkerPool":
+        self.processes = [self._spawn(i) for i in range(self.size)]
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+        return self
+
+    def check_workers(self) -> int:
+        """重新拉起已退出的 worker，先把它领取的任务重新排队（或达到最大尝试次数后标记失败）；返回重启数量"""
+        restarted = 0
+        with self._lock:
+            for i, process in enumerate(self.processes):
+                if process.is_alive() or self.stop_event.is_set():
+                    continue
+                released = self.queue.release_worker(f"worker-{i}", f"worker 进程退出 (exitcode {process.exitcode})")
+                print(f"⚠️ worker-{i} 已退出 (exitcode {process.exitcode})，"
+                      f"{released} 个进行中的任务已处理，重新启动")
+                self.processes[i] = self._spawn(i)
+                restarted += 1
+        return restarted
+
+    def _supervise(self) -> None:
+        while not self.stop_event.wait(SERVICE_SUPERVISE_INTERVAL):
+            self.check_workers()
+
+    def alive(self) -> int:
+        return sum(1 for p in self.processes if p.is_alive())
+
+    def stop(self, timeout: float = 30) -> None:
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+
+# ==============================================================
+# HTTP 接口
+# ==============================================================
+
+def _upload_suffix(kind: str, name: str) -> str:
+    if kind == "text":
+        return ".txt"
+    if kind == "pdf":
+        return ".pdf"
+    suffix = Path(name).suffix.lower()
+    return suffix if suffix in (".jpg", ".jpeg", ".png") else ".jpg"
+
+
+def _public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: job[key] for key in ("id", "kind", "name", "status", "attempts", "error",
+                                      "created_at", "started_at", "finished_at")}
+
+
+def load_job_result(job: Dict[str, Any]) -> Dict[str, Any]:
+    """读取已完成任务的结构化表格和用量统计"""
+    from medical_agent.utils import load_df_from_cache
+    df = load_df_from_cache(job["output_name"])
+    rows = json.loads(df.to_json(orient="records", force_ascii=False)) if df is not None else []
+    usage_path = os.path.join(CACHE_DIR, f"{job['output_name']}.usage.json")
+    usage = None
+    if os.path.exists(usage_path):
+        with open(usage_path, encoding="utf-8") as f:
+            usage = json.load(f)
+    return {"job": _public_job(job), "rows": rows, "usage": usage}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    server_version = "MedicalAgentService/0.1"
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            return self._send_json(404, {"error": "not found"})
+        params = parse_qs(url.query)
+        kind = params.get("kind", [""])[0]
+        name = params.get("name", [""])[0]
+        if kind not in JOB_KINDS:
+            return self._send_json(400, {"error": f"kind 必须为 {', '.join(JOB_KINDS)}"})
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            return self._send_json(400, {"error": "请求体为空"})
+        if length > SERVICE_MAX_UPLOAD_MB * 1024 * 1024:
+            return self._send_json(413, {"error": f"文件超过 {SERVICE_MAX_UPLOAD_MB:g}MB"})
+
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.server.upload_dir, exist_ok=True)
+        source_path = os.path.join(self.server.upload_dir, f"{job_id}{_upload_suffix(kind, name)}")
+        with open(source_path, "wb") as f:
+            f.write(self.rfile.read(length))
+        self.server.queue.submit(kind, source_path, name or os.path.basename(source_path), job_id=job_id)
+        self._send_json(202, {"job_id": job_id, "status": QUEUED})
+
+    def do_GET(self):
+        parts = [p for p in urlparse(self.path).path.split("/") if p]
+        if parts == ["health"]:
+            pool = self.server.pool
+            return self._send_json(200, {"jobs": self.server.queue.counts(),
+                                         "workers": pool.alive() if pool is not None else 0})
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.server.queue.get(parts[1])
+            if job is None:
+                return self._send_json(404, {"error": "任务不存在"})
+            if len(parts) == 2:
+                return self._send_json(200, _public_job(job))
+            if parts[2] == "result":
+                if job["status"] != DONE:
+                    return self._send_json(409, {"error": f"任务状态为 {job['status']}", "job": _public_job(job)})
+                return self._send_json(200, load_job_result(job))
+        self._send_json(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        if os.getenv('SERVICE_ACCESS_LOG', '0') == '1':
+            super().log_message(format, *args)
+
+
+def create_server(queue: JobQueue, host: str = SERVICE_HOST, port: int = SERVICE_PORT,
+                  pool: Optional[WorkerPool] = None, upload_dir: str = SERVICE_UPLOAD_DIR) -> ThreadingHTTPServer:
+    """创建 HTTP 服务（不启动）；port 为 0 时由系统分配端口"""
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.queue = queue
+    server.pool = pool
+    server.upload_dir = upload_dir
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="医疗报告结构化提取服务")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    parser.add_argument("--db", default=SERVICE_DB)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    queue = JobQueue(args.db)
+    requeued = queue.requeue_running()
+    if requeued:
+        print(f"♻️ {requeued} 个未完成的任务已重新排队")
+
+    # 先启动 worker（fork 时主进程中还没有 HTTP 线程），再开始监听
+    pool = WorkerPool(args.workers, args.db).start()
+    server = create_server(queue, args.host, args.port, pool)
+    print(f"🏥 结构化提取服务已启动: http://{args.host}:{server.server_address[1]} ({args.workers} 个 worker)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 正在停止服务...")
+    finally:
+        server.server_close()
+        pool.stop()
+
+
+if __name__ == "__main__":
+    main()
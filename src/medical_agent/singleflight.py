@@ -0,0 +1,108 @@
+"""
+相同请求合并（single-flight）
+
+并行处理时，同一时刻常有完全相同的请求在途：多份报告里同样的别名复核、重复页面的同一张 OCR 图片。
+结果缓存要等第一个请求返回后才能生效，SingleFlight 则让并发的相同请求（客户端 + 模型 + 消息 +
+response_format 的哈希相同）共用一次底层调用：第一个到达的请求（leader）真正发出，其余请求（follower）
+等待并拿到同一个结果；leader 失败时 follower 收到同一个异常，各自的重试逻辑照常处理。
+
+llm._create() 在对冲（hedging）外层使用它，因此对冲请求不会被合并掉；任何缓存层都可以放在它的
+外面（先查缓存，未命中再 single-flight）或里面（fn 中查缓存）。合并只发生在请求在途期间，结果不保留。
+被合并的调用记在用量账本的 coalesced 中，不计 calls 与 tokens。SINGLE_FLIGHT=0 关闭。
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def single_flight_enabled() -> bool:
+    return os.getenv('SINGLE_FLIGHT', '1') != '0'
+
+
+def request_key(client: Any, model: str, messages: List[Dict[str, Any]],
+                response_format: Optional[Dict[str, Any]] = None) -> str:
+    """请求的合并键：客户端实例 + 模型 + 消息（含图片 data URL）+ response_format 的哈希"""
+    payload = json.dumps([model, messages, response_format], ensure_ascii=False, sort_keys=True, default=str)
+    return f"{id(client)}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+class _Flight:
+    """一次在途调用：完成后 done 置位，结果或异常二选一"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """按键合并在途调用（线程安全），并按类型统计 leader / 被合并的次数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def do(self, key: str, fn: Callable[[], Any], kind: str = "") -> Tuple[Any, bool]:
+        """
+        执行 fn()；同一 key 已有调用在途时等待并共用其结果
+
+        Args:
+            key (str): 合并键（见 request_key）
+            fn (Callable[[], Any]): 真正发起调用的函数
+            kind (str): 提示词类型，用于统计
+
+        Returns:
+            Tuple[Any, bool]: (结果, 是否为共用其他调用的结果)
+
+        Raises:
+            Exception: fn() 的异常；follower 收到 leader 的同一个异常
+        """
+        with self._lock:
+            stats = self._stats.setdefault(kind, {"leaders": 0, "coalesced": 0})
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                stats["leaders"] += 1
+            else:
+                stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            # 先移除再通知：之后到达的相同请求重新发起，而不是拿到已经返回的结果
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """按类型的 {"leaders", "coalesced"}（只包含发生过合并的类型）"""
+        with self._lock:
+            return {kind: dict(s) for kind, s in self._stats.items() if s["coalesced"]}
+
+
+flights = SingleFlight()
+
+
+def coalesced_call(kind: str, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+    """通过进程内共享的 SingleFlight 执行调用；SINGLE_FLIGHT=0 时直接执行"""
+    if not single_flight_enabled():
+        return fn(), False
+    return flights.do(key, fn, kind)
@@ -0,0 +1,290 @@
+"""
+结构化（JSON）输出
+
+模型返回的 JSON 经常带代码块、前后说明文字、照抄提示词里的 # 注释、单引号、尾逗号，或者因 max_tokens
+被截断。safe_json_load() 解析失败只能返回 None，字段被静默丢弃。parse_response() 依次：
+    1. 快速解析（安装了 orjson 时使用 orjson，否则 json）
+    2. 本地修复后再解析：去掉代码块与说明文字、注释，单引号与 Python 字面量改为 JSON，
+       删除尾逗号，补全被截断的字符串 / 对象
+    3. 按提示词类型的 pydantic schema 校验（schema_for）
+只有修复后仍不合格时，llm.json_completion() 才重新请求（STRUCTURED_REREQUESTS 次，默认 1）。
+每种提示词类型的修复次数与解析失败次数记入用量账本。
+
+支持的后端同时请求 JSON 模式（response_format={"type": "json_object"}）：OpenAI 兼容接口要求消息中
+出现 "JSON" 字样，因此只对提到 JSON 的提示词开启；后端返回 400 拒绝该参数时记住该后端 + 模型，之后不再发送。
+JSON_MODE=0 关闭 JSON 模式。
+
+pydantic 与 orjson 在第一次解析时才导入，导入本模块（以及 llm）不会拖慢批量入口的启动。
+"""
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Literal, Optional, Set, Tuple, Union
+
+STRUCTURED_REREQUESTS = int(os.getenv('STRUCTURED_REREQUESTS', 1))
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+Scalar = Optional[Union[str, int, float]]
+
+_schemas: Optional[Dict[str, Any]] = None
+_orjson: Any = None
+_lazy_lock = threading.Lock()
+
+
+def _build_schemas() -> Dict[str, Any]:
+    from pydantic import BaseModel
+
+    class ClassifierResult(BaseModel):
+        report_type: Literal["CTA", "Ultrasound"]
+        confidence: Scalar = None
+        reason: Scalar = None
+
+    class SegmentResult(BaseModel):
+        斑块种类: Scalar
+        类型: Scalar
+        症状: Scalar
+        数值: Scalar
+        狭窄程度: Scalar
+        闭塞: Scalar
+
+    class KeyResult(BaseModel):
+        key_name: str
+        result: Scalar
+        reason: Scalar = None
+
+    class MatchResult(BaseModel):
+        match: Scalar
+
+    # 提示词类型 → schema；dict 表示任意 JSON 对象（键由报告内容决定）
+    return {
+        "classifier": ClassifierResult,
+        "segment": SegmentResult,
+        "ultrasound_location": SegmentResult,
+        "cta_category": KeyResult,
+        "abnormal": KeyResult,
+        "cta_header": dict,
+        "us_header": dict,
+        "all_measurements": dict,
+        "cta_gapfill": dict,
+        "key_pick": MatchResult,
+        "alias": MatchResult,
+        "alias_batch": dict,
+    }
+
+
+def schema_for(kind: str) -> Any:
+    """提示词类型对应的 schema（首次调用时导入 pydantic 并定义）；未登记的类型返回 None"""
+    global _schemas
+    if _schemas is None:
+        with _lazy_lock:
+            if _schemas is None:
+                _schemas = _build_schemas()
+    return _schemas.get(kind)
+
+
+def _loads(text: str) -> Any:
+    global _orjson
+    if _orjson is None:
+        try:
+            import orjson
+            _orjson = orjson
+        except ImportError:
+            _orjson = False
+    return _orjson.loads(text) if _orjson else json.loads(text)
+
+
+def _strip_wrapping(text: str) -> str:
+    """去掉代码块和 JSON 前后的说明文字"""
+    fence = _FENCE_RE.search(text)
+    if fence:
+        text = fence.group(1)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    return text[min(starts):] if starts else text
+
+
+def repair_json(text: str) -> str:
+    """
+    修复常见的 JSON 格式问题
+
+    Args:
+        text (str): 模型返回的文本
+
+    Returns:
+        str: 修复后的 JSON 文本（不保证一定可以解析）
+    """
+    text = _strip_wrapping(text or "").strip()
+    out: List[str] = []
+    stack: List[str] = []
+    # 截断时回退的位置：(输出长度, 当时的括号栈)
+    cut_points: List[Tuple[int, List[str]]] = []
+    quote: Optional[str] = None
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote is not None:
+            if ch == "\\" and i + 1 < len(text):
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            if ch == quote:
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"')       # 单引号字符串中的双引号
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        if ch in "\"'":
+            quote = ch
+            out.append('"')
+        elif ch == "#" or text.startswith("//", i):
+            # 照抄提示词中的注释
+            newline = text.find("\n", i)
+            i = len(text) if newline < 0 else newline
+            continue
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+            cut_points.append((len(out), list(stack)))
+        elif ch in "}]":
+            _drop_trailing_comma(out)
+            if stack:
+                out.append(stack.pop())
+            if not stack:
+                break                   # 顶层对象结束，忽略后面的说明文字
+        elif ch == ",":
+            _drop_trailing_comma(out)
+            cut_points.append((len(out), list(stack)))
+            out.append(ch)
+        elif ch.isalpha():
+            word = re.match(r"[A-Za-z_]+", text[i:])
+            if word:
+                out.append(_LITERALS.get(word.group(0), word.group(0)))
+                i += len(word.group(0))
+                continue
+            out.append(ch)
+        else:
+            out.append(ch)
+        i += 1
+
+    if quote is None and not stack:
+        return "".join(out)
+    # 被截断：只保留完整的值再补全括号（截断的字符串可能改变含义，如“轻度狭窄”只剩“轻”）
+    candidate = _close("".join(out), stack) if quote is None else ""
+    if candidate and _parses(candidate):
+        return candidate
+    for length, snapshot in reversed(cut_points):
+        candidate = _close("".join(out[:length]), snapshot)
+        if _parses(candidate):
+            return candidate
+    return candidate
+
+
+def _drop_trailing_comma(out: List[str]) -> None:
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ",":
+        del out[j]
+
+
+def _close(text: str, stack: List[str]) -> str:
+    text = text.rstrip()
+    if text.endswith(","):
+        text = text[:-1]
+    return text + "".join(reversed(stack))
+
+
+def _parses(text: str) -> bool:
+    try:
+        json.loads(text, strict=False)
+        return True
+    except ValueError:
+        return False
+
+
+def _validate(schema: Any, data: Any) -> bool:
+    if schema is None:
+        return True
+    if not isinstance(data, dict):
+        return False
+    if schema is dict:
+        return True
+    from pydantic import ValidationError
+    # pydantic 2 为 model_validate，1.x 为 parse_obj
+    validate = getattr(schema, "model_validate", None) or schema.parse_obj
+    try:
+        validate(data)
+        return True
+    except ValidationError:
+        return False
+
+
+def parse_response(text: str, kind: str) -> Tuple[Any, str]:
+    """
+    解析并校验模型返回的 JSON
+
+    Args:
+        text (str): 模型返回的文本
+        kind (str): 提示词类型，决定使用的 schema
+
+    Returns:
+        Tuple[Any, str]: (解析结果, 状态)；状态为 "ok"、"repaired"（本地修复后通过）、
+            "invalid"（可以解析但不符合 schema，结果仍返回）或 "failed"（无法解析，结果为 None）
+    """
+    schema = schema_for(kind)
+    try:
+        data = _loads(text)
+        if _validate(schema, data):
+            return data, "ok"
+    except ValueError:
+        data = None
+    try:
+        repaired = json.loads(repair_json(text), strict=False)
+    except ValueError:
+        return data, "invalid" if data is not None else "failed"
+    if _validate(schema, repaired):
+        return repaired, "repaired"
+    return (data if data is not None else repaired), "invalid"
+
+
+_json_mode_unsupported: Set[str] = set()
+_json_mode_lock = threading.Lock()
+
+
+def json_mode_enabled() -> bool:
+    return os.getenv('JSON_MODE', '1') != '0'
+
+
+def response_format_for(messages: List[Dict[str, Any]]) -> Optional[Dict[str, str]]:
+    """提示词提到 JSON 时请求 JSON 模式"""
+    if not json_mode_enabled():
+        return None
+    text = "\n".join(str(m.get("content", "")) for m in messages if isinstance(m.get("content"), str))
+    return {"type": "json_object"} if "json" in text.lower() else None
+
+
+def json_mode_key(client: Any, model: str) -> str:
+    """JSON 模式支持情况的记录键：后端地址 + 实际发送的模型名（同名模型在不同后端上支持情况可能不同）"""
+    return f"{getattr(client, 'base_url', '')}|{model}"
+
+
+def json_mode_supported(key: str) -> bool:
+    with _json_mode_lock:
+        return key not in _json_mode_unsupported
+
+
+def json_mode_rejected(key: str, error: BaseException) -> bool:
+    """后端以 400 拒绝 response_format 时记住该后端 + 模型（见 json_mode_key），返回 True 表示应去掉参数重试"""
+    message = str(error).lower()
+    if getattr(error, "status_code", None) != 400 or not ("response_format" in message or "json" in message):
+        return False
+    with _json_mode_lock:
+        _json_mode_unsupported.add(key)
+    print(f"⚠️ {key} 不支持 JSON 模式，改为普通输出后本地解析")
+    return True
@@ -0,0 +1,207 @@
+"""
+轻量级分阶段追踪
+
+用 span 记录处理流程中各阶段的耗时，span 可以嵌套，并携带文件名、页码、提示词类型、
+模型、重试次数等属性：
+
+    with span("ocr.page", file=name, page=3) as s:
+        ...
+        s.set(retries=1)
+
+每个结束的 span 以一行 JSON 追加写入 cache/trace.jsonl（TRACE_FILE 可覆盖，TRACING=0 关闭），
+同时保留在内存中，批量处理结束时由 print_trace_summary() 按阶段汇总 p50/p95，并列出最慢的调用。
+当前 span 保存在 contextvars 中；提交到线程池的任务需用 with_context() 包装才能继承父 span。
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from medical_agent.utils import CACHE_DIR
+
+TRACE_FILE = os.getenv('TRACE_FILE', os.path.join(CACHE_DIR, "trace.jsonl"))
+# 内存中保留的已结束 span 数量上限（仅用于批次汇总）
+TRACE_MEMORY_LIMIT = int(os.getenv('TRACE_MEMORY_LIMIT', 100000))
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("medical_agent_span", default=None)
+_finished: deque = deque(maxlen=TRACE_MEMORY_LIMIT)
+_lock = threading.Lock()
+
+
+def tracing_enabled() -> bool:
+    return os.getenv('TRACING', '1') != '0'
+
+
+def _new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Span:
+    """一个计时区间；由 span() 创建，不直接实例化"""
+
+    def __init__(self, name: str, parent: Optional["Span"], attrs: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else _new_id()
+        self.span_id = _new_id()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attrs = attrs
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.status = "ok"
+        self.error: Optional[str] = None
+
+    def set(self, **attrs: Any) -> "Span":
+        """追加或覆盖属性"""
+        self.attrs.update(attrs)
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_s": round(self.duration or 0.0, 6),
+            "status": self.status,
+            "thread": threading.current_thread().name,
+            "pid": os.getpid(),
+        }
+        if self.error:
+            record["error"] = self.error
+        record.update(self.attrs)
+        return record
+
+
+def _write(record: Dict[str, Any]) -> None:
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _lock:
+        _finished.append(record)
+        try:
+            os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"⚠️ 写入追踪记录失败: {e}")
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Span]:
+    """
+    开启一个嵌套 span
+
+    Args:
+        name (str): 阶段名称，如 "ocr.page"、"llm"、"fill_form.segments"
+        **attrs: 附加属性（file / page / prompt / model / retries 等）
+
+    Yields:
+        Span: 当前 span，可用 set() 补充属性
+    """
+    current = Span(name, _current.get(), attrs)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - current._t0
+        _current.reset(token)
+        if tracing_enabled():
+            _write(current.to_dict())
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def traced(name: Optional[str] = None, **attrs: Any) -> Callable:
+    """装饰器：整个函数调用记录为一个 span"""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name or fn.__name__, **attrs):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def with_context(fn: Callable) -> Callable:
+    """包装提交到线程池的函数，使其在提交时的上下文中运行（继承当前 span）"""
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        # 同一个 Context 不能在多个线程中同时进入，每次调用使用副本
+        return ctx.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+def trace_spans(trace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """返回内存中已结束的 span（可按 trace_id 过滤）"""
+    with _lock:
+        records = list(_finished)
+    if trace_id is None:
+        return records
+    return [r for r in records if r["trace_id"] == trace_id]
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def summarize_spans(records: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    按 span 名称汇总耗时
+
+    Returns:
+        Dict[str, Dict[str, Any]]: {名称: {"count", "errors", "total_s", "p50_s", "p95_s", "max_s"}}，按总耗时降序
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for record in records:
+        groups.setdefault(record["name"], []).append(record)
+    summary = {}
+    for name, items in groups.items():
+        durations = [r["duration_s"] for r in items]
+        summary[name] = {
+            "count": len(items),
+            "errors": sum(1 for r in items if r["status"] != "ok"),
+            "total_s": round(sum(durations), 3),
+            "p50_s": round(_percentile(durations, 50), 3),
+            "p95_s": round(_percentile(durations, 95), 3),
+            "max_s": round(max(durations), 3),
+        }
+    return dict(sorted(summary.items(), key=lambda kv: -kv[1]["total_s"]))
+
+
+def print_trace_summary(trace_id: Optional[str] = None, slowest: int = 5) -> None:
+    """打印按阶段的耗时汇总以及最慢的几个 span"""
+    records = trace_spans(trace_id)
+    if not records:
+        return
+    print("\n⏱️ 阶段耗时汇总:")
+    print(f"   {'阶段':<28}{'次数':>6}{'失败':>6}{'总计s':>10}{'p50 s':>9}{'p95 s':>9}{'最大s':>9}")
+    for name, s in summarize_spans(records).items():
+        print(f"   {name:<28}{s['count']:>6}{s['errors']:>6}{s['total_s']:>10.2f}"
+              f"{s['p50_s']:>9.2f}{s['p95_s']:>9.2f}{s['max_s']:>9.2f}")
+
+    # 最慢的叶子调用（LLM / OCR 请求），便于定位长尾
+    leaves = [r for r in records if r["name"].startswith("llm")]
+    if leaves:
+        print(f"   最慢的 {min(slowest, len(leaves))} 次模型调用:")
+        for r in sorted(leaves, key=lambda r: -r["duration_s"])[:slowest]:
+            detail = " ".join(f"{k}={r[k]}" for k in ("prompt", "model", "file", "page", "location", "retries")
+                              if r.get(k) not in (None, ""))
+            print(f"     {r['duration_s']:.2f}s {detail}")
+    if tracing_enabled():
+        print(f"   详细记录: {TRACE_FILE}")
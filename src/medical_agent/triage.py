@@ -0,0 +1,192 @@
+"""
+页面分诊：OCR 之前在本地剔除空白页、二维码页等低信息页面
+
+对预处理后的二值图统计墨迹占比、文字大小的连通域数量以及墨迹外接框面积，
+结合原始灰度图的对比度，将每页判定为：
+    blank     空白页（扫描背面等）
+    low_info  低信息页（二维码、封面 logo、只有一两行字的页面）
+    content   正文页，发送给 OCR
+空白页一律跳过；低信息页只在第 1 页跳过（封面、二维码），之后的低信息页仍然 OCR——
+只有一两行“诊断意见：…”的结论页特征上与二维码页相同，而单页 OCR 的代价很小（见 skip_ocr）。
+每页的判定和特征写入 cache/page_triage.jsonl 以备审计。
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from medical_agent.imaging import get_preprocess_executor, preprocess_array
+from medical_agent.tracing import span, with_context
+from medical_agent.utils import CACHE_DIR
+
+PAGE_BLANK = "blank"
+PAGE_LOW_INFO = "low_info"
+PAGE_CONTENT = "content"
+
+# 灰度标准差低于该值视为没有任何内容（Otsu 在纯噪声上也会分出大量“墨迹”）
+TRIAGE_MIN_CONTRAST = float(os.getenv('TRIAGE_MIN_CONTRAST', 6.0))
+# 墨迹像素占比低于该值视为空白
+TRIAGE_BLANK_INK = float(os.getenv('TRIAGE_BLANK_INK', 0.002))
+# 比纸色深 TRIAGE_DARK_DELTA 以上的像素占比达到该值时不算空白（一行小字的对比度和墨迹占比都很低，但像素明显更深）
+TRIAGE_BLANK_DARK = float(os.getenv('TRIAGE_BLANK_DARK', 0.0001))
+TRIAGE_DARK_DELTA = int(os.getenv('TRIAGE_DARK_DELTA', 60))
+# 文字大小的连通域少于该值视为低信息页
+TRIAGE_MIN_COMPONENTS = int(os.getenv('TRIAGE_MIN_COMPONENTS', 25))
+# 文字连通域的外接框面积占比低于该值（内容集中在一小块区域，如二维码）视为低信息页
+TRIAGE_MIN_INK_EXTENT = float(os.getenv('TRIAGE_MIN_INK_EXTENT', 0.05))
+
+TRIAGE_LOG = os.path.join(CACHE_DIR, "page_triage.jsonl")
+
+_log_lock = threading.Lock()
+
+
+def triage_enabled() -> bool:
+    return os.getenv('PAGE_TRIAGE', '1') != '0'
+
+
+def page_features(gray: np.ndarray, binary: np.ndarray) -> Dict[str, float]:
+    """
+    计算单页的分诊特征
+
+    Args:
+        gray (np.ndarray): 原始灰度页
+        binary (np.ndarray): preprocess_array 输出的二值图
+
+    Returns:
+        Dict[str, float]: contrast / ink_ratio / dark_ratio / variance / components / ink_extent
+    """
+    height, width = binary.shape[:2]
+    area = float(height * width)
+    ink = binary < 128
+    ink_ratio = float(np.count_nonzero(ink)) / area
+    if ink_ratio > 0.5:
+        # 深色背景：墨迹取少数类
+        ink = ~ink
+        ink_ratio = 1.0 - ink_ratio
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(ink.view(np.uint8), connectivity=8)
+    stats = stats[1:]  # 去掉背景
+    # 只统计文字大小的连通域：排除噪点和大块图形（logo、表格边框、二维码整体）
+    sizes = stats[:, cv2.CC_STAT_AREA]
+    heights = stats[:, cv2.CC_STAT_HEIGHT]
+    text_like = stats[(sizes >= 4) & (sizes <= area * 0.01) & (heights <= height / 15)]
+
+    if len(text_like):
+        left = text_like[:, cv2.CC_STAT_LEFT].min()
+        top = text_like[:, cv2.CC_STAT_TOP].min()
+        right = (text_like[:, cv2.CC_STAT_LEFT] + text_like[:, cv2.CC_STAT_WIDTH]).max()
+        bottom = (text_like[:, cv2.CC_STAT_TOP] + text_like[:, cv2.CC_STAT_HEIGHT]).max()
+        ink_extent = float((right - left) * (bottom - top)) / area
+    else:
+        ink_extent = 0.0
+
+    # 纸色取抽样的中位数
+    paper = float(np.median(gray[::4, ::4]))
+    dark_ratio = float(np.count_nonzero(gray < paper - TRIAGE_DARK_DELTA)) / area
+
+    return {
+        "contrast": round(float(gray.std()), 2),
+        "ink_ratio": round(ink_ratio, 5),
+        "dark_ratio": round(dark_ratio, 6),
+        "variance": round(float(binary.var()), 1),
+        "components": int(len(text_like)),
+        "ink_extent": round(ink_extent, 4),
+    }
+
+
+def classify_page(features: Dict[str, float]) -> str:
+    """根据分诊特征判定页面类别"""
+    faint = features["contrast"] < TRIAGE_MIN_CONTRAST or features["ink_ratio"] < TRIAGE_BLANK_INK
+    if faint and features.get("dark_ratio", 0.0) < TRIAGE_BLANK_DARK:
+        return PAGE_BLANK
+    if features["components"] < TRIAGE_MIN_COMPONENTS or features["ink_extent"] < TRIAGE_MIN_INK_EXTENT:
+        return PAGE_LOW_INFO
+    return PAGE_CONTENT
+
+
+def skip_ocr(decision: Dict[str, Any], page_no: int) -> bool:
+    """
+    是否跳过该页的 OCR
+
+    Args:
+        decision (Dict): preprocess_and_triage 的分诊结果
+        page_no (int): 页码（从 1 开始）
+
+    Returns:
+        bool: 空白页，或第 1 页的低信息页返回 True
+    """
+    label = decision.get("label", PAGE_CONTENT)
+    return label == PAGE_BLANK or (label == PAGE_LOW_INFO and page_no == 1)
+
+
+def preprocess_and_triage(gray: np.ndarray) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    预处理并分诊单页（在预处理线程池中执行）
+
+    Returns:
+        Tuple[np.ndarray, Dict[str, Any]]: (二值图, {"label": 类别, **特征})
+    """
+    binary = preprocess_array(gray)
+    if not triage_enabled():
+        return binary, {"label": PAGE_CONTENT}
+    try:
+        features = page_features(gray, binary)
+    except Exception as e:
+        print(f"⚠️ 页面分诊出错: {e}，按正文页处理")
+        return binary, {"label": PAGE_CONTENT}
+    return binary, {"label": classify_page(features), **features}
+
+
+def submit_preprocess_and_triage(pages: List[np.ndarray]) -> List[Future]:
+    """
+    将各页提交到共享预处理线程池，同时完成预处理和分诊
+
+    Returns:
+        List[Future]: 每页一个 Future，结果为 (二值图, 分诊结果)
+    """
+    executor = get_preprocess_executor()
+    task = with_context(_preprocess_page)
+    return [executor.submit(task, page, page_no) for page_no, page in enumerate(pages, 1)]
+
+
+def _preprocess_page(page: np.ndarray, page_no: int) -> Tuple[np.ndarray, Dict[str, Any]]:
+    with span("preprocess", page=page_no) as s:
+        binary, decision = preprocess_and_triage(page)
+        s.set(label=decision["label"])
+        return binary, decision
+
+
+def record_triage(file_name: str, page_no: int, decision: Dict[str, Any], log_path: str = TRIAGE_LOG) -> None:
+    """将单页分诊结果追加到审计日志"""
+    if not triage_enabled():
+        return
+    entry = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "file": file_name,
+        "page": page_no,
+        **decision,
+    }
+    try:
+        with _log_lock:
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            with open(log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"⚠️ 写入页面分诊日志失败: {e}")
+
+
+def better_fallback(current: Optional[Tuple[int, np.ndarray, Dict[str, Any]]],
+                    candidate: Tuple[int, np.ndarray, Dict[str, Any]]) -> Tuple[int, np.ndarray, Dict[str, Any]]:
+    """
+    在被跳过的页面中保留信息量最大的一页
+
+    所有页面都被跳过时仍需 OCR 这一页，避免分诊误判导致整份报告没有文本。
+    """
+    if current is None or candidate[2].get("components", 0) > current[2].get("components", 0):
+        return candidate
+    return current
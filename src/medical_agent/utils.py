@@ -1,13 +1,55 @@
 import json
 import os
+import re
+import sys
+import threading
 import pandas as pd
 import time
 from pathlib import Path
 
 # Define the base paths
 ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
-CACHE_DIR = os.path.join(ROOT_DIR, 'cache')
-OCR_RESULT_DIR = os.path.join(ROOT_DIR, "../../exports/OCR_result")
+# 可用环境变量改到其他位置（基准测试等不应写入真实缓存的场景）
+CACHE_DIR = os.getenv('MEDICAL_AGENT_CACHE_DIR', os.path.join(ROOT_DIR, 'cache'))
+OCR_RESULT_DIR = os.getenv('OCR_RESULT_DIR', os.path.join(ROOT_DIR, "../../exports/OCR_result"))
+
+# 报告中的检查日期（优先）或报告日期，例如 "检查日期：2022-09-08"、"报告时间：2022年9月8日 17:19"
+_REPORT_DATE_RE = re.compile(
+    r"(检查|检验|报告)(?:日期|时间)\s*[:：]?\s*(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})")
+
+
+def extract_report_date(text: str):
+    """
+    从报告文本中提取检查日期（没有时取报告日期）
+
+    Args:
+        text (str): OCR 文本
+
+    Returns:
+        Optional[str]: "YYYY-MM-DD"，没有可识别的日期时返回 None
+    """
+    from datetime import date
+    found = {}
+    for label, year, month, day in _REPORT_DATE_RE.findall(text or ""):
+        try:
+            found.setdefault(label, date(int(year), int(month), int(day)).isoformat())
+        except ValueError:
+            continue
+    return found.get("检查") or found.get("检验") or found.get("报告")
+
+
+def gui_enabled() -> bool:
+    """
+    是否显示结果弹窗
+
+    SHOW_GUI=0 时关闭（批量 worker 建议关闭）；Linux 上没有显示服务器时自动跳过，
+    避免在无头主机上导入 tkinter 失败。
+    """
+    if os.getenv('SHOW_GUI', '1') == '0':
+        return False
+    if sys.platform.startswith('linux') and not (os.getenv('DISPLAY') or os.getenv('WAYLAND_DISPLAY')):
+        return False
+    return True
 
 def save_df_to_cache(df: pd.DataFrame, filename: str):
     """
@@ -19,7 +61,10 @@ def save_df_to_cache(df: pd.DataFrame, filename: str):
     """
     os.makedirs(CACHE_DIR, exist_ok=True)
     full_path = os.path.join(CACHE_DIR, f"{filename}.parquet")
-    df.to_parquet(full_path, index=False)
+    # 先写临时文件再原子替换，并发的 worker 不会读到写了一半的文件
+    tmp_path = f"{full_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, full_path)
     print(f"✅ Saved to {full_path}")
 
 def load_df_from_cache(filename: str) -> pd.DataFrame:
@@ -0,0 +1,321 @@
+"""
+监视文件夹增量导入
+
+持续扫描共享文件夹，报告落盘几分钟内即进入结构化流水线，而不是等夜间批量处理：
+
+    发现    os.scandir 递归流式遍历（不构造完整文件列表），只看 PDF / 图片
+    变更    与状态库（cache/watch_state.db）中的 (size, mtime) 比较；变化时再计算内容哈希确认
+    稳定    size 与 mtime 连续 WATCH_SETTLE_SECONDS 秒不变才处理，避免读到仍在拷贝的文件
+    分发    默认提交到服务任务队列（见 service，由常驻 worker 处理）；--inline 时在本进程直接处理
+
+与已处理结果内容相同的文件直接链接到已有结果（见 dedup）。
+
+用法（在仓库根目录运行）：
+    PYTHONPATH=src python -m medical_agent.watcher /data/incoming
+    PYTHONPATH=src python -m medical_agent.watcher /data/incoming --inline --once
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from medical_agent.utils import CACHE_DIR
+
+WATCH_STATE_DB = os.getenv('WATCH_STATE_DB', os.path.join(CACHE_DIR, "watch_state.db"))
+# 两次扫描之间的间隔（秒）
+WATCH_INTERVAL = float(os.getenv('WATCH_INTERVAL', 5))
+# 文件 size/mtime 保持不变多久后视为写入完成（秒）
+WATCH_SETTLE_SECONDS = float(os.getenv('WATCH_SETTLE_SECONDS', 10))
+
+WATCH_SUFFIXES = {".pdf": "pdf", ".jpg": "jpg", ".jpeg": "jpg", ".png": "jpg"}
+# 拷贝/下载过程中的临时文件
+_PARTIAL_SUFFIXES = (".part", ".tmp", ".crdownload", ".partial")
+
+# 状态：queued 已提交队列 / done / failed / duplicate
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path         TEXT PRIMARY KEY,
+    size         INTEGER NOT NULL,
+    mtime_ns     INTEGER NOT NULL,
+    content_hash TEXT,
+    status       TEXT NOT NULL,
+    output_name  TEXT,
+    job_id       TEXT,
+    error        TEXT,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_status ON files (status);
+"""
+
+
+def iter_report_files(root: str) -> Iterator[os.DirEntry]:
+    """
+    递归流式遍历目录，逐个产出报告文件（隐藏文件、临时文件和符号链接目录除外）
+
+    Args:
+        root (str): 监视的根目录
+
+    Yields:
+        os.DirEntry: 文件条目（stat 结果由 scandir 缓存）
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if name.startswith(".") or name.startswith("~$"):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file() and Path(name).suffix.lower() in WATCH_SUFFIXES \
+                                and not name.lower().endswith(_PARTIAL_SUFFIXES):
+                            yield entry
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"⚠️ 无法读取目录 {directory}: {e}")
+
+
+def output_name_for(path: str, root: str) -> str:
+    """按相对路径生成稳定且不重名的输出名"""
+    rel = os.path.relpath(path, root)
+    digest = hashlib.sha1(rel.encode("utf-8")).hexdigest()[:8]
+    return f"patient_{WATCH_SUFFIXES[Path(path).suffix.lower()]}_{Path(path).stem}_{digest}"
+
+
+class WatchState:
+    """已见文件的状态库（SQLite），按路径单条读写，十万级文件也不需要整体载入内存"""
+
+    def __init__(self, path: str = WATCH_STATE_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute("SELECT * FROM files WHERE path = ?", (path,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def upsert(self, path: str, **fields: Any) -> None:
+        fields["updated_at"] = time.time()
+        current = self.get(path)
+        if current is None:
+            record = {"size": 0, "mtime_ns": 0, "status": "queued", **fields, "path": path}
+            columns = ", ".join(record)
+            self._conn.execute(f"INSERT INTO files ({columns}) VALUES ({', '.join('?' * len(record))})",
+                               tuple(record.values()))
+        else:
+            assignments = ", ".join(f"{key} = ?" for key in fields)
+            self._conn.execute(f"UPDATE files SET {assignments} WHERE path = ?", (*fields.values(), path))
+
+    def with_status(self, status: str) -> Iterator[Dict[str, Any]]:
+        for row in self._conn.execute("SELECT * FROM files WHERE status = ?", (status,)).fetchall():
+            yield dict(row)
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM files GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class FolderWatcher:
+    """
+    扫描 → 稳定检查 → 分发
+
+    Args:
+        root (str): 监视的根目录
+        state (WatchState): 状态库
+        dispatch (Callable): dispatch(path, kind, output_name) -> (状态, job_id)；状态为 queued/done/failed
+        settle_seconds (float): 文件稳定时间
+        job_status (Callable): 查询已提交任务的状态（队列模式），inline 模式为 None
+    """
+
+    def __init__(self, root: str, state: WatchState, dispatch: Callable[[str, str, str], Tuple[str, Optional[str]]],
+                 settle_seconds: float = WATCH_SETTLE_SECONDS,
+                 job_status: Optional[Callable[[str], Optional[str]]] = None):
+        self.root = os.path.abspath(root)
+        self.state = state
+        self.dispatch = dispatch
+        self.settle_seconds = settle_seconds
+        self.job_status = job_status
+        # 内存中的稳定性观察：path -> (size, mtime_ns, 首次观察到该值的时间)
+        self._observed: Dict[str, Tuple[int, int, float]] = {}
+
+    def _settled(self, path: str, size: int, mtime_ns: int, now: float) -> bool:
+        observed = self._observed.get(path)
+        if observed is None or observed[:2] != (size, mtime_ns):
+            self._observed[path] = (size, mtime_ns, now)
+            return self.settle_seconds <= 0
+        return now - observed[2] >= self.settle_seconds
+
+    def scan(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        扫描一次，分发已稳定的新文件或已变更文件
+
+        Returns:
+            Dict[str, int]: 本次扫描的统计 {"seen", "waiting", "dispatched", "unchanged", "duplicate"}
+        """
+        from medical_agent.dedup import dedup_enabled, file_content_hash, lookup_processed, record_duplicate_link
+
+        now = time.time() if now is None else now
+        stats = {"seen": 0, "waiting": 0, "dispatched": 0, "unchanged": 0, "duplicate": 0}
+        for entry in iter_report_files(self.root):
+            stats["seen"] += 1
+            path = entry.path
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+            known = self.state.get(path)
+            if known is not None and (known["size"], known["mtime_ns"]) == (size, mtime_ns):
+                stats["unchanged"] += 1
+                continue
+            if size == 0 or not self._settled(path, size, mtime_ns, now):
+                stats["waiting"] += 1
+                continue
+            self._observed.pop(path, None)
+
+            try:
+                content_hash = file_content_hash(path)
+            except OSError as e:
+                print(f"⚠️ 无法读取 {path}: {e}")
+                continue
+            if known is not None and known["content_hash"] == content_hash:
+                # 只是 mtime 变化（如被重新拷贝），内容未变
+                self.state.upsert(path, size=size, mtime_ns=mtime_ns)
+                stats["unchanged"] += 1
+                continue
+
+            kind = WATCH_SUFFIXES[Path(path).suffix.lower()]
+            output_name = output_name_for(path, self.root)
+            match = lookup_processed(content_hash) if dedup_enabled() else None
+            if match is not None:
+                print(f"♻️ {path} 与已处理结果 {match[0]} 相同，直接链接")
+                record_duplicate_link(path, output_name, match[0], match[1])
+                self.state.upsert(path, size=size, mtime_ns=mtime_ns, content_hash=content_hash,
+                                  status="duplicate", output_name=match[0], job_id=None, error=None)
+                stats["duplicate"] += 1
+                continue
+
+            print(f"📥 新文件: {path}")
+            status, job_id = self.dispatch(path, kind, output_name)
+            self.state.upsert(path, size=size, mtime_ns=mtime_ns, content_hash=content_hash,
+                              status=status, output_name=output_name, job_id=job_id, error=None)
+            if status == "done":
+                self._record_done(content_hash, output_name)
+            stats["dispatched"] += 1
+
+        # 已被删除或改名的文件不再跟踪稳定性
+        for path in [p for p in self._observed if not os.path.exists(p)]:
+            del self._observed[path]
+        self.poll_jobs()
+        return stats
+
+    def _record_done(self, content_hash: Optional[str], output_name: str) -> None:
+        from medical_agent.dedup import dedup_enabled, record_result
+        if dedup_enabled():
+            record_result(content_hash, output_name)
+
+    def poll_jobs(self) -> None:
+        """队列模式：同步已提交任务的最终状态"""
+        if self.job_status is None:
+            return
+        for row in self.state.with_status("queued"):
+            status = self.job_status(row["job_id"]) if row["job_id"] else None
+            if status == "done":
+                self.state.upsert(row["path"], status="done")
+                self._record_done(row["content_hash"], row["output_name"])
+                print(f"✅ 已完成: {row['path']}")
+            elif status == "failed":
+                self.state.upsert(row["path"], status="failed", error="任务失败")
+                print(f"❌ 处理失败: {row['path']}（文件更新后会重新处理）")
+
+    def run(self, interval: float = WATCH_INTERVAL, once: bool = False) -> None:
+        print(f"👀 开始监视: {self.root}（扫描间隔 {interval:g}s，稳定时间 {self.settle_seconds:g}s）")
+        while True:
+            start = time.time()
+            stats = self.scan()
+            if stats["dispatched"] or stats["duplicate"]:
+                print(f"🔍 扫描 {stats['seen']} 个文件 ({time.time() - start:.2f}s): "
+                      f"新分发 {stats['dispatched']}，重复 {stats['duplicate']}，等待稳定 {stats['waiting']}")
+            if once and not stats["waiting"]:
+                break
+            time.sleep(interval)
+
+
+def queue_dispatcher(db_path: Optional[str] = None):
+    """提交到服务任务队列（原文件路径直接作为输入，不复制）"""
+    from medical_agent.service import SERVICE_DB, JobQueue
+    queue = JobQueue(db_path or SERVICE_DB)
+
+    def dispatch(path: str, kind: str, output_name: str) -> Tuple[str, Optional[str]]:
+        return "queued", queue.submit(kind, path, os.path.basename(path), output_name=output_name)
+
+    def job_status(job_id: str) -> Optional[str]:
+        job = queue.get(job_id)
+        return job["status"] if job is not None else None
+
+    return dispatch, job_status
+
+
+def inline_dispatcher():
+    """在当前进程中直接处理（无需启动服务）"""
+    from medical_agent.llm import save_usage, usage_scope
+    from medical_agent.service import warm_up
+    from medical_agent.tracing import span
+    processors = warm_up()
+
+    def dispatch(path: str, kind: str, output_name: str) -> Tuple[str, Optional[str]]:
+        try:
+            with span("file", file=os.path.basename(path)) as s, usage_scope() as usage:
+                ok = processors[kind](path, output_name)
+                s.set(ok=ok)
+            save_usage(usage, output_name)
+        except Exception as e:
+            print(f"❌ 处理 {path} 时出错: {e}")
+            ok = False
+        return ("done" if ok else "failed"), None
+
+    return dispatch, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="监视文件夹，增量导入新报告")
+    parser.add_argument("root", help="监视的根目录")
+    parser.add_argument("--inline", action="store_true", help="在本进程中直接处理，不提交到服务队列")
+    parser.add_argument("--once", action="store_true", help="处理完当前文件后退出")
+    parser.add_argument("--interval", type=float, default=WATCH_INTERVAL)
+    parser.add_argument("--settle", type=float, default=WATCH_SETTLE_SECONDS)
+    parser.add_argument("--state", default=WATCH_STATE_DB)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    if not os.path.isdir(args.root):
+        print(f"❌ 监视目录不存在或不是目录: {args.root}")
+        return
+    dispatch, job_status = inline_dispatcher() if args.inline else queue_dispatcher()
+    state = WatchState(args.state)
+    try:
+        FolderWatcher(args.root, state, dispatch, args.settle, job_status).run(args.interval, args.once)
+    except KeyboardInterrupt:
+        print("\n🛑 停止监视")
+    finally:
+        print(f"📊 文件状态: {state.counts()}")
+        state.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import json
+import os
+import re
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent import tracing
+from medical_agent.agent import _ask_qwen_alias_batch
+
+
+class FakeClient:
+    """对批量请求按 id 返回预设答案，记录每次请求的项数"""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.batches = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, timeout=None, response_format=None):
+        ids = re.findall(r'"id": "([^"]+)"', messages[-1]["content"])
+        self.batches.append(ids)
+        content = json.dumps({i: self.answers[i] for i in ids if i in self.answers}, ensure_ascii=False)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+def _item(item_id, query, *names):
+    return {"id": item_id, "query": query, "candidates": [{"exact_name": n, "aliases": []} for n in names]}
+
+
+def test_one_request_per_report(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(tmp_path / "trace.jsonl"))
+    items = [
+        _item("q1", "左室射血分数", "左心室射血分数(LVEF)", "左心室缩短分数(FS)"),
+        _item("q2", "肺动脉压", "肺动脉收缩压(PASP)"),
+        _item("q3", "E/e'", "二尖瓣E/e'"),
+        _item("q4", "某项目", "主动脉根部内径(AO)"),
+    ]
+    client = FakeClient({"q1": "左心室射血分数(LVEF)", "q2": "no_match", "q3": "E/e'"})
+
+    answers = _ask_qwen_alias_batch(client, "qwen-max", items)
+    assert len(client.batches) == 1
+    # 不在该项候选中的回答、缺失的 id 视为没有明确结论
+    assert answers == {"q1": "左心室射血分数(LVEF)", "q2": "no_match", "q3": "", "q4": ""}
+
+    monkeypatch.setenv("ALIAS_BATCH_SIZE", "3")
+    client.batches = []
+    _ask_qwen_alias_batch(client, "qwen-max", items)
+    assert client.batches == [["q1", "q2", "q3"], ["q4"]]
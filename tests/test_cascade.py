@@ -0,0 +1,88 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent import tracing
+from medical_agent.cascade import VALIDATORS, ModelCascade
+from medical_agent.llm import chat_completion, report_messages, usage_scope
+from medical_agent.prompts import FILLIN_PROMPT_5, FILLIN_PROMPT_5_DEFAULT
+
+
+class ModelClient:
+    """按模型返回预设内容，并记录调用的模型"""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.models = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, timeout=None):
+        self.models.append(model)
+        reply = self.replies[model]
+        if isinstance(reply, Exception):
+            raise reply
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(reply, ensure_ascii=False)))],
+            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=2),
+        )
+
+
+def test_cascade_escalation(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(tmp_path / "trace.jsonl"))
+    cascade = ModelCascade("fast", "strong")
+    messages = [{'role': 'user', 'content': '候选: ["左心室射血分数", "左房内径"]'}]
+
+    with usage_scope() as ledger:
+        # 高置信度分类直接采纳快速模型
+        client = ModelClient({"fast": {"report_type": "CTA", "confidence": "高"}})
+        chat_completion(client, cascade, messages, kind="classifier")
+        assert client.models == ["fast"]
+
+        # 低置信度升级到大模型
+        client = ModelClient({"fast": {"report_type": "CTA", "confidence": "低"},
+                              "strong": {"report_type": "Ultrasound", "confidence": "高"}})
+        completion = chat_completion(client, cascade, messages, kind="classifier")
+        assert client.models == ["fast", "strong"]
+        assert "Ultrasound" in completion.choices[0].message.content
+
+        # 选出的名称不在候选中、或快速模型调用失败，都升级
+        client = ModelClient({"fast": {"match": "射血分数"}, "strong": {"match": "左心室射血分数"}})
+        chat_completion(client, cascade, messages, kind="key_pick")
+        client = ModelClient({"fast": RuntimeError("429"), "strong": {"match": "左房内径"}})
+        chat_completion(client, cascade, messages, kind="key_pick")
+
+        # 没有校验规则的类型直接使用大模型
+        client = ModelClient({"strong": {}})
+        chat_completion(client, cascade, messages, kind="other")
+        assert client.models == ["strong"]
+
+    by_prompt = ledger.to_dict()["by_prompt"]
+    assert by_prompt["classifier"]["calls"] == 3
+    assert by_prompt["classifier"]["escalations"] == 1
+    assert by_prompt["key_pick"]["escalations"] == 2
+    assert by_prompt["key_pick"]["errors"] == 1
+    assert ledger.to_dict()["by_model"]["strong"]["calls"] == 4
+
+
+def test_segment_validation():
+    report = "冠状动脉CTA检查\n左前降支近段可见混合密度斑块，管腔中度狭窄。\n右冠状动脉未见明显异常。"
+
+    def check(location, result):
+        messages = report_messages("system", report, FILLIN_PROMPT_5.format(location=location))
+        return VALIDATORS["segment"](result, messages)
+
+    finding = dict(FILLIN_PROMPT_5_DEFAULT, 斑块种类="混合密度斑块", 狭窄程度="中度")
+    assert check("左前降支近段", finding)
+    assert check("左前降支近段", dict(finding, 斑块种类="硬斑块(钙化性斑块)"))
+    # 斑块种类整体精确匹配，不接受包含合法取值的其他文本
+    assert not check("左前降支近段", dict(finding, 斑块种类="未见钙化"))
+    assert not check("左前降支近段", dict(finding, 斑块种类="-（未提及）"))
+    # 报告有阳性所见时全部为默认值视为漏检；未提及的节段默认值正常
+    assert not check("左前降支近段", dict(FILLIN_PROMPT_5_DEFAULT))
+    assert check("左回旋支远段", dict(FILLIN_PROMPT_5_DEFAULT))
+
+    assert not VALIDATORS["cta_header"]({}, [])
+    assert VALIDATORS["cta_gapfill"]({"左前降支近段": {"斑块种类": "软斑块"}}, [])
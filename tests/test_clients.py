@@ -0,0 +1,59 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent.clients import ConnectionStats, LazyClient, build_http_client
+
+
+class _ChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({
+            "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "test",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "ok"}}],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_pooled_client_reuses_connections():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ChatHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        stats = ConnectionStats()
+        client = OpenAI(api_key="test", base_url=f"http://127.0.0.1:{server.server_port}/v1",
+                        http_client=build_http_client(stats))
+        for _ in range(5):
+            completion = client.chat.completions.create(model="test", messages=[{"role": "user", "content": "hi"}])
+            assert completion.choices[0].message.content == "ok"
+        snapshot = stats.snapshot()
+        assert snapshot["requests"] == 5
+        assert snapshot["new_connections"] == 1
+        assert snapshot["reused"] == 4
+        client.close()
+    finally:
+        server.shutdown()
+
+
+def test_lazy_client():
+    created = []
+    lazy = LazyClient(lambda: created.append(1) or "value")
+    assert not created
+    assert lazy.upper() == "VALUE"
+    assert lazy.upper() == "VALUE"
+    assert created == [1]
@@ -0,0 +1,51 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent.compaction import compact_ocr_text, load_boilerplate_patterns
+
+PAGE_HEADER = "某某医院超声检查报告单\n姓名：张三 性别：男 年龄：56岁"
+
+OCR_TEXT = f"""=== 第1页 ===
+{PAGE_HEADER}
+测量值：
+左心室射血分数（LVEF）　６２％   E/A  0.84
+超声提示：左房稍大。
+
+=== 第2页 ===
+{PAGE_HEADER}
+超声所见：左房稍大，余房室腔内径正常。
+报告时间：2022-09-08 17:19:39
+审核医师：
+注：1.本报告仅供临床科室申请医生诊治参考！
+2.二维码链接图像，请妥善保存本报告！
+"""
+
+
+def test_compact_ocr_text():
+    compacted, stats = compact_ocr_text(OCR_TEXT, load_boilerplate_patterns(path=""))
+
+    # 全角数字/符号转半角，中文标点保留
+    assert "左心室射血分数（LVEF） 62%  E/A  0.84" in compacted
+    # 第二页重复的页眉只保留一次
+    assert compacted.count("姓名：张三") == 1
+    assert "超声所见：左房稍大，余房室腔内径正常。" in compacted
+    for boilerplate in ("=== 第", "报告时间", "审核医师", "本报告仅供", "二维码"):
+        assert boilerplate not in compacted
+
+    assert stats["duplicate_lines"] == 2
+    assert stats["boilerplate_lines"] == 4
+    assert stats["chars_after"] == len(compacted)
+    assert stats["tokens_saved"] > 0
+
+
+def test_custom_patterns_and_fallback(tmp_path):
+    rules = tmp_path / "boilerplate.txt"
+    rules.write_text("# 医院抬头\n^某某医院\n", encoding="utf-8")
+    compacted, _ = compact_ocr_text(OCR_TEXT, load_boilerplate_patterns(path=str(rules)))
+    assert "某某医院" not in compacted
+
+    # 规则删光全部内容时退回原文
+    only_footer = "报告时间：2022-09-08 17:19:39"
+    assert compact_ocr_text(only_footer, load_boilerplate_patterns(path=""))[0] == only_footer
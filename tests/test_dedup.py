@@ -0,0 +1,90 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent import dedup
+from medical_agent.dedup import (group_duplicates, hamming_distance, link_confirmed_duplicate, linked_result,
+                                 lookup_processed, near_processed, perceptual_hash, record_result, record_text,
+                                 texts_match, normalize_report_text)
+
+
+def _report_page(text: str) -> np.ndarray:
+    page = np.full((1100, 800), 250, np.uint8)
+    for i, y in enumerate(range(80, 1000, 60)):
+        cv2.putText(page, f"{text} {i}", (40 + (i % 3) * 60, y), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 20, 2)
+    cv2.rectangle(page, (30, 30), (500, 300), 0, -1)
+    return page
+
+
+def test_group_duplicates(tmp_path):
+    page = _report_page("LVEF 59%")
+    other = cv2.flip(_report_page("LAD 12mm"), 0)
+
+    original = tmp_path / "a.png"
+    copy = tmp_path / "a_copy.png"
+    rescan = tmp_path / "a_rescan.jpg"
+    different = tmp_path / "b.png"
+    cv2.imwrite(str(original), page)
+    copy.write_bytes(original.read_bytes())
+    cv2.imwrite(str(rescan), cv2.resize(page, (600, 825)), [cv2.IMWRITE_JPEG_QUALITY, 60])
+    cv2.imwrite(str(different), other)
+
+    assert hamming_distance(perceptual_hash(page), perceptual_hash(other)) > 10
+
+    groups = group_duplicates([str(original), str(copy), str(rescan), str(different)])
+    # 只有内容完全相同的文件分为一组；重新扫描的版本只是候选，需 OCR 后确认
+    assert len(groups) == 3
+    first, rescanned, second = groups
+    assert {first["representative"], *first["duplicates"]} == {str(original), str(copy)}
+    assert rescanned["duplicates"] == [] and rescanned["near"][0][0] == first["representative"]
+    assert second["representative"] == str(different) and second["near"] == []
+
+
+def test_same_template_different_values(tmp_path, monkeypatch):
+    # 同一模板打印的两份报告：版面几乎相同，只有测量值不同
+    first, second = tmp_path / "p1.png", tmp_path / "p2.png"
+    cv2.imwrite(str(first), _report_page("LVEF 59%"))
+    cv2.imwrite(str(second), _report_page("LVEF 35%"))
+
+    groups = group_duplicates([str(first), str(second)])
+    assert [g["duplicates"] for g in groups] == [[], []]
+    assert groups[1]["near"], "同模板报告的 pHash 应当近似（否则本测试没有意义）"
+
+    monkeypatch.setattr(dedup, "CACHE_DIR", str(tmp_path))
+    db_path = str(tmp_path / "dedup.db")
+    (tmp_path / "patient_p1.parquet").write_bytes(b"")
+    text_1 = "=== 第1页 ===\n姓名：张三 住院号：2022041478\n左心室射血分数 59%\n"
+    record_text("patient_p1", text_1, db_path=db_path)
+
+    candidates = [("patient_p1", 1)]
+    assert link_confirmed_duplicate(str(second), "patient_p2", text_1.replace("59%", "35%"), candidates,
+                                    db_path=db_path) is None
+    # 同一份报告的另一次 OCR（换行不同）才会链接
+    rescan_text = "姓名：张三  住院号：2022041478 左心室射血分数 59%"
+    assert link_confirmed_duplicate(str(second), "patient_p2", rescan_text, candidates,
+                                    db_path=db_path) == "patient_p1"
+    assert not texts_match(normalize_report_text("住院号 123 EF 59"), normalize_report_text("住院号 124 EF 59"))
+    assert linked_result("patient_p2", db_path=db_path) == "patient_p1"
+    # 重新处理后清除旧链接
+    record_text("patient_p2", text_1.replace("59%", "35%"), db_path=db_path)
+    assert linked_result("patient_p2", db_path=db_path) is None
+
+
+def test_store_lookups(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, "CACHE_DIR", str(tmp_path))
+    db_path = str(tmp_path / "dedup.db")
+    (tmp_path / "a.parquet").write_bytes(b"")
+    hashes = [0x0F0F0F0F0F0F0F0F, 0x00FF00FF00FF00FF]
+    record_result("sha-a", "a", hashes, db_path=db_path)
+    record_result("sha-b", "b", [0x0F0F0F0F0F0F0F0F], db_path=db_path)
+
+    assert lookup_processed("sha-a", db_path=db_path) == ("a", 0)
+    # 结果文件已删除时视为未处理
+    assert lookup_processed("sha-b", db_path=db_path) is None
+    assert near_processed([hashes[0] ^ 0b111, hashes[1]], db_path=db_path) == [("a", 3)]
+    assert near_processed([hashes[0], hashes[1] ^ 0xFFFF], db_path=db_path) == []
+    assert near_processed(hashes[:1], db_path=db_path) == []
@@ -0,0 +1,141 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from types import SimpleNamespace
+
+import pytest
+
+from medical_agent import endpoints, structured
+from medical_agent.cascade import ModelCascade
+from medical_agent.endpoints import CircuitBreaker, Endpoint, EndpointPool, parse_endpoints
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, message=""):
+        super().__init__(f"HTTP {status_code} {message}".strip())
+        self.status_code = status_code
+
+
+class FakeClient:
+    def __init__(self, error=None):
+        self.error = error
+        self.models_seen = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.models = SimpleNamespace(list=self.list_models)
+
+    def create(self, model, messages, timeout=None):
+        self.models_seen.append(model)
+        if self.error is not None:
+            raise self.error
+        return model
+
+    def list_models(self, timeout=None):
+        if self.error is not None:
+            raise self.error
+        return []
+
+
+class JsonClient(FakeClient):
+    """拒绝 response_format 的后端（reject=True）或接受它的后端，记录每次请求的 (模型, response_format)"""
+
+    def __init__(self, reject):
+        super().__init__()
+        self.reject = reject
+        self.requests = []
+
+    def create(self, model, messages, timeout=None, response_format=None):
+        self.requests.append((model, response_format))
+        if response_format and self.reject:
+            raise StatusError(400, "response_format is not supported")
+        return model
+
+
+def test_parse_endpoints():
+    parsed = [(e.name, e.model, e.weight) for e in parse_endpoints(" qwen, baichuan=Baichuan-M2*2 ,")]
+    assert parsed == [("qwen", None, 1.0), ("baichuan", "Baichuan-M2", 2.0)]
+
+
+def test_balance_and_model_mapping():
+    qwen, baichuan = FakeClient(), FakeClient()
+    pool = EndpointPool([Endpoint("qwen", client=qwen), Endpoint("baichuan", "Baichuan-M2", client=baichuan)])
+    pool.endpoints[0].latency, pool.endpoints[1].latency = 2.0, 0.5
+
+    assert pool.chat.completions.create(model="qwen-max", messages=[]) == "Baichuan-M2"
+    # 较慢的后端有请求进行中时仍优先选快的；快的积压后分给慢的
+    pool.endpoints[1].outstanding = 4
+    assert pool.chat.completions.create(model="qwen-max", messages=[]) == "qwen-max"
+    assert qwen.models_seen == ["qwen-max"] and baichuan.models_seen == ["Baichuan-M2"]
+
+
+def test_failover_and_client_errors():
+    broken, healthy = FakeClient(StatusError(503)), FakeClient()
+    pool = EndpointPool([Endpoint("a", client=broken), Endpoint("b", client=healthy)], mode="least_outstanding")
+    assert pool.create(model="m", messages=[]) == "m"
+    assert pool.snapshot()["a"]["failures"] == 1 and healthy.models_seen == ["m"]
+
+    # 400 是请求本身的问题：直接抛出，不换后端、不计入故障
+    bad_request = EndpointPool([Endpoint("a", client=FakeClient(StatusError(400))), Endpoint("b", client=healthy)])
+    with pytest.raises(StatusError):
+        bad_request.create(model="m", messages=[])
+    assert bad_request.snapshot()["a"]["failures"] == 0
+
+
+def test_circuit_breaker(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(endpoints.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(threshold=2, cooldown=30)
+
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    now[0] += 30
+    assert breaker.allow() and not breaker.allow()     # 半开：只放行一个试探请求
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_all_endpoints_open():
+    pool = EndpointPool([Endpoint("a", client=FakeClient(ConnectionError("refused")))])
+    pool.endpoints[0].breaker.threshold = 1
+    with pytest.raises(ConnectionError):
+        pool.create(model="m", messages=[])
+    with pytest.raises(RuntimeError):
+        pool.create(model="m", messages=[])
+    assert pool.health_check() == {"a": False}
+
+
+def test_json_mode_per_endpoint(monkeypatch):
+    monkeypatch.setattr(structured, "_json_mode_unsupported", set())
+    json_format = {"type": "json_object"}
+    local, dashscope = JsonClient(reject=True), JsonClient(reject=False)
+    pool = EndpointPool([Endpoint("local", "Baichuan-M2", client=local)])
+
+    # 拒绝后在同一后端去掉参数重试，之后该后端不再发送
+    assert pool.create(model="qwen-max", messages=[], response_format=json_format) == "Baichuan-M2"
+    assert pool.create(model="qwen-turbo", messages=[], response_format=json_format) == "Baichuan-M2"
+    assert local.requests == [("Baichuan-M2", json_format), ("Baichuan-M2", None), ("Baichuan-M2", None)]
+
+    # 其他后端上的 qwen-max / qwen-turbo 不受影响
+    pool = EndpointPool([Endpoint("qwen", client=dashscope)])
+    pool.create(model="qwen-max", messages=[], response_format=json_format)
+    pool.create(model="qwen-turbo", messages=[], response_format=json_format)
+    assert dashscope.requests == [("qwen-max", json_format), ("qwen-turbo", json_format)]
+
+
+def test_cascade_skips_mapped_backends():
+    cascade = ModelCascade("qwen-turbo", "qwen-max")
+    mapped = EndpointPool([Endpoint("baichuan", "Baichuan-M2", client=FakeClient())])
+    mixed = EndpointPool([Endpoint("qwen", client=FakeClient()), Endpoint("baichuan", "Baichuan-M2", client=FakeClient())])
+    assert mapped.backend_models("qwen-turbo") == mapped.backend_models("qwen-max") == {"Baichuan-M2"}
+    # 两个模型在所有后端上都相同时升级只会重复调用
+    assert not cascade.routes("classifier", mapped)
+    assert cascade.routes("classifier", mixed) and cascade.routes("classifier")
@@ -0,0 +1,104 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent import hedging
+from medical_agent.hedging import HedgeBudget, LatencyTracker, hedged_call
+
+
+@pytest.fixture
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(hedging, "tracker", LatencyTracker())
+    monkeypatch.setattr(hedging, "budget", HedgeBudget(ratio=0.5))
+    monkeypatch.setattr(hedging, "HEDGE_MIN_DELAY", 0.0)
+    monkeypatch.setattr(hedging, "HEDGE_MIN_SAMPLES", 5)
+
+
+def test_hedge_after_percentile(fresh_state):
+    timeouts = []
+    for _ in range(5):
+        hedging.tracker.record("segment", 0.02)
+        hedging.budget.record_call()
+    assert hedging.tracker.threshold("segment") == pytest.approx(0.02)
+
+    calls = []
+    lock = threading.Lock()
+
+    def request(timeout):
+        timeouts.append(timeout)
+        with lock:
+            calls.append(len(calls))
+            first = len(calls) == 1
+        # 第一次请求是长尾，对冲请求很快返回
+        time.sleep(1.0 if first else 0.01)
+        return "slow" if first else "fast"
+
+    start = time.perf_counter()
+    result, info = hedged_call("segment", request)
+    assert result == "fast"
+    assert info == {"hedged": True, "hedge_won": True}
+    assert time.perf_counter() - start < 0.5
+    assert timeouts == [hedging.LLM_TIMEOUT, hedging.LLM_TIMEOUT]
+
+
+def test_no_hedge_without_samples_or_budget(fresh_state):
+    result, info = hedged_call("classifier", lambda timeout: timeout)
+    assert result == hedging.LLM_TIMEOUT and not info["hedged"]
+
+    # 预算用尽时只等待原请求
+    for _ in range(5):
+        hedging.tracker.record("segment", 0.01)
+    hedging.budget.ratio = 0.0
+    result, info = hedged_call("segment", lambda timeout: time.sleep(0.05) or "primary")
+    assert result == "primary" and not info["hedged"]
+
+
+def test_hedge_survives_primary_failure(fresh_state):
+    for _ in range(5):
+        hedging.tracker.record("segment", 0.01)
+        hedging.budget.record_call()
+    attempts = []
+
+    def request(timeout):
+        attempts.append(timeout)
+        if len(attempts) == 1:
+            time.sleep(0.1)
+            raise TimeoutError("primary timed out")
+        return "hedge"
+
+    assert hedged_call("segment", request)[0] == "hedge"
+
+
+def test_outstanding_hedges_bounded(fresh_state):
+    hedging.budget.max_outstanding = 1
+    for _ in range(5):
+        hedging.tracker.record("segment", 0.01)
+        hedging.budget.record_call()
+    primary_done = threading.Event()
+    calls = []
+
+    def request(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            # 原请求是长尾，对冲请求先返回后它仍占用连接
+            primary_done.wait(5)
+            return "slow"
+        return "fast"
+
+    assert hedged_call("segment", request) == ("fast", {"hedged": True, "hedge_won": True})
+    assert hedging.budget.outstanding == 1
+
+    # 败者未结束时不再发出新的对冲
+    result, info = hedged_call("segment", lambda timeout: time.sleep(0.1) or "primary")
+    assert result == "primary" and not info["hedged"]
+
+    primary_done.set()
+    deadline = time.time() + 5
+    while hedging.budget.outstanding and time.time() < deadline:
+        time.sleep(0.01)
+    assert hedging.budget.outstanding == 0
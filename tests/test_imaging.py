@@ -0,0 +1,85 @@
+import base64
+import io
+import os
+import sys
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent.imaging import (
+    OCR_MAX_PIXELS,
+    build_image_content,
+    fit_to_pixel_budget,
+    load_image_file_base64,
+    plan_pdf_dpi,
+)
+
+
+def test_plan_pdf_dpi_fits_budget():
+    # A4 页面
+    dpi = plan_pdf_dpi(595.276, 841.89)
+    pixels = (595.276 / 72 * dpi) * (841.89 / 72 * dpi)
+    assert pixels <= OCR_MAX_PIXELS
+    assert pixels > OCR_MAX_PIXELS * 0.9
+    # 很小的页面不超过 300dpi
+    assert plan_pdf_dpi(100, 100) == 300
+
+
+def test_fit_to_pixel_budget():
+    image = Image.new('RGB', (3000, 4000), 'white')
+    fitted = fit_to_pixel_budget(image)
+    assert fitted.width * fitted.height <= OCR_MAX_PIXELS
+    small = Image.new('RGB', (100, 100), 'white')
+    assert fit_to_pixel_budget(small) is small
+
+
+def test_load_image_file_base64(tmp_path):
+    big_path = tmp_path / "big.png"
+    Image.new('RGB', (2000, 2000), 'white').save(big_path)
+    data, mime = load_image_file_base64(str(big_path))
+    assert mime == "image/jpeg"
+    decoded = Image.open(io.BytesIO(base64.b64decode(data)))
+    assert decoded.width * decoded.height <= OCR_MAX_PIXELS
+
+    small_path = tmp_path / "small.png"
+    Image.new('RGB', (200, 200), 'white').save(small_path)
+    data, mime = load_image_file_base64(str(small_path))
+    assert mime == "image/png"
+    assert base64.b64decode(data) == small_path.read_bytes()
+
+    content = build_image_content(data, mime)
+    assert content["image_url"]["url"].startswith("data:image/png;base64,")
+    assert content["max_pixels"] == OCR_MAX_PIXELS
+
+
+def test_lean_image_path():
+    import numpy as np
+
+    from medical_agent.imaging import array_to_data_url, preprocess_array
+
+    gray = np.full((400, 300), 240, np.uint8)
+    gray[100:120, 50:250] = 10
+    binary = preprocess_array(gray)
+    assert binary.dtype == np.uint8 and binary.shape == gray.shape
+    assert set(np.unique(binary)) <= {0, 255}
+    # 输入缓冲区不被修改
+    assert gray[0, 0] == 240
+
+    url = array_to_data_url(binary)
+    assert url.startswith("data:image/jpeg;base64,")
+    decoded = Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1])))
+    assert decoded.size == (300, 400)
+
+
+def test_preprocess_pages_matches_serial():
+    import numpy as np
+
+    from medical_agent.imaging import preprocess_array, preprocess_pages
+
+    rng = np.random.default_rng(0)
+    pages = [rng.integers(0, 256, (200, 150), dtype=np.uint8) for _ in range(5)]
+    results = preprocess_pages(pages)
+    assert len(results) == len(pages)
+    for page, result in zip(pages, results):
+        assert np.array_equal(result, preprocess_array(page))
@@ -0,0 +1,87 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent import llm, tracing
+from medical_agent.llm import chat_completion, report_messages, save_usage, usage_scope
+from medical_agent.prompts import REPORT_EXCERPT_PROMPT
+
+
+class FakeClient:
+    """按顺序返回预设结果的 OpenAI 兼容客户端"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, timeout=None):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="{}"))],
+            usage=SimpleNamespace(prompt_tokens=outcome[0], completion_tokens=outcome[1],
+                                  prompt_tokens_details=SimpleNamespace(cached_tokens=outcome[2] if len(outcome) > 2 else 0)),
+        )
+
+
+def test_usage_ledger(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(tmp_path / "trace.jsonl"))
+    client = FakeClient([(100, 10), RuntimeError("429"), (120, 12, 96), (50, 5)])
+    messages = [{'role': 'user', 'content': 'x'}]
+
+    with usage_scope() as batch:
+        with usage_scope() as report:
+            chat_completion(client, "qwen-max", messages, kind="segment", prompt="FILLIN_PROMPT_5")
+            with pytest.raises(RuntimeError):
+                chat_completion(client, "qwen-max", messages, kind="segment", retries=0)
+            chat_completion(client, "qwen-max", messages, kind="segment", retries=1)
+        chat_completion(client, "qwen-turbo", messages, kind="classifier")
+
+    report_totals = report.totals()
+    assert report_totals["calls"] == 3
+    assert report_totals["errors"] == 1
+    assert report_totals["retries"] == 1
+    assert report_totals["prompt_tokens"] == 220
+    assert report_totals["total_tokens"] == 242
+    assert report_totals["cached_tokens"] == 96
+
+    # 子账本的记录同时计入批次账本
+    summary = batch.to_dict()
+    assert summary["totals"]["calls"] == 4
+    assert summary["by_prompt"]["classifier"]["prompt_tokens"] == 50
+    assert summary["by_model"]["qwen-max"]["completion_tokens"] == 22
+
+    path = save_usage(report, "patient_a")
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)["by_prompt"]["segment"]["calls"] == 3
+
+
+def test_report_messages_share_prefix():
+    # 同一报告的不同任务只在结尾不同，前缀（系统提示 + OCR 文本）逐字相同
+    first = report_messages("system", "报告正文", "任务一")
+    second = report_messages("system", "报告正文", "任务二")
+    assert first[0] == second[0]
+    assert "报告正文" in first[1]["content"]
+    assert first[1]["content"].endswith("任务一")
+    assert first[1]["content"][:-3] == second[1]["content"][:-3]
+
+
+def test_report_calls_count_full_context_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(tmp_path / "trace.jsonl"))
+    client = FakeClient([(100, 10)] * 3)
+    with usage_scope() as ledger:
+        chat_completion(client, "qwen-max", report_messages("system", "报告正文", "任务"), kind="segment")
+        # 只发送摘录、或不带报告文本（别名批量复核）的调用不计
+        chat_completion(client, "qwen-max", report_messages("system", "摘录", "任务", REPORT_EXCERPT_PROMPT),
+                        kind="segment")
+        chat_completion(client, "qwen-max", [{'role': 'user', 'content': '候选列表'}], kind="alias_batch")
+    by_prompt = ledger.to_dict()["by_prompt"]
+    assert (by_prompt["segment"]["calls"], by_prompt["segment"]["report_calls"]) == (2, 1)
+    assert by_prompt["alias_batch"]["report_calls"] == 0
@@ -0,0 +1,25 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent.pdf_text import is_usable_page_text, text_quality
+
+
+def test_text_layer_quality():
+    good = (
+        "超声心动图报告\n"
+        "左心室射血分数(LVEF)      59     %\n"
+        "左心室舒张末期内径(LVEDD) 42     mm\n"
+        "室间隔厚度(IVSd)          8      mm\n"
+        "主动脉瓣口流速            1.2    m/s\n"
+    )
+    assert is_usable_page_text(good)
+
+    # 中文字体缺少 ToUnicode 映射时的典型输出
+    mojibake = "³¬Éù¼ì²é±¨¸æ ×óÐÄÊÒÉäÑª·ÖÊý 59 % " * 3
+    assert text_quality(mojibake)["garbage_ratio"] > 0.5
+    assert not is_usable_page_text(mojibake)
+
+    assert not is_usable_page_text("(cid:12)(cid:34)(cid:56) " * 20)
+    assert not is_usable_page_text("第1页")
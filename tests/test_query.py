@@ -0,0 +1,131 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent.query import (build_measurement_index, compact_measurement_index, list_metrics,
+                                 measurement_distribution, query_measurements)
+
+
+def _write_case(cache_dir, case_id, rows, report_date=None):
+    df = pd.DataFrame(rows, columns=["名称", "英文", "类型", "症状", "数值", "单位"])
+    if report_date:
+        df.attrs["report_date"] = report_date
+    df.to_parquet(os.path.join(cache_dir, f"{case_id}.parquet"), index=False)
+
+
+def test_query_measurements(tmp_path):
+    cache_dir = tmp_path / "cache"
+    index_dir = tmp_path / "index"
+    cache_dir.mkdir()
+    _write_case(cache_dir, "patient_1", [
+        ["左心室射血分数(LVEF)", "LV ejection fraction", "", "", "35", "%"],
+        ["二尖瓣E/A比值(MV E/A)", "MV E/A ratio", "", "", "2.4", ""],
+        ["左前降支近段(pLAD)", "", "", "", "25%", ""],
+    ], report_date="2025-08-12")
+    _write_case(cache_dir, "patient_2", [
+        ["左心室射血分数(LVEF)", "LV ejection fraction", "", "", "62", "%"],
+        ["左前降支中段(mLAD)", "", "", "", "85", "%"],
+        ["右心室收缩压(RVSP)", "", "", "", "-", "mmHg"],
+    ], report_date="2024-03-02")
+    _write_case(cache_dir, "qwen_cache", [
+        ["左心室射血分数(LVEF)", "", "", "", "10", "%"],
+    ])
+
+    stats = build_measurement_index(str(cache_dir), str(index_dir))
+    assert stats["cases"] == 2
+    assert stats["rows"] == 5
+
+    low_ef = query_measurements("LVEF", "<", 40, index_dir=str(index_dir))
+    assert low_ef["case_id"].tolist() == ["patient_1"]
+
+    high_ea = query_measurements("二尖瓣E/A比值", ">", 2, index_dir=str(index_dir))
+    assert high_ea["case_id"].tolist() == ["patient_1"]
+
+    # 子串匹配只在 fuzzy=True 时启用，否则报错并列出候选
+    with pytest.raises(ValueError, match="mLAD, pLAD"):
+        measurement_distribution("LAD", bins=2, index_dir=str(index_dir))
+    lad = measurement_distribution("LAD", bins=2, index_dir=str(index_dir), fuzzy=True)
+    assert set(lad["summary"].index) == {"pLAD", "mLAD"}
+    assert query_measurements(["pLAD"], index_dir=str(index_dir))["case_id"].tolist() == ["patient_1"]
+    with pytest.raises(ValueError, match="LVEF"):
+        query_measurements("EF", index_dir=str(index_dir))
+    assert query_measurements("TAPSE", index_dir=str(index_dir)).empty
+
+    with pytest.raises(ValueError):
+        query_measurements("LVEF", "<", index_dir=str(index_dir))
+
+    # 时间范围按检查日期筛选，而不是结果文件的写入时间
+    q3 = query_measurements("LVEF", since="2025-07-01", until="2025-10-01", index_dir=str(index_dir))
+    assert q3["case_id"].tolist() == ["patient_1"]
+    assert str(q3["report_date"].iloc[0].date()) == "2025-08-12"
+    assert query_measurements("LVEF", since="2999-01-01", index_dir=str(index_dir)).empty
+    assert len(query_measurements("LVEF", since="2020-01-01", index_dir=str(index_dir),
+                                  date_field="processed_at")) == 2
+
+    # 未变化时不重新读取，删除病例后从索引移除
+    assert build_measurement_index(str(cache_dir), str(index_dir))["added"] == 0
+    os.remove(cache_dir / "patient_2.parquet")
+    stats = build_measurement_index(str(cache_dir), str(index_dir))
+    assert stats["removed"] == 1
+    assert query_measurements("LVEF", index_dir=str(index_dir))["case_id"].tolist() == ["patient_1"]
+
+
+def test_index_fragments(tmp_path, monkeypatch):
+    import medical_agent.query as query
+    cache_dir = tmp_path / "cache"
+    index_dir = tmp_path / "index"
+    parts_dir = index_dir / "parts"
+    cache_dir.mkdir()
+    monkeypatch.setattr(query, "INDEX_MAX_PARTS", 3)
+
+    # 每批新增病例写成一个分片，已有分片不被重写
+    for i in range(3):
+        _write_case(cache_dir, f"p{i}", [["左心室射血分数(LVEF)", "", "", "", str(40 + i), "%"]])
+        build_measurement_index(str(cache_dir), str(index_dir))
+    first = sorted(n for n in os.listdir(parts_dir) if n.endswith(".cases.json"))
+    assert len(first) == 3
+    mtimes = {n: os.stat(parts_dir / n).st_mtime_ns for n in first}
+
+    # 修改一个病例只重写它所在的分片
+    _write_case(cache_dir, "p1", [["左心室射血分数(LVEF)", "", "", "", "20", "%"]])
+    os.utime(cache_dir / "p1.parquet", ns=(1, 1))
+    stats = build_measurement_index(str(cache_dir), str(index_dir))
+    assert stats["added"] == 1 and stats["parts"] == 3
+    assert {n: os.stat(parts_dir / n).st_mtime_ns for n in (first[0], first[2])} == \
+        {n: mtimes[n] for n in (first[0], first[2])}
+    assert query_measurements("LVEF", "<", 30, index_dir=str(index_dir))["case_id"].tolist() == ["p1"]
+
+    # 超过 INDEX_MAX_PARTS 时合并为一个分片
+    _write_case(cache_dir, "p3", [["左心房内径(LA)", "", "", "", "35", "mm"]])
+    stats = build_measurement_index(str(cache_dir), str(index_dir))
+    assert stats["parts"] == 1 and stats["rows"] == 4
+    assert dict(zip(list_metrics(str(index_dir))["metric"], list_metrics(str(index_dir))["count"])) == \
+        {"LVEF": 3, "LA": 1}
+
+    # 未提交的分片文件（写入中断）被清理，其中的病例重新构建
+    (parts_dir / "part-orphan.parquet").write_bytes(b"")
+    assert build_measurement_index(str(cache_dir), str(index_dir))["added"] == 0
+    assert not (parts_dir / "part-orphan.parquet").exists()
+    assert compact_measurement_index(str(index_dir)) == 1
+
+    # 分片病例数有上限：全量构建按 INDEX_PART_CASES 分组，修改病例只重写所在分片
+    monkeypatch.setattr(query, "INDEX_PART_CASES", 2)
+    capped_dir = tmp_path / "capped"
+    assert build_measurement_index(str(cache_dir), str(capped_dir))["parts"] == 2
+    before = set(os.listdir(capped_dir / "parts"))
+    os.utime(cache_dir / "p3.parquet", ns=(2, 2))
+    stats = build_measurement_index(str(cache_dir), str(capped_dir))
+    assert stats["added"] == 1 and stats["rows"] == 4
+    assert len(before & set(os.listdir(capped_dir / "parts"))) == 3  # 另一个分片的三个文件未被重写
+
+
+def test_extract_report_date():
+    from medical_agent.utils import extract_report_date
+    text = "报告时间：2022-09-08 17:19:39\n检查日期：2022年9月7日 审核医师："
+    assert extract_report_date(text) == "2022-09-07"
+    assert extract_report_date("报告日期: 2023/4/15") == "2023-04-15"
+    assert extract_report_date("住院号：2022041478") is None
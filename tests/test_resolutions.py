@@ -0,0 +1,57 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent.resolutions import ResolutionStore, catalog_fingerprint, normalize_name
+
+
+def test_record_and_lookup(tmp_path):
+    store = ResolutionStore(str(tmp_path / "resolutions.db"))
+    catalog = catalog_fingerprint(["左心室射血分数(LVEF)"], ["lvef"])
+    name = normalize_name("EF（Teich）")
+    assert name == "ef(teich)"
+    # 限定词不同的项目互不影响
+    assert normalize_name("EF (Simpson)") != name
+    store.record_many("std", [
+        {"name": name, "target": "左心室射血分数(LVEF)", "source": "llm", "confidence": 0.86},
+        {"name": "某项目", "target": "", "source": "fuzzy", "confidence": 0.42},
+    ], catalog)
+
+    found = store.lookup_many("std", [name, "某项目", "未记录"], catalog)
+    assert found[name]["target"] == "左心室射血分数(LVEF)" and found[name]["hits"] == 0
+    assert set(found) == {name, "某项目"}
+    assert store.entries(name=name)[0]["hits"] == 1
+    # 阶段互不影响
+    assert store.lookup_many("kb", [name], catalog) == {}
+
+    # 名称集合变化后“无匹配”的记录失效，有匹配的记录保留
+    changed = catalog_fingerprint(["左心室射血分数(LVEF)", "某项目"], ["lvef"])
+    assert set(store.lookup_many("std", [name, "某项目"], changed)) == {name}
+
+
+def test_manual_and_purge(tmp_path):
+    store = ResolutionStore(str(tmp_path / "resolutions.db"))
+    store.set_manual("kb", "ao", "主动脉根部内径")
+    store.record_many("kb", [{"name": "ao", "target": "", "source": "llm", "confidence": 0.85},
+                             {"name": "la", "target": "左房内径", "source": "fuzzy", "confidence": 0.93}], "c1")
+    # 自动结论不覆盖人工指定
+    assert store.lookup_many("kb", ["ao"], "c2")["ao"]["target"] == "主动脉根部内径"
+    assert store.counts() == {"kb/manual": 1, "kb/fuzzy": 1}
+
+    assert store.purge(source="fuzzy") == 1
+    assert store.purge(older_than=1) == 0
+    assert [e["name"] for e in store.entries()] == ["ao"]
+
+
+def test_old_keys_dropped(tmp_path):
+    path = str(tmp_path / "resolutions.db")
+    store = ResolutionStore(path)
+    store.set_manual("std", "ef", "左心室射血分数(LVEF)")
+    store.record_many("std", [{"name": "ef", "target": "左心室射血分数(LVEF)", "source": "llm", "confidence": 0.9},
+                              {"name": "la", "target": "左房内径", "source": "fuzzy", "confidence": 0.93}], "c1")
+    # 旧版本的数据库（键去掉了限定词）：重新打开时自动结论作废，人工指定保留
+    with sqlite3.connect(path) as conn:
+        conn.execute("PRAGMA user_version = 0")
+    assert ResolutionStore(path).counts() == {"std/manual": 1}
@@ -0,0 +1,129 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent import retrieval
+from medical_agent.retrieval import ReportIndex, item_aliases, parse_segment
+
+CTA_TEXT = """CT检查报告单
+检查项目：256排冠状动脉CTA
+检查所见：
+冠状动脉呈右优势型。左主干起源于左窦，右冠状动脉起源于右窦。
+左主干管壁可见钙化斑块，管腔轻微狭窄约10%。左前降支近段管壁可见钙化斑块，管腔轻度狭窄约25%；中段管壁可见混合斑块，管腔重度狭窄约85%。
+左回旋支中远段管壁可见非钙化斑块，管腔轻度狭窄约25%；近段未见斑块及明显狭窄。第一，第二钝缘支未见斑块及明显狭窄。
+右冠状动脉近段管壁可见钙化、非钙化斑块，管腔轻度狭窄约25%；中段、远段未见斑块及明显狭窄。右后降支未见斑块及明显狭窄。
+心脏各腔室不大，心肌未见异常密度影。
+左心房内径(LA) 36mm  左心室射血分数(LVEF) 62%
+"""
+
+
+def test_item_aliases():
+    assert {"左前降支中段", "mLAD", "前降支", "LAD"} <= item_aliases("左前降支中段(mLAD)")
+    kb = ({"tapse": "三尖瓣环收缩期位移"}, {"三尖瓣环收缩期位移": {"测量值简写": "TAPSE", "别名": ["三尖瓣环位移"]}})
+    assert "三尖瓣环位移" in item_aliases("三尖瓣环收缩期位移(TAPSE)", kb)
+
+
+def test_context_for(monkeypatch):
+    monkeypatch.setattr(retrieval, "RETRIEVAL_HEADER_LINES", 2)
+    index = ReportIndex(CTA_TEXT)
+
+    # 省略主语的“中段……”随血管所在的整句一起返回
+    context, excerpt = index.context_for("左前降支中段(mLAD)")
+    assert excerpt
+    assert context.startswith("CT检查报告单\n检查项目：256排冠状动脉CTA")
+    assert "中段管壁可见混合斑块，管腔重度狭窄约85%" in context
+    assert "左回旋支" not in context and "右冠状动脉" not in context
+
+    # 缩写按整词匹配："LA" 不命中 "LAD"
+    context, _ = index.context_for("左心房内径(LA)")
+    assert "36mm" in context and "前降支" not in context
+
+    # 没有语句提到该项目时只保留头部
+    context, excerpt = index.context_for("二尖瓣反流峰值速度(MR peak Vel)")
+    assert excerpt and context == index.header
+
+    # 摘录接近全文时直接发送全文
+    monkeypatch.setattr(retrieval, "RETRIEVAL_MAX_FRACTION", 0.0)
+    assert index.context_for("左主干(LM)") == (CTA_TEXT, False)
+
+
+def test_mention_status():
+    index = ReportIndex("冠状动脉钙化积分：LM 12，LAD 86，LCX 0，RCA 35。\n" + CTA_TEXT)
+    assert parse_segment("左前降支近段(pLAD)") == ("前降支", {"近"}, None)
+    assert parse_segment("第二钝缘支(OM2)") == ("钝缘支", set(), "2")
+    assert parse_segment("左心房内径(LA)") is None
+
+    expected = {
+        "左主干(LM)": "positive",
+        "左前降支中段(mLAD)": "positive",
+        "左前降支远段(dLAD)": "absent",        # 钙化积分行不算提及
+        "左回旋支近段(pLCX)": "negative",
+        "左回旋支远段(dLCX)": "positive",      # “中远段”
+        "第二钝缘支(OM2)": "negative",
+        "第一对角支(D1)": "absent",
+        "右冠状动脉中段(mRCA)": "negative",    # “中段、远段未见斑块及明显狭窄”沿用句首血管
+        "右后降支(PDA)": "negative",
+        "左心房内径(LA)": "positive",
+        "二尖瓣反流峰值速度(MR peak Vel)": "absent",
+    }
+    assert {name: index.mention_status(name) for name in expected} == expected
+
+
+LABEL_LAYOUT = """CT检查报告单
+检查项目：256排冠状动脉CTA
+检查所见：
+左前降支：
+近段：未见斑块及明显狭窄
+中段：管壁可见混合斑块，狭窄约85%
+左回旋支：
+近段：管壁可见钙化斑块，狭窄约25%
+印象：
+中段狭窄。
+"""
+
+PERIOD_LAYOUT = """CT检查报告单
+检查项目：256排冠状动脉CTA
+检查所见：
+左前降支近段管壁可见钙化斑块，管腔轻度狭窄约25%。中段管壁可见混合斑块，管腔重度狭窄约85%。远段未见斑块及明显狭窄。
+右冠状动脉未见斑块及明显狭窄。
+心脏各腔室不大，心肌未见异常密度影，心包未见积液，主动脉未见扩张。
+"""
+
+
+def test_subject_carried_across_lines_and_sentences(monkeypatch):
+    monkeypatch.setattr(retrieval, "RETRIEVAL_HEADER_LINES", 2)
+    monkeypatch.setattr(retrieval, "RETRIEVAL_MAX_FRACTION", 1.0)
+
+    # 血管标签行下的节段行
+    index = ReportIndex(LABEL_LAYOUT)
+    assert index.mention_status("左前降支近段(pLAD)") == "negative"
+    assert index.mention_status("左前降支中段(mLAD)") == "positive"
+    assert index.mention_status("左回旋支近段(pLCX)") == "positive"
+    assert index.mention_status("左回旋支中段(mLCX)") == "absent"     # “印象：”之后不再沿用
+    context, _ = index.context_for("左前降支中段(mLAD)")
+    assert "左前降支：\n" in context and "中段：管壁可见混合斑块，狭窄约85%" in context
+    assert "左回旋支" not in context
+
+    # 句号分隔的节段句
+    index = ReportIndex(PERIOD_LAYOUT)
+    assert index.mention_status("左前降支中段(mLAD)") == "positive"
+    assert index.mention_status("左前降支远段(dLAD)") == "negative"
+    assert index.mention_status("右冠状动脉中段(mRCA)") == "negative"
+    context, excerpt = index.context_for("左前降支中段(mLAD)")
+    assert excerpt and "管腔重度狭窄约85%" in context and "心包" not in context
+
+    # 找不到描述该节段的句子时发送全文
+    assert index.context_for("第一对角支(D1)") == (PERIOD_LAYOUT, False)
+
+
+def test_findings_in_header_lines():
+    # 换行很少的 OCR / 粘贴文本：所见落在头部的前几行里
+    text = ("冠脉CTA报告\n检查项目：冠状动脉CTA\n姓名：某某\n"
+            "左前降支近段管壁可见钙化斑块，管腔轻度狭窄约25%；中段管壁可见混合斑块，管腔重度狭窄约85%\n")
+    index = ReportIndex(text)
+    assert "85%" in index.header
+    assert index.mention_status("左前降支近段(pLAD)") == "positive"
+    assert index.mention_status("左前降支中段(mLAD)") == "positive"
+    # 节段自身的写法出现但无法归入分句时按阳性处理
+    assert ReportIndex("钙化积分：前降支中段 86").mention_status("左前降支中段(mLAD)") == "positive"
@@ -0,0 +1,105 @@
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent.service import DONE, FAILED, QUEUED, RUNNING, JobQueue, WorkerPool, create_server
+
+
+def crashing_worker(worker_name, db_path, stop_event):
+    """领取一个任务后进程直接退出（模拟处理中崩溃）"""
+    queue = JobQueue(db_path)
+    while not stop_event.is_set():
+        if queue.claim(worker_name) is not None:
+            os._exit(1)
+        stop_event.wait(0.05)
+
+
+def exiting_worker(worker_name, db_path, stop_event):
+    """不领取任务直接退出"""
+
+
+def test_job_queue_lifecycle(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), max_attempts=2)
+    first = queue.submit("pdf", "/tmp/a.pdf", "a.pdf")
+    second = queue.submit("text", "/tmp/b.txt", "b.txt")
+
+    job = queue.claim("worker-0")
+    assert job["id"] == first and job["status"] == RUNNING and job["attempts"] == 1
+    assert queue.claim("worker-1")["id"] == second
+    assert queue.claim("worker-1") is None
+
+    # 第一次失败重新排队，达到最大尝试次数后标记失败
+    assert queue.fail(first, "timeout") == QUEUED
+    assert queue.claim("worker-0")["attempts"] == 2
+    assert queue.fail(first, "timeout") == FAILED
+    queue.complete(second)
+    assert queue.get(second)["status"] == DONE
+
+    # 重启时 running 任务重新排队
+    third = queue.submit("jpg", "/tmp/c.jpg")
+    queue.claim("worker-0")
+    assert queue.requeue_running() == 1
+    assert queue.get(third)["status"] == QUEUED
+    assert queue.counts() == {QUEUED: 1, RUNNING: 0, DONE: 1, FAILED: 1}
+
+
+def test_http_submit_and_status(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    server = create_server(queue, "127.0.0.1", 0, upload_dir=str(tmp_path / "uploads"))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        request = urllib.request.Request(f"{base}/jobs?kind=text&name=report.txt",
+                                         data="左室射血分数 60%".encode("utf-8"), method="POST")
+        with urllib.request.urlopen(request) as response:
+            assert response.status == 202
+            job_id = json.load(response)["job_id"]
+
+        with urllib.request.urlopen(f"{base}/jobs/{job_id}") as response:
+            assert json.load(response)["status"] == QUEUED
+        with open(queue.get(job_id)["source_path"], encoding="utf-8") as f:
+            assert f.read() == "左室射血分数 60%"
+
+        try:
+            urllib.request.urlopen(f"{base}/jobs/{job_id}/result")
+            assert False, "未完成的任务不应返回结果"
+        except urllib.error.HTTPError as e:
+            assert e.code == 409
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_worker_crash_requeues_job(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    queue = JobQueue(db_path, max_attempts=2)
+    job_id = queue.submit("text", "/tmp/a.txt", "a.txt")
+    pool = WorkerPool(1, db_path, target=crashing_worker)
+    pool.processes = [pool._spawn(0)]
+    try:
+        pool.processes[0].join(10)
+        assert queue.get(job_id)["status"] == RUNNING
+        # 重新拉起的 worker 不领取任务，便于检查重新排队后的状态
+        pool.target = exiting_worker
+        assert pool.check_workers() == 1
+        job = queue.get(job_id)
+        assert (job["status"], job["worker"], job["attempts"]) == (QUEUED, None, 1)
+        assert "worker 进程退出" in job["error"]
+
+        # 再次崩溃时已达到最大尝试次数，标记失败
+        pool.target = crashing_worker
+        pool.processes[0].join(10)
+        assert pool.check_workers() == 1
+        pool.processes[0].join(10)
+        assert pool.check_workers() == 1
+        job = queue.get(job_id)
+        assert (job["status"], job["attempts"]) == (FAILED, 2)
+        assert queue.counts()[RUNNING] == 0
+    finally:
+        pool.stop(timeout=5)
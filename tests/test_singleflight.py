@@ -0,0 +1,80 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent import tracing
+from medical_agent.llm import chat_completion, usage_scope
+from medical_agent.singleflight import SingleFlight
+from medical_agent.tracing import with_context
+
+
+class SlowClient:
+    """请求在 release 之前一直挂起，记录实际发出的请求数"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.requests = 0
+        self.release = threading.Event()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, timeout=None, response_format=None):
+        self.requests += 1
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=10, prompt_tokens_details=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="LVEF"))], usage=usage)
+
+
+def test_coalesce_identical_requests(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(tmp_path / "trace.jsonl"))
+    monkeypatch.setenv("HEDGE", "0")
+    client = SlowClient()
+    messages = [{'role': 'user', 'content': '左室射血分数对应哪一项'}]
+
+    with usage_scope() as ledger:
+        def call():
+            return chat_completion(client, "qwen-max", messages, kind="alias").choices[0].message.content
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(with_context(call)) for _ in range(4)]
+            time.sleep(0.2)
+            client.release.set()
+            assert [f.result() for f in futures] == ["LVEF"] * 4
+
+    assert client.requests == 1
+    bucket = ledger.to_dict()["by_prompt"]["alias"]
+    assert (bucket["calls"], bucket["coalesced"], bucket["prompt_tokens"]) == (1, 3, 100)
+
+    # 请求返回后不保留结果：之后的相同请求重新发出
+    chat_completion(client, "qwen-max", messages, kind="alias")
+    assert client.requests == 2
+
+
+def test_error_propagates_to_followers():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        release.wait(5)
+        raise TimeoutError("upstream timeout")
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(flights.do, "key", fail, "ocr") for _ in range(3)]
+        time.sleep(0.2)
+        release.set()
+        for future in futures:
+            with pytest.raises(TimeoutError):
+                future.result()
+
+    assert len(calls) == 1
+    assert flights.snapshot() == {"ocr": {"leaders": 1, "coalesced": 2}}
+    assert flights.in_flight() == 0
@@ -0,0 +1,35 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+
+# 批量入口的导入时间预算（秒），CI 机器较慢时可通过环境变量放宽
+STARTUP_BUDGET_S = float(os.getenv('STARTUP_BUDGET_S', 3.0))
+# 批量处理不应在导入时加载的模块
+LAZY_MODULES = ["langchain", "langchain_openai", "langgraph", "tkinter", "openai", "pydantic", "orjson"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+@pytest.mark.parametrize("module", ["batch_pdf_import", "batch_jpg_import", "text_extract"])
+def test_entry_point_import_budget(module):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([SRC_DIR, os.path.join(SRC_DIR, "medical_agent")])
+    env.pop("DISPLAY", None)  # 模拟无头主机
+    result = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(module=module, lazy=LAZY_MODULES)],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    assert report["loaded"] == [], f"{module} 导入时加载了 {report['loaded']}"
+    assert report["seconds"] < STARTUP_BUDGET_S, f"{module} 导入耗时 {report['seconds']:.2f}s"
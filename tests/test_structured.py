@@ -0,0 +1,81 @@
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent import structured, tracing
+from medical_agent.llm import json_completion, usage_scope
+from medical_agent.structured import parse_response, repair_json
+
+SEGMENT = '{"斑块种类": "钙化", "类型": "-", "症状": "-", "数值": "25%", "狭窄程度": "局限性狭窄", "闭塞": "否"}'
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeClient:
+    """按顺序返回预设文本（或抛出异常），记录每次请求的 response_format"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.formats = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, timeout=None, response_format=None):
+        self.formats.append(response_format)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=outcome))], usage=None)
+
+
+def test_repair_json():
+    assert parse_response(SEGMENT, "segment")[1] == "ok"
+    # 代码块、说明文字、照抄的注释、单引号、Python 字面量、尾逗号
+    text = "结果如下：\n```json\n{'key_name': '冠脉优势型', # 固定\n 'result': '右冠优势型', 'reason': None,}\n```"
+    assert parse_response(text, "cta_category") == (
+        {"key_name": "冠脉优势型", "result": "右冠优势型", "reason": None}, "repaired")
+    # 截断：丢弃不完整的值（“轻度狭窄”只剩“轻”时不能当作结果）
+    assert repair_json('{"LM": "钙化", "LAD": "轻') == '{"LM": "钙化"}'
+    assert repair_json('{"LM": "钙化", "LAD": [1, 2') == '{"LM": "钙化", "LAD": [1, 2]}'
+
+
+def test_schema_validation():
+    assert parse_response('{"report_type": "CT"}', "classifier") == ({"report_type": "CT"}, "invalid")
+    truncated = SEGMENT[:SEGMENT.index(', "闭塞"')] + ', "闭塞": "'
+    data, status = parse_response(truncated, "segment")
+    assert status == "invalid" and "闭塞" not in data
+    assert parse_response("没有找到", "alias") == (None, "failed")
+    assert parse_response('{"任意": "键"}', "cta_gapfill")[1] == "ok"
+
+
+def test_json_completion_rerequest(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(tmp_path / "trace.jsonl"))
+    messages = [{'role': 'user', 'content': '只返回JSON'}]
+    client = FakeClient(['```json\n' + SEGMENT[:-1] + ',}\n```', '无法判断', SEGMENT])
+
+    with usage_scope() as ledger:
+        assert json_completion(client, "qwen-max", messages, kind="segment")["数值"] == "25%"
+        assert json_completion(client, "qwen-max", messages, kind="segment")["闭塞"] == "否"
+
+    bucket = ledger.to_dict()["by_prompt"]["segment"]
+    assert (bucket["calls"], bucket["repaired"], bucket["parse_failures"], bucket["retries"]) == (3, 1, 1, 1)
+    assert client.formats == [{"type": "json_object"}] * 3
+
+
+def test_json_mode_fallback(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(tmp_path / "trace.jsonl"))
+    monkeypatch.setattr(structured, "_json_mode_unsupported", set())
+    client = FakeClient([StatusError(400, "response_format is not supported"), '{"match": "LVEF"}',
+                         '{"match": "E/A"}'])
+    messages = [{'role': 'user', 'content': '仅返回严格 JSON'}]
+
+    assert json_completion(client, "local-model", messages, kind="key_pick") == {"match": "LVEF"}
+    assert json_completion(client, "local-model", messages, kind="key_pick") == {"match": "E/A"}
+    # 被拒绝后不再发送 response_format；没有提到 JSON 的提示词从不发送
+    assert client.formats == [{"type": "json_object"}, None, None]
+    assert structured.response_format_for([{'role': 'user', 'content': '判断类型'}]) is None
@@ -0,0 +1,48 @@
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent import tracing
+from medical_agent.tracing import span, summarize_spans, trace_spans, with_context
+
+
+def test_nested_spans_across_threads(tmp_path, monkeypatch):
+    trace_file = tmp_path / "trace.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(trace_file))
+
+    def call(location):
+        with span("llm.segment", prompt="FILLIN_PROMPT_5", location=location):
+            if location == "bad":
+                raise RuntimeError("boom")
+            return location
+
+    with span("file", file="a.pdf") as root:
+        with span("fill_form.segments"), ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(with_context(call), loc) for loc in ("LAD", "RCA", "bad")]
+        with pytest.raises(RuntimeError):
+            futures[2].result()
+        root.set(ok=False)
+
+    records = trace_spans(root.trace_id)
+    by_name = {}
+    for record in records:
+        by_name.setdefault(record["name"], []).append(record)
+
+    # 线程池中的调用挂在 fill_form.segments 之下，属于同一条 trace
+    stage = by_name["fill_form.segments"][0]
+    assert stage["parent_id"] == root.span_id
+    assert len(by_name["llm.segment"]) == 3
+    assert all(r["parent_id"] == stage["span_id"] for r in by_name["llm.segment"])
+    assert by_name["file"][0]["ok"] is False
+
+    summary = summarize_spans(records)
+    assert summary["llm.segment"]["count"] == 3
+    assert summary["llm.segment"]["errors"] == 1
+
+    lines = [json.loads(line) for line in trace_file.read_text(encoding="utf-8").splitlines()]
+    assert {r["span_id"] for r in lines} == {r["span_id"] for r in records}
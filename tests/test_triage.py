@@ -0,0 +1,73 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent import pdf_ocr, tracing
+from medical_agent.triage import PAGE_BLANK, PAGE_CONTENT, PAGE_LOW_INFO, preprocess_and_triage, skip_ocr
+
+
+def test_page_triage():
+    rng = np.random.default_rng(0)
+    height, width = 1600, 1130
+
+    # 扫描背面：只有轻微噪声
+    blank = (245 + rng.integers(0, 4, (height, width))).astype(np.uint8)
+
+    # 二维码页：一小块随机方格
+    qr = np.full((height, width), 250, np.uint8)
+    modules = rng.integers(0, 2, (25, 25)).astype(bool)
+    qr[100:350, 100:350][np.kron(modules, np.ones((10, 10), bool))] = 0
+
+    # 正文页
+    content = np.full((height, width), 250, np.uint8)
+    for y in range(100, height - 100, 45):
+        cv2.putText(content, "LVEF 59%  LVEDD 42mm  IVSd 8mm", (60, y), cv2.FONT_HERSHEY_SIMPLEX, 1.0, 20, 2)
+
+    assert preprocess_and_triage(blank)[1]["label"] == PAGE_BLANK
+    assert preprocess_and_triage(qr)[1]["label"] == PAGE_LOW_INFO
+    binary, decision = preprocess_and_triage(content)
+    assert decision["label"] == PAGE_CONTENT
+    assert binary.shape == content.shape
+
+
+def test_short_conclusion_page_is_ocred():
+    # 第2页只有一行结论：特征上可能与二维码页一样是低信息页，但不能跳过
+    conclusion = np.full((1600, 1130), 250, np.uint8)
+    cv2.putText(conclusion, "Impression: LAD stenosis 85%", (60, 150), cv2.FONT_HERSHEY_SIMPLEX, 1.0, 20, 2)
+    decision = preprocess_and_triage(conclusion)[1]
+    assert decision["label"] != PAGE_BLANK
+    assert not skip_ocr(decision, 2)
+
+    assert skip_ocr({"label": PAGE_LOW_INFO}, 1)
+    assert skip_ocr({"label": PAGE_BLANK}, 3)
+    assert not skip_ocr({"label": PAGE_CONTENT}, 1)
+
+
+def test_ocr_pdf_pages_skips_blank_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(tmp_path / "trace.jsonl"))
+    monkeypatch.setattr(pdf_ocr, "record_triage", lambda *args: None)
+    blank = np.full((1600, 1130), 248, np.uint8)
+    content = np.full((1600, 1130), 250, np.uint8)
+    for y in range(100, 1500, 45):
+        cv2.putText(content, "LVEF 59%  LVEDD 42mm  IVSd 8mm", (60, y), cv2.FONT_HERSHEY_SIMPLEX, 1.0, 20, 2)
+
+    calls = []
+
+    def fake_ocr(image, page_no, file_name, state_context=None):
+        calls.append((page_no, state_context))
+        return f"page {page_no}"
+
+    monkeypatch.setattr(pdf_ocr, "ocr_page_image", fake_ocr)
+    monkeypatch.setattr(pdf_ocr, "pdf_to_gray_arrays", lambda path: [content, blank, content])
+    context = {"current_file_name": "a.pdf"}
+    assert pdf_ocr.ocr_pdf_pages("a.pdf", "a.pdf", context) == ["=== 第1页 ===\npage 1", "=== 第3页 ===\npage 3"]
+    assert calls == [(1, context), (3, context)]
+
+    # 所有页面都被跳过时对其中一页 OCR 兜底
+    calls.clear()
+    monkeypatch.setattr(pdf_ocr, "pdf_to_gray_arrays", lambda path: [blank, blank])
+    assert len(pdf_ocr.ocr_pdf_pages("b.pdf", "b.pdf")) == 1 and len(calls) == 1
@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from medical_agent.watcher import FolderWatcher, WatchState, iter_report_files
+
+
+def test_watch_folder_incremental(tmp_path, monkeypatch):
+    monkeypatch.setenv("DEDUP", "0")
+    root = tmp_path / "incoming"
+    (root / "2024" / "05").mkdir(parents=True)
+    (root / "2024" / "05" / "a.pdf").write_bytes(b"%PDF-1.4 a")
+    (root / "b.JPG").write_bytes(b"jpeg b")
+    (root / "notes.txt").write_text("x")
+    (root / ".hidden.pdf").write_bytes(b"x")
+    (root / "c.pdf.part").write_bytes(b"x")
+    assert sorted(e.name for e in iter_report_files(str(root))) == ["a.pdf", "b.JPG"]
+
+    dispatched = []
+
+    def dispatch(path, kind, output_name):
+        dispatched.append((os.path.basename(path), kind))
+        return "done", None
+
+    state = WatchState(str(tmp_path / "state.db"))
+    watcher = FolderWatcher(str(root), state, dispatch, settle_seconds=10)
+
+    # 第一次看到时等待稳定，稳定时间过后才分发
+    assert watcher.scan(now=1000)["waiting"] == 2
+    assert watcher.scan(now=1005)["dispatched"] == 0
+    assert watcher.scan(now=1011)["dispatched"] == 2
+    assert sorted(dispatched) == [("a.pdf", "pdf"), ("b.JPG", "jpg")]
+
+    # 未变化的文件不再处理；仍在增长的文件等到大小稳定后再处理
+    assert watcher.scan(now=1020)["unchanged"] == 2
+    growing = root / "2024" / "05" / "a.pdf"
+    growing.write_bytes(b"%PDF-1.4 a, updated")
+    assert watcher.scan(now=1030)["waiting"] == 1
+    growing.write_bytes(b"%PDF-1.4 a, updated and longer")
+    assert watcher.scan(now=1035)["waiting"] == 1
+    assert watcher.scan(now=1046)["dispatched"] == 1
+    assert dispatched[-1] == ("a.pdf", "pdf")
+
+    # 只改 mtime、内容不变：不重新处理
+    b = root / "b.JPG"
+    os.utime(b, (2_000_000_000, 2_000_000_000))
+    watcher.scan(now=1050)
+    stats = watcher.scan(now=1061)
+    assert stats["dispatched"] == 0 and stats["unchanged"] == 2
+    assert state.counts() == {"done": 2}
+    state.close()